@@ -0,0 +1,60 @@
+import logging
+
+# Значение admins.class_access для доступа ко всем классам; иначе классы берутся из admin_classes
+ALL = "all"
+
+
+# Запись прав администратора (вызывать внутри транзакции). classes=None — все классы
+def grant(conn, user_id: int, username: str, classes=None):
+    conn.execute("INSERT OR REPLACE INTO admins (user_id, username, class_access) VALUES (?, ?, ?)",
+                 (user_id, username, ALL if classes is None else None))
+    conn.execute("DELETE FROM admin_classes WHERE user_id = ?", (user_id,))
+    conn.executemany("INSERT INTO admin_classes (user_id, class) VALUES (?, ?)",
+                     [(user_id, class_name) for class_name in sorted(classes or ())])
+
+
+# Права администраторов в памяти: user_id -> None (все классы) или frozenset классов.
+# Загружаются один раз при запуске и обновляются при каждой записи, поэтому проверка
+# доступа в обработчиках — поиск в словаре и множестве без обращения к базе
+class AccessControl:
+    def __init__(self, owners):
+        # Главные администраторы: все классы и управление ботом
+        self.owners = frozenset(owners)
+        self._access = {}
+
+    # Чтение таблиц admins и admin_classes (выполняется в потоке пула базы)
+    def load(self, conn):
+        access = {}
+        for user_id, class_access in conn.execute("SELECT user_id, class_access FROM admins"):
+            access[user_id] = None if class_access == ALL else set()
+        for user_id, class_name in conn.execute("SELECT user_id, class FROM admin_classes"):
+            if access.get(user_id) is not None:
+                access[user_id].add(class_name)
+        self._access = {user_id: None if classes is None else frozenset(classes)
+                        for user_id, classes in access.items()}
+        logging.info(f"Загружены права {len(self._access)} администраторов.")
+
+    def set(self, user_id: int, classes=None):
+        self._access[user_id] = None if classes is None else frozenset(classes)
+
+    def is_owner(self, user_id: int) -> bool:
+        return user_id in self.owners
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.owners or user_id in self._access
+
+    # None — доступны все классы, иначе множество доступных (пустое для не-администратора)
+    def classes(self, user_id: int):
+        if user_id in self.owners:
+            return None
+        return self._access.get(user_id, frozenset())
+
+    def can_view(self, user_id: int, class_name: str) -> bool:
+        if user_id in self.owners:
+            return True
+        classes = self._access.get(user_id, frozenset())
+        return classes is None or class_name in classes
+
+    def report(self) -> str:
+        scoped = sum(classes is not None for classes in self._access.values())
+        return f"👤 Администраторов: главных {len(self.owners)}, всех классов {len(self._access) - scoped}, по классам {scoped}"
@@ -0,0 +1,545 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import zipfile
+import threading
+import itertools
+from collections import namedtuple
+
+from storage import LocalStorage
+
+# Максимальный размер одной части архива (Bot API принимает документы до 50 МБ)
+PART_LIMIT = int(os.environ.get("ARCHIVE_PART_LIMIT_MB", "45")) * 1024 * 1024
+# Квота на диске для архивов: готовые части в кэше плюс собираемые прямо сейчас
+CACHE_LIMIT = int(os.environ.get("ARCHIVE_CACHE_MB", "2048")) * 1024 * 1024
+# Как часто уборщик проверяет temp_zip и через сколько удаляются забытые временные файлы
+JANITOR_INTERVAL = int(os.environ.get("ARCHIVE_JANITOR_INTERVAL", "600"))
+TEMP_MAX_AGE = int(os.environ.get("ARCHIVE_TEMP_MAX_AGE", "3600"))
+# Запас на локальный заголовок, запись центрального каталога и zip64-расширения одного файла
+_ENTRY_OVERHEAD = 30 + 46 + 64
+_END_OVERHEAD = 22 + 56 + 20
+# Сколько файлов хранилища проверяется одним запросом reader.stats
+STAT_BATCH = 64
+
+ArchivePart = namedtuple("ArchivePart", "path number is_last files")
+
+
+# Архив не помещается в квоту даже после вытеснения старых архивов из кэша
+class QuotaExceeded(Exception):
+    pass
+
+
+def _entry_size(size: int, arcname: str) -> int:
+    return size + _ENTRY_OVERHEAD + 2 * len(arcname.encode("utf-8"))
+
+
+# Файлы, которые кладутся в архив: для каждой пары (путь, имя в архиве) — вариант resolve(путь),
+# если он есть в хранилище, иначе сам путь. Размеры запрашиваются пачками по STAT_BATCH
+# (у S3 — параллельно). Выдаёт (путь, (размер, mtime) или None, имя в архиве).
+# prefetch=True — найденные файлы пачки объявляются reader'у для заблаговременного чтения
+def _picked(reader, entries, resolve=None, prefetch=False):
+    entries = iter(entries)
+    while True:
+        batch = list(itertools.islice(entries, STAT_BATCH))
+        if not batch:
+            return
+        keys = [path for path, _ in batch]
+        if resolve is not None:
+            keys += [resolve(path) for path, _ in batch]
+        stats = reader.stats(keys)
+        picked = []
+        for i, (path, name) in enumerate(batch):
+            if resolve is not None and stats[len(batch) + i] is not None:
+                picked.append((keys[len(batch) + i], stats[len(batch) + i], name))
+            else:
+                picked.append((path, stats[i], name))
+        if prefetch:
+            reader.prefetch([(path, stat[0]) for path, stat, _ in picked if stat is not None])
+        yield from picked
+
+
+# Запись архива частями (выполняется в потоке). JPEG почти не сжимаются, поэтому
+# файлы кладутся без сжатия, и размер каждой части известен заранее.
+# entries — пары (ключ в хранилище, имя в архиве); байты читаются через reader
+# (storage.Storage.reader) частями, так что файл не обязан лежать на этом диске
+def _write_parts(entries, base_path: str, limit: int, emit, cancelled: threading.Event, start=None,
+                 reader=None, resolve=None):
+    reader = reader or LocalStorage().reader()
+    zf = None
+    number = 0
+    size = 0
+    files = 0
+    part_path = None
+    # Дозапись в уже существующую последнюю часть
+    if start is not None:
+        part_path, number, files = start.path, start.number, start.files
+        zf = zipfile.ZipFile(part_path, "a", compression=zipfile.ZIP_STORED, allowZip64=True)
+        size = os.path.getsize(part_path)
+    try:
+        for path, stat, arcname in _picked(reader, entries, resolve, prefetch=True):
+            if cancelled.is_set():
+                break
+            if stat is None:
+                logging.warning(f"Файл {path} не найден, пропускаю при архивации.")
+                continue
+            file_size, mtime = stat
+            entry_size = _entry_size(file_size, arcname)
+            if zf is not None and size + entry_size + _END_OVERHEAD > limit:
+                zf.close()
+                emit(ArchivePart(part_path, number, False, files))
+                zf = None
+            if zf is None:
+                number += 1
+                part_path = f"{base_path}_part{number}.zip"
+                zf = zipfile.ZipFile(part_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+                size = 0
+            if entry_size + _END_OVERHEAD > limit:
+                logging.warning(f"Файл {path} больше лимита части архива, он будет отправлен отдельной частью.")
+            info = zipfile.ZipInfo(arcname, time.localtime(max(mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = file_size
+            with zf.open(info, "w") as target:
+                reader.copy(path, target)
+            size += entry_size
+            files += 1
+        if zf is not None:
+            zf.close()
+            if cancelled.is_set():
+                os.remove(part_path)
+            else:
+                emit(ArchivePart(part_path, number, True, files))
+            zf = None
+    finally:
+        reader.close()
+        if zf is not None:
+            zf.close()
+            os.remove(part_path)
+        emit(None)
+
+
+# Асинхронный генератор частей архива: архив собирается в пуле потоков,
+# каждая часть отдаётся сразу, как только она закрыта
+async def build_zip_parts(entries, base_path: str, limit: int = PART_LIMIT, start: ArchivePart = None,
+                          storage=None, resolve=None):
+    loop = asyncio.get_running_loop()
+    reader = (storage or LocalStorage()).reader(loop)
+    parts = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def emit(item):
+        loop.call_soon_threadsafe(parts.put_nowait, item)
+
+    builder = loop.run_in_executor(None, _write_parts, entries, base_path, limit, emit, cancelled, start,
+                                   reader, resolve)
+    finished = False
+    try:
+        while True:
+            part = await parts.get()
+            if part is None:
+                finished = True
+                break
+            yield part
+        await builder
+    finally:
+        if not finished:
+            cancelled.set()
+            await asyncio.wait([builder])
+            while not parts.empty():
+                part = parts.get_nowait()
+                if part is not None and os.path.exists(part.path):
+                    os.remove(part.path)
+
+
+# Имя файла в архиве относительно root; файлы вне root кладутся в корень архива
+def arcname(path: str, root: str) -> str:
+    relative = os.path.relpath(path, root)
+    return os.path.basename(path) if relative.startswith("..") else relative
+
+
+# Дайджесты манифеста целиком и его первых prefix строк. sources (см. _sources) — какой файл
+# реально попадает в архив для каждой строки, если архив собирается с resolve
+def _manifest_digests(rows, prefix: int, sources=None):
+    digest = hashlib.sha256()
+    prefix_digest = digest.hexdigest() if prefix == 0 else None
+    for i, (row_id, path, _) in enumerate(rows, start=1):
+        line = f"{row_id}:{path}" if sources is None else f"{row_id}:{path}:{sources[i - 1]}"
+        digest.update(f"{line}\n".encode("utf-8"))
+        if i == prefix:
+            prefix_digest = digest.hexdigest()
+    return prefix_digest, digest.hexdigest()
+
+
+# Для каждой строки манифеста — "ключ:размер" файла, который возьмёт сборка (вариант resolve
+# или оригинал), "" — файла нет. Архив, собранный, пока сжатых копий ещё не было, после их
+# появления получает другой дайджест и пересобирается, а не отдаётся из кэша
+def _sources(rows, resolve, reader):
+    return [f"{path}:{stat[0]}" if stat is not None else ""
+            for path, stat, _ in _picked(reader, ((path, name) for _, path, name in rows), resolve)]
+
+
+def _estimate(rows, resolve, reader) -> int:
+    size = _END_OVERHEAD
+    for _, stat, name in _picked(reader, ((path, name) for _, path, name in rows), resolve):
+        if stat is not None:
+            size += _entry_size(stat[0], name)
+    return size
+
+
+# Удаление файлов temp_zip, которые никому не нужны: вне каталога кэша — временные файлы
+# старше max_age. Файлы каталога кэша, которых нет в индексе и которые не относятся к идущей
+# сборке, не удаляются сразу, а возвращаются кандидатами (путь, размер, mtime): сборка могла
+# начаться, пока шёл обход, поэтому кандидаты ещё раз сверяются с заданиями в цикле событий
+def _sweep(temp_root: str, cache_root: str, keep, building, max_age: float):
+    removed = 0
+    freed = 0
+    candidates = []
+    now = time.time()
+    cache_root = os.path.abspath(cache_root)
+    for directory, _, names in os.walk(temp_root):
+        in_cache = os.path.abspath(directory) == cache_root
+        for name in names:
+            path = os.path.abspath(os.path.join(directory, name))
+            if in_cache:
+                if path in keep or name.startswith("index.json") or name.startswith(building):
+                    continue
+            try:
+                stat = os.stat(path)
+                if in_cache:
+                    candidates.append((path, stat.st_size, stat.st_mtime))
+                    continue
+                if now - stat.st_mtime < max_age:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            freed += stat.st_size
+    return removed, freed, candidates
+
+
+# Удаление кандидатов _sweep, которые с момента обхода не изменились (в изменённый файл кто-то пишет)
+def _remove_unchanged(candidates):
+    removed = 0
+    freed = 0
+    for path, size, mtime in candidates:
+        try:
+            if os.stat(path).st_mtime != mtime:
+                continue
+            os.remove(path)
+        except OSError:
+            continue
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+# Сборка одного архива, на которую подписываются все одновременные запросы с тем же
+# манифестом: части складываются в список, каждый подписчик читает его со своей позиции.
+# Задание живёт, пока не закончена сборка и не ушёл последний подписчик: до этого
+# файлы частей не удаляются и не перезаписываются другой сборкой того же ключа
+class ExportJob:
+    def __init__(self, digest: str, on_idle):
+        self.digest = digest
+        self.parts = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self._on_idle = on_idle
+        self._changed = asyncio.Condition()
+
+    @property
+    def idle(self) -> bool:
+        return self.done and not self.followers
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def add(self, part: ArchivePart):
+        self.parts.append(part)
+        await self._notify()
+
+    async def finish(self, error: Exception = None):
+        self.done = True
+        self.error = error
+        await self._release()
+
+    async def _release(self):
+        if self.idle:
+            self._on_idle(self)
+        await self._notify()
+
+    async def wait(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.idle)
+
+    async def follow(self):
+        self.followers += 1
+        position = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: position < len(self.parts) or self.done)
+                if position < len(self.parts):
+                    position += 1
+                    yield self.parts[position - 1]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+        finally:
+            self.followers -= 1
+            await self._release()
+
+
+# Постоянный кэш архивов. Ключ — имя выгрузки (класс, ученик, вся школа), содержимое
+# описывается манифестом: упорядоченным по id списком строк screenshots (id, ключ в хранилище, имя в архиве).
+# Файлы читаются из storage (диск или S3), готовые части архивов лежат на локальном диске.
+# Неизменившийся манифест отдаёт готовые части, дополненный — дописывает только новые файлы
+# в последнюю часть, любой другой — пересобирает архив. Одновременные запросы одного архива
+# получают части одной общей сборки. Место на диске ограничено квотой: перед сборкой
+# давно не использованные архивы вытесняются, пока новый не поместится.
+class ArchiveCache:
+    def __init__(self, root: str, max_bytes: int = CACHE_LIMIT, part_limit: int = PART_LIMIT, storage=None):
+        self.root = root
+        self.storage = storage or LocalStorage()
+        self.max_bytes = max_bytes
+        self.part_limit = part_limit
+        os.makedirs(root, exist_ok=True)
+        self._index_path = os.path.join(root, "index.json")
+        self._index = self._load_index()
+        # Индекс пишется через один временный файл: одновременные сохранения идут по очереди
+        self._index_lock = asyncio.Lock()
+        self._jobs = {}
+        self._tasks = set()
+        self._reserved = {}
+        self._janitor = None
+        self.merged = 0
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.error(f"Индекс кэша архивов повреждён, начинаю с пустого: {e}")
+            return {}
+
+    def _write_index(self, data: str):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self._index_path)
+
+    async def _save_index(self):
+        async with self._index_lock:
+            data = json.dumps(self._index, ensure_ascii=False)
+            await asyncio.to_thread(self._write_index, data)
+
+    def _base_path(self, key: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20])
+
+    def _drop(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry:
+            for path, _ in entry["parts"]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def used_bytes(self) -> int:
+        return sum(entry["size"] for entry in self._index.values()) + sum(self._reserved.values())
+
+    # Вытеснение давно не использованных архивов, пока занятое место вместе с need байтами
+    # не уложится в квоту; архивы, которые сейчас собираются, не трогаются
+    def _evict(self, keep: str = None, need: int = 0) -> bool:
+        total = self.used_bytes() + need
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep or key in self._jobs:
+                continue
+            total -= entry["size"]
+            self._drop(key)
+            logging.info(f"Архив {key} вытеснен из кэша.")
+        return total <= self.max_bytes
+
+    def _store(self, key: str, rows: int, digest: str, parts):
+        self._index[key] = {
+            "rows": rows,
+            "digest": digest,
+            "parts": [[part.path, part.files] for part in parts],
+            "size": sum(os.path.getsize(part.path) for part in parts),
+            "used": time.time(),
+        }
+        self._evict(keep=key)
+
+    # Части архива для ключа key; rows — полный манифест (id, ключ, имя в архиве).
+    # resolve(ключ) — вариант файла (например, сжатая копия), который кладётся вместо
+    # оригинала, если он есть в хранилище. С resolve наличие и размер вариантов проверяются
+    # (в потоке) и до сборки: они входят в дайджест архива
+    async def parts(self, key: str, rows, resolve=None):
+        sources = None
+        if resolve is not None:
+            sources = await asyncio.to_thread(_sources, rows, resolve, self.storage.reader())
+        digest = _manifest_digests(rows, 0, sources)[1]
+        while True:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._start(key, rows, resolve, sources, digest)
+                break
+            if job.digest == digest and not job.error:
+                self.merged += 1
+                logging.info(f"Архив {key}: присоединяюсь к уже идущей сборке.")
+                break
+            # Идёт сборка (или отправка) того же архива по другому манифесту: дождаться её, затем дописать
+            await job.wait()
+        async for part in job.follow():
+            yield part
+
+    def _start(self, key: str, rows, resolve, sources, digest: str) -> ExportJob:
+        job = ExportJob(digest, lambda done: self._jobs.pop(key, None) if self._jobs.get(key) is done else None)
+        self._jobs[key] = job
+        task = asyncio.create_task(self._run(job, key, rows, resolve, sources), name=f"archive-{key}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    # Сборка идёт в отдельной задаче и доводится до конца, даже если запросивший ушёл
+    async def _run(self, job: ExportJob, key: str, rows, resolve, sources):
+        error = None
+        try:
+            async for part in self._parts(key, rows, resolve, sources):
+                await job.add(part)
+        except asyncio.CancelledError:
+            error = RuntimeError("Сборка архива прервана остановкой бота")
+            raise
+        except QuotaExceeded as e:
+            error = e
+        except Exception as e:
+            logging.error(f"Ошибка сборки архива {key}: {e}")
+            error = e
+        finally:
+            self._reserved.pop(key, None)
+            await job.finish(error)
+
+    async def _parts(self, key: str, rows, resolve, sources):
+        entry = self._index.get(key)
+        if entry and not all(os.path.exists(path) for path, _ in entry["parts"]):
+            self._drop(key)
+            entry = None
+        cached_rows = entry["rows"] if entry and entry["rows"] <= len(rows) else 0
+        prefix_digest, digest = _manifest_digests(rows, cached_rows, sources)
+        cached = [ArchivePart(path, number, False, files)
+                  for number, (path, files) in enumerate(entry["parts"], start=1)] if entry else []
+
+        if entry and entry["rows"] == len(rows) and entry["digest"] == digest:
+            entry["used"] = time.time()
+            await self._save_index()
+            logging.info(f"Архив {key} отдан из кэша.")
+            for part in cached:
+                yield part._replace(is_last=part.number == len(cached))
+            return
+
+        start = None
+        new_rows = rows
+        appending = bool(entry and entry["digest"] == prefix_digest and cached)
+        if appending:
+            new_rows = rows[entry["rows"]:]
+        need = await asyncio.to_thread(_estimate, new_rows, resolve, self.storage.reader())
+        if not appending:
+            self._drop(key)
+        elif entry:
+            # Пока архив дописывается, его место учитывается в резерве
+            need += entry["size"]
+        self._index.pop(key, None)
+        if not self._evict(keep=key, need=need):
+            if appending:
+                self._index[key] = entry
+            raise QuotaExceeded(f"Архиву нужно {need // (1024 * 1024)} МБ, квота {self.max_bytes // (1024 * 1024)} МБ")
+        self._reserved[key] = need
+
+        if appending:
+            # Манифест только дополнился: отдаём готовые части и дописываем последнюю
+            start = cached.pop()
+            for part in cached:
+                yield part
+            logging.info(f"Архив {key}: дописываю {len(new_rows)} новых файлов.")
+        else:
+            cached = []
+            logging.info(f"Архив {key}: собираю заново ({len(rows)} файлов).")
+
+        built = list(cached)
+        completed = False
+        try:
+            entries = [(path, name) for _, path, name in new_rows]
+            async for part in build_zip_parts(entries, self._base_path(key), self.part_limit, start,
+                                              self.storage, resolve):
+                built.append(part)
+                yield part
+            completed = True
+        finally:
+            self._reserved.pop(key, None)
+            if completed:
+                self._store(key, len(rows), digest, built)
+                await self._save_index()
+            else:
+                for part in built:
+                    if os.path.exists(part.path):
+                        os.remove(part.path)
+
+    # Одна уборка temp_zip; при запуске (startup=True) обрывками считаются все файлы вне индекса
+    # Файлы частей из индекса и префиксы имён частей идущих сборок
+    def _in_use(self):
+        keep = {os.path.abspath(path) for entry in self._index.values() for path, _ in entry["parts"]}
+        building = tuple(os.path.basename(self._base_path(key)) for key in self._jobs)
+        return keep, building
+
+    async def sweep(self, temp_root: str, startup: bool = False):
+        keep, building = self._in_use()
+        removed, freed, candidates = await asyncio.to_thread(_sweep, temp_root, self.root, keep, building,
+                                                             0 if startup else TEMP_MAX_AGE)
+        # Сборки и индекс могли измениться за время обхода
+        keep, building = self._in_use()
+        candidates = [item for item in candidates
+                      if item[0] not in keep and not os.path.basename(item[0]).startswith(building)]
+        if candidates:
+            count, size = await asyncio.to_thread(_remove_unchanged, candidates)
+            removed += count
+            freed += size
+        if not self._evict():
+            logging.warning("Архивы в кэше не помещаются в квоту: идут сборки.")
+        if removed:
+            logging.info(f"Уборка {temp_root}: удалено файлов {removed}, освобождено {freed / 1024 / 1024:.1f} МБ")
+        return removed, freed
+
+    async def _janitor_loop(self, temp_root: str, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep(temp_root)
+            except OSError as e:
+                logging.error(f"Ошибка уборки {temp_root}: {e}")
+
+    # Уборка обрывков после прошлого запуска и единственная фоновая задача уборщика
+    async def start(self, temp_root: str, interval: float = JANITOR_INTERVAL):
+        await self.sweep(temp_root, startup=True)
+        if self._janitor is None:
+            self._janitor = asyncio.create_task(self._janitor_loop(temp_root, interval), name="archive-janitor")
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        if self._janitor is not None:
+            tasks.append(self._janitor)
+            self._janitor = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def report(self) -> str:
+        return (f"🗜 Архивы: в кэше {len(self._index)}, в работе {len(self._jobs)}, "
+                f"занято {self.used_bytes() / 1024 / 1024:.1f} из {self.max_bytes // (1024 * 1024)} МБ, "
+                f"объединено запросов {self.merged}")
@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+from telegram import Update, CallbackQuery, User
+from telegram.ext import CallbackQueryHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import callbacks  # noqa: E402
+
+# Стоимость выбора обработчика нажатия кнопки: прежняя цепочка CallbackQueryHandler'ов
+# с регулярными выражениями (Application проверяет их по очереди до первого совпадения,
+# затем обработчик заново разбирает query.data через split) против точек входа диалогов
+# и одного CallbackRouter с разбором callback_data и поиском по тегу в словаре.
+# Плюс длина callback_data для длинных названий классов.
+
+# Обработчики в порядке регистрации до перехода на callbacks.py
+REGEX_CHAIN = [
+    "^add_class$", "^add_admin$", "^manage_admins$", "^back_to_main$", "^menu:", "^class_", "^roster:",
+    "^student_", "^shots:", "^view_screenshot_", "^(download|compressed)_student_",
+    "^(download|compressed)_class_", "^(download|compressed)_all_photos$", "^submissions$", "^modo_tasks$",
+    "^my_screenshots$", "^back_to_menu$", "^upload_screenshot$", "^modo_settings$", "^remove_modo_url$",
+    "^activate_modo$", "^deactivate_modo$", "^set_modo_url$", "^broadcast_menu$", "^remind_now$",
+    "^broadcast_to_", "^import_roster$",
+]
+ENTRY_POINTS = [callbacks.ADD_CLASS, callbacks.ADD_ADMIN, callbacks.UPLOAD_SCREENSHOT, callbacks.SET_MODO_URL,
+                callbacks.BROADCAST_TO, callbacks.IMPORT_ROSTER]
+
+
+async def _noop(update, context, *values):
+    return values
+
+
+# Прежний разбор полей в обработчиках
+def legacy_parse(data: str):
+    if data.startswith("class_"):
+        return data[6:]
+    if data.startswith(("student_", "view_screenshot_", "download_student_", "compressed_student_")):
+        return int(data.split("_")[-1])
+    if data.startswith(("download_class_", "compressed_class_")):
+        return data.split("_class_", 1)[1]
+    if data.startswith(("menu:", "roster:", "shots:")):
+        return data.split(":", 2)[1:]
+    return None
+
+
+# Типичный поток нажатий администратора и учеников: (старый callback_data, новый callback_data)
+def presses(count: int, classes):
+    result = []
+    for _ in range(count):
+        class_id = random.randrange(len(classes)) + 1
+        class_name = classes[class_id - 1]
+        student_id = random.randrange(1, 5000)
+        screenshot_id = random.randrange(1, 100000)
+        result.append(random.choice([
+            (f"class_{class_name}", callbacks.encode(callbacks.CLASS, class_id, "")),
+            (f"student_{student_id}", callbacks.encode(callbacks.STUDENT, student_id, "")),
+            (f"view_screenshot_{screenshot_id}", callbacks.encode(callbacks.SCREENSHOT, screenshot_id)),
+            (f"roster:>{student_id}:{class_name}", callbacks.encode(callbacks.CLASS, class_id, f">{student_id}")),
+            (f"shots:<{screenshot_id}:{student_id}", callbacks.encode(callbacks.STUDENT, student_id, f"<{screenshot_id}")),
+            (f"compressed_class_{class_name}", callbacks.encode(callbacks.DOWNLOAD_CLASS, class_id, True)),
+            ("back_to_main", callbacks.encode(callbacks.MENU, "")),
+            ("my_screenshots", callbacks.encode(callbacks.MY_SCREENSHOTS)),
+            ("upload_screenshot", callbacks.encode(callbacks.UPLOAD_SCREENSHOT)),
+            ("remind_now", callbacks.encode(callbacks.REMIND_NOW)),
+        ]))
+    return result
+
+
+def update(data: str) -> Update:
+    user = User(1, "bench", False)
+    return Update(1, callback_query=CallbackQuery("1", user, "bench", data=data))
+
+
+# Поиск первого подходящего обработчика, как в Application.process_update
+def route(handlers, upd):
+    for handler in handlers:
+        check = handler.check_update(upd)
+        if check is not None and check is not False:
+            return handler, check
+    return None, None
+
+
+def measure(func, items, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        timings.append((time.perf_counter() - started) / len(items) * 1e6)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк маршрутизации нажатий кнопок")
+    parser.add_argument("--presses", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    classes = [f"{grade}{letter}" for grade in range(1, 12) for letter in "АБВГД"]
+    regex_handlers = [CallbackQueryHandler(_noop, pattern=pattern) for pattern in REGEX_CHAIN]
+    router = callbacks.CallbackRouter()
+    for item in callbacks.ROUTES.values():
+        if item not in ENTRY_POINTS and item is not callbacks.PICK_CLASS:
+            router.add(item, _noop)
+    table_handlers = [CallbackQueryHandler(_noop, pattern=callbacks.matches(item)) for item in ENTRY_POINTS]
+    table_handlers.append(router)
+
+    data = presses(args.presses, classes)
+    old_updates = [update(old) for old, _ in data]
+    new_updates = [update(new) for _, new in data]
+    assert all(route(regex_handlers, upd)[0] is not None for upd in old_updates)
+    assert all(route(table_handlers, upd)[0] is not None for upd in new_updates)
+
+    def regex_press(upd):
+        handler, _ = route(regex_handlers, upd)
+        legacy_parse(upd.callback_query.data)
+
+    def table_press(upd):
+        handler, check = route(table_handlers, upd)
+        if handler is not router:
+            callbacks.decode(upd.callback_query.data)
+
+    regex_us = measure(regex_press, old_updates, args.repeat)
+    table_us = measure(table_press, new_updates, args.repeat)
+    decode_us = measure(callbacks.decode, [new for _, new in data], args.repeat)
+    old_len = statistics.mean(len(old.encode()) for old, _ in data)
+    new_len = statistics.mean(len(new) for _, new in data)
+
+    print(f"{args.presses} нажатий, {len(REGEX_CHAIN)} regex-обработчиков в прежней цепочке")
+    print(f"Цепочка regex + split:         {regex_us:6.2f} мкс на нажатие")
+    print(f"Точки входа + CallbackRouter:  {table_us:6.2f} мкс на нажатие (из них разбор {decode_us:.2f} мкс)")
+    print(f"Средняя длина callback_data:   было {old_len:.1f} байт, стало {new_len:.1f} байт")
+
+    long_name = "Подготовительная_группа_Б"
+    old = f"compressed_class_{long_name}"
+    new = callbacks.encode(callbacks.DOWNLOAD_CLASS, 12345, True)
+    print(f"Класс «{long_name}»: было {len(old.encode())} байт (лимит {callbacks.MAX_LENGTH}), "
+          f"стало {len(new)} байт")
+
+
+if __name__ == '__main__':
+    main()
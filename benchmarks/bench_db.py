@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+
+# Сравнение пропускной способности обработчиков: прямой sqlite3.connect в цикле событий
+# против пула соединений db.Database. Каждый «апдейт» повторяет запросы обработчиков
+# бота и ждёт имитацию сетевого вызова к Telegram.
+
+API_LATENCY = 0.005
+
+
+def populate(path: str, classes: int, students: int, screenshots: int):
+    db.init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO classes (name) VALUES (?)", [(f"{i}А",) for i in range(classes)])
+    conn.executemany("INSERT INTO students (user_id, first_name, last_name, class, username) VALUES (?, ?, ?, ?, ?)",
+                     [(uid, f"Имя{uid}", f"Фамилия{uid}", f"{uid % classes}А", f"user{uid}")
+                      for uid in range(students)])
+    conn.executemany("INSERT INTO screenshots (user_id, file_path, timestamp) VALUES (?, ?, ?)",
+                     [(random.randrange(students), f"photos/x/{i}.jpg", "2024-01-01 10:00")
+                      for i in range(screenshots)])
+    conn.commit()
+    conn.close()
+
+
+ROSTER_SQL = """
+    SELECT s.id, s.first_name, s.last_name,
+           (SELECT MAX(timestamp) FROM screenshots WHERE user_id = s.user_id) as last_upload,
+           (SELECT COUNT(*) FROM screenshots WHERE user_id = s.user_id) as screenshot_count
+    FROM students s
+    WHERE s.class = ?
+"""
+
+
+# Старый способ: новое соединение на каждый запрос прямо в цикле событий
+class DirectBackend:
+    def __init__(self, path):
+        self.path = path
+
+    async def fetchall(self, sql, params=()):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    async def execute(self, sql, params=()):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        conn.commit()
+        conn.close()
+
+    def close(self):
+        pass
+
+
+async def simulated_update(backend, n: int, classes: int, students: int):
+    kind = n % 4
+    if kind == 0:
+        await backend.fetchall("SELECT value FROM settings WHERE key = 'modo_active'")
+    elif kind == 1:
+        await backend.fetchall(ROSTER_SQL, (f"{n % classes}А",))
+    elif kind == 2:
+        await backend.execute("INSERT INTO screenshots (user_id, file_path, timestamp) VALUES (?, ?, ?)",
+                              (n % students, f"photos/x/new_{n}.jpg", "2024-01-02 10:00"))
+    else:
+        await backend.fetchall("SELECT file_path FROM screenshots WHERE user_id = ?", (n % students,))
+    await asyncio.sleep(API_LATENCY)
+
+
+async def run_scenario(backend, updates: int, concurrency: int, classes: int, students: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    lag = [0.0]
+    stop = asyncio.Event()
+
+    # Задержка цикла событий: насколько опаздывает таймер в 1 мс
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag[0] = max(lag[0], time.perf_counter() - started - 0.001)
+
+    async def one(n):
+        async with semaphore:
+            started = time.perf_counter()
+            await simulated_update(backend, n, classes, students)
+            latencies.append(time.perf_counter() - started)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(updates)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    latencies.sort()
+    return {
+        "throughput": updates / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+        "max_loop_lag": lag[0] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк слоя доступа к SQLite")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--classes", type=int, default=30)
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--screenshots", type=int, default=3000)
+    parser.add_argument("--pool", type=int, default=db.POOL_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        populate(path, args.classes, args.students, args.screenshots)
+        for name, backend in (("before (sqlite3.connect)", DirectBackend(path)),
+                              ("after (db.Database)", db.Database(path, args.pool))):
+            result = asyncio.run(run_scenario(backend, args.updates, args.concurrency,
+                                              args.classes, args.students))
+            backend.close()
+            print(f"{name:26} {result['throughput']:8.1f} upd/s  p50 {result['p50']:7.1f} ms  "
+                  f"p95 {result['p95']:7.1f} ms  max loop lag {result['max_loop_lag']:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+import search  # noqa: E402
+
+# Поиск ученика по всей школе: FTS5 с префиксными индексами против LIKE по таблице
+# students, плюс цена триггеров синхронизации индекса при вставке учеников.
+
+FIRST_NAMES = ["Александр", "Мария", "Артём", "Анна", "Михаил", "София", "Иван", "Алиса", "Дмитрий", "Ева",
+               "Нурлан", "Айгерим", "Данияр", "Алия", "Ерлан", "Дана", "Тимур", "Камила", "Арман", "Асель"]
+LAST_NAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+              "Новиков", "Фёдоров", "Ахметов", "Омаров", "Сериков", "Касымов", "Жумабаев", "Нурланов",
+              "Абдрахманов", "Искаков", "Бекова", "Садыкова"]
+
+LIKE_SQL = """
+    SELECT id, first_name, last_name, class, username FROM students
+    WHERE first_name LIKE ? OR last_name LIKE ? OR username LIKE ?
+    LIMIT ?
+"""
+
+
+def populate(conn, students: int):
+    rows = []
+    for i in range(students):
+        last_name = random.choice(LAST_NAMES) + random.choice(["", "а"]) * (i % 3 == 0)
+        rows.append((random.choice(FIRST_NAMES), f"{last_name}{i % 997 or ''}" if i % 5 == 0 else last_name,
+                     f"{random.randint(1, 11)}{random.choice('АБВГД')}", f"user_{i}" if i % 2 else None))
+    conn.executemany("INSERT INTO students (first_name, last_name, class, username) VALUES (?, ?, ?, ?)", rows)
+
+
+def queries(count: int):
+    result = []
+    for _ in range(count):
+        kind = random.randrange(4)
+        if kind == 0:
+            result.append(random.choice(LAST_NAMES)[:random.randint(2, 5)])
+        elif kind == 1:
+            result.append(f"{random.choice(FIRST_NAMES)[:3]} {random.choice(LAST_NAMES)[:4]}")
+        elif kind == 2:
+            result.append(f"user_{random.randrange(1000)}")
+        else:
+            result.append(random.choice(FIRST_NAMES))
+    return result
+
+
+def measure(func, texts):
+    timings = []
+    for text in texts:
+        started = time.perf_counter()
+        func(text)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска учеников /find")
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "find.db")
+        conn = db.connect(path)
+        conn.execute("CREATE TABLE students (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, "
+                     "first_name TEXT, last_name TEXT, class TEXT, username TEXT)")
+        with conn:
+            populate(conn, args.students)
+        started = time.perf_counter()
+        db._transaction(conn, db._add_student_search)
+        migrate_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with conn:
+            populate(conn, 1000)
+        insert_ms = (time.perf_counter() - started)
+
+        texts = queries(args.queries)
+        found = sum(bool(search.search(conn, text)) for text in texts)
+        fts_p50, fts_p95 = measure(lambda text: search.search(conn, text), texts)
+        scoped = {"5А", "5Б", "6В"}
+        scoped_p50, scoped_p95 = measure(lambda text: search.search(conn, text, scoped), texts)
+        like_p50, like_p95 = measure(
+            lambda text: conn.execute(LIKE_SQL, (f"%{text}%",) * 3 + (search.LIMIT,)).fetchall(), texts)
+        conn.close()
+
+    print(f"{args.students} учеников, {args.queries} запросов (с результатами: {found})")
+    print(f"FTS5 по всей школе:      p50 {fts_p50:7.2f} мс, p95 {fts_p95:7.2f} мс")
+    print(f"FTS5 по трём классам:    p50 {scoped_p50:7.2f} мс, p95 {scoped_p95:7.2f} мс")
+    print(f"LIKE '%...%' (без ранж.): p50 {like_p50:7.2f} мс, p95 {like_p95:7.2f} мс")
+    print(f"Построение индекса:      {migrate_ms:9.1f} мс (однократно)")
+    print(f"Вставка 1000 учеников с триггерами: {insert_ms * 1000:7.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
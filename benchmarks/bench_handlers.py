@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import functools
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_telegram import FakeTelegram, FakeRequest  # noqa: E402
+import callbacks  # noqa: E402
+
+# Нагрузочный тест обработчиков бота без Telegram: настоящее Application из bot.py
+# со всеми зарегистрированными обработчиками получает синтетические апдейты, а запросы
+# к Bot API обслуживает FakeTelegram в том же процессе (FakeRequest). База данных
+# и файлы скриншотов генерируются заданного размера: классы × ученики × скриншоты.
+# Результат — задержки p50/p95/p99 по обработчикам и пропускная способность
+# по сценариям; --output сохраняет их в JSON, --compare сравнивает с прошлым запуском.
+
+TOKEN = "123456:BENCH"
+FIRST_STUDENT = 10_000_000
+FIRST_NEW_USER = 20_000_000
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+# Учёт длительности каждого вызова обработчика (по имени функции)
+class Timings:
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                self.samples.setdefault(name, []).append(time.perf_counter() - started)
+        return timed
+
+    def instrument(self, application):
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                self._instrument(handler)
+
+    def _instrument(self, handler):
+        nested = getattr(handler, "entry_points", None)
+        if nested is not None:
+            for inner in [*handler.entry_points, *handler.fallbacks,
+                          *(h for state in handler.states.values() for h in state)]:
+                self._instrument(inner)
+        elif hasattr(handler, "routes"):
+            for tag, callback in handler.routes.items():
+                handler.routes[tag] = self.wrap(callback)
+        else:
+            handler.callback = self.wrap(handler.callback)
+
+    def report(self):
+        return {name: {"count": len(values),
+                       "p50_ms": percentile(values, 0.50) * 1000,
+                       "p95_ms": percentile(values, 0.95) * 1000,
+                       "p99_ms": percentile(values, 0.99) * 1000,
+                       "max_ms": max(values) * 1000}
+                for name, values in sorted(self.samples.items())}
+
+
+def populate(db, path: str, photos_dir: str, args):
+    conn = db.connect(path)
+    classes = [f"{grade}{letter}" for grade in range(1, 12) for letter in "АБВГДЕЖЗ"][:args.classes]
+    conn.executemany("INSERT INTO classes (name) VALUES (?)", [(name,) for name in classes])
+    students, screenshots = [], []
+    for c, class_name in enumerate(classes):
+        os.makedirs(os.path.join(photos_dir, class_name), exist_ok=True)
+        for s in range(args.students):
+            user_id = FIRST_STUDENT + c * args.students + s
+            students.append((user_id, f"Имя{user_id}", f"Фамилия{user_id}", class_name, f"user{user_id}"))
+            for n in range(args.screenshots):
+                file_path = os.path.join(photos_dir, class_name, f"screenshot_{user_id}_f{user_id}x{n}.jpg")
+                with open(file_path, "wb") as f:
+                    f.write(os.urandom(args.file_kb * 1024))
+                timestamp = f"2024-09-{1 + n % 28:02d} 10:00"
+                screenshots.append((user_id, file_path, timestamp, db.to_epoch(timestamp), f"f{user_id}x{n}"))
+    conn.executemany("INSERT INTO students (user_id, first_name, last_name, class, username) VALUES (?, ?, ?, ?, ?)",
+                     students)
+    conn.executemany("INSERT INTO screenshots (user_id, file_path, timestamp, created_at, file_id) VALUES (?, ?, ?, ?, ?)",
+                     screenshots)
+    db._backfill_student_stats(conn)
+    conn.commit()
+    conn.close()
+    return classes
+
+
+class Driver:
+    def __init__(self, application):
+        self.application = application
+        self.update_id = 0
+        self.message_id = 0
+
+    def _user(self, user_id: int):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, **fields):
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id), **fields}
+
+    def _update(self, **fields):
+        from telegram import Update
+        self.update_id += 1
+        return Update.de_json({"update_id": self.update_id, **fields}, self.application.bot)
+
+    def text(self, user_id: int, text: str):
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._update(message=self._message(user_id, **fields))
+
+    def photo(self, user_id: int, file_id: str):
+        photo = [{"file_id": file_id, "file_unique_id": f"u{file_id}", "width": 1280, "height": 720}]
+        return self._update(message=self._message(user_id, photo=photo))
+
+    def callback(self, user_id: int, data: str):
+        return self._update(callback_query={"id": str(self.update_id), "from": self._user(user_id),
+                                            "chat_instance": "bench", "data": data,
+                                            "message": self._message(user_id, text="menu")})
+
+    # Обработка потока апдейтов так же, как это делает Application: через update_processor
+    async def run(self, updates):
+        processor = self.application.update_processor
+        tasks = [asyncio.create_task(processor.process_update(update, self.application.process_update(update)))
+                 for update in updates]
+        await asyncio.gather(*tasks)
+        return len(tasks)
+
+
+def registration(driver, classes, args):
+    updates = []
+    for i in range(args.new_users):
+        user_id = FIRST_NEW_USER + i
+        updates += [driver.text(user_id, "/start"), driver.text(user_id, f"Имя{i}"),
+                    driver.text(user_id, f"Фамилия{i}"), driver.callback(user_id, callbacks.encode(callbacks.PICK_CLASS, random.randrange(len(classes)) + 1))]
+    # Апдейты разных пользователей приходят вперемешку, порядок каждого сохраняется
+    return interleave(updates, 4)
+
+
+def uploads(driver, classes, args):
+    updates = []
+    # Каждый ученик загружает один скриншот: повторный вход в диалог во время загрузки игнорируется
+    students = random.sample(range(args.classes * args.students), min(args.uploads, args.classes * args.students))
+    for i, student in enumerate(students):
+        user_id = FIRST_STUDENT + student
+        updates += [driver.callback(user_id, callbacks.encode(callbacks.UPLOAD_SCREENSHOT)), driver.photo(user_id, f"bench{i}")]
+    return interleave(updates, 2)
+
+
+def browsing(driver, classes, admins, args):
+    updates = []
+    for i in range(args.sessions):
+        admin = admins[i % len(admins)]
+        class_index = random.randrange(len(classes))
+        student_id = class_index * args.students + random.randrange(args.students) + 1
+        updates += [driver.text(admin, "/sqlallget"),
+                    driver.callback(admin, callbacks.encode(callbacks.CLASS, class_index + 1, "")),
+                    driver.callback(admin, callbacks.encode(callbacks.STUDENT, student_id, "")),
+                    driver.callback(admin, callbacks.encode(callbacks.MENU, ""))]
+    return updates
+
+
+def archives(driver, classes, admins, args):
+    updates = []
+    for i in range(min(args.archives, len(classes))):
+        admin = admins[i % len(admins)]
+        # Первый запрос собирает архив, второй берёт его из кэша (id классов идут по порядку с 1)
+        updates += [driver.callback(admin, callbacks.encode(callbacks.DOWNLOAD_CLASS, i + 1, False)) for _ in range(2)]
+        updates.append(driver.callback(admin, callbacks.encode(callbacks.DOWNLOAD_STUDENT,
+                                                               FIRST_STUDENT + i * args.students, False)))
+    return updates
+
+
+def interleave(updates, per_user: int):
+    users = [updates[i:i + per_user] for i in range(0, len(updates), per_user)]
+    result = []
+    for step in range(per_user):
+        result += [user[step] for user in users]
+    return result
+
+
+async def run_scenario(name, driver, updates, timings, fake, bot, wait_uploads=False):
+    timings.samples.clear()
+    fake.reset()
+    started = time.perf_counter()
+    count = await driver.run(updates)
+    if wait_uploads:
+        await bot.upload_queue._queue.join()
+    elapsed = time.perf_counter() - started
+    result = {"updates": count, "seconds": elapsed, "throughput": count / elapsed,
+              "api_calls": sum(fake.calls.values()), "handlers": timings.report()}
+    print(f"\n{name}: {count} апдейтов за {elapsed:.2f} с ({count / elapsed:.0f} апд/с), "
+          f"вызовов API: {result['api_calls']}")
+    for handler, stats in result["handlers"].items():
+        print(f"  {handler:<24} n={stats['count']:<5} p50 {stats['p50_ms']:7.1f} мс  "
+              f"p95 {stats['p95_ms']:7.1f} мс  p99 {stats['p99_ms']:7.1f} мс")
+    return result
+
+
+def compare(previous: dict, current: dict):
+    print("\nСравнение с предыдущим запуском (было → стало):")
+    for scenario, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        print(f"  {scenario}: {before['throughput']:.0f} → {result['throughput']:.0f} апд/с")
+        for handler, stats in result["handlers"].items():
+            old = before["handlers"].get(handler)
+            if old:
+                print(f"    {handler:<24} p95 {old['p95_ms']:7.1f} → {stats['p95_ms']:7.1f} мс")
+
+
+async def main_async(args):
+    args.output = args.output and os.path.abspath(args.output)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    workdir = tempfile.mkdtemp(prefix="bench_handlers_")
+    os.chdir(workdir)
+    os.environ["SCHOOL_BOT_DB"] = os.path.join(workdir, "bench.db")
+    os.environ.setdefault("IMAGE_PIPELINE", "0")
+    os.environ.setdefault("MODO_REMINDER_TIME", "")
+    # Измеряется стоимость обработчиков, а не лимиты Telegram: планировщик не сдерживает отправку
+    for name in ("OUTBOUND_GLOBAL_RATE", "OUTBOUND_CHAT_RATE", "OUTBOUND_CHAT_BURST"):
+        os.environ.setdefault(name, "1000000")
+    import bot
+    import db
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(args.seed)
+    started = time.perf_counter()
+    classes = populate(db, os.environ["SCHOOL_BOT_DB"], bot.PHOTOS_DIR, args)
+    print(f"База: {args.classes} классов × {args.students} учеников × {args.screenshots} скриншотов "
+          f"({time.perf_counter() - started:.1f} с на генерацию)")
+
+    fake = FakeTelegram(args.api_latency / 1000)
+    request = FakeRequest(fake)
+    application = bot.build_application(TOKEN, concurrency=args.concurrency, request=request)
+    timings = Timings()
+    timings.instrument(application)
+    bot.upload_queue.process = timings.wrap(bot.upload_queue.process)
+    driver = Driver(application)
+    admins = sorted(bot.MAIN_ADMINS)
+    results = {"config": vars(args), "scenarios": {}}
+    async with application:
+        bot.upload_queue.start()
+        scenarios = [
+            ("registration", registration(driver, classes, args), False),
+            ("uploads", uploads(driver, classes, args), True),
+            ("browsing", browsing(driver, classes, admins, args), False),
+            ("archives", archives(driver, classes, admins, args), False),
+        ]
+        for name, updates, wait_uploads in scenarios:
+            if name in args.scenarios:
+                results["scenarios"][name] = await run_scenario(name, driver, updates, timings, fake, bot,
+                                                                wait_uploads)
+        await bot.upload_queue.drain()
+    db.close()
+    results["bytes_up"] = request.bytes_up
+    results["bytes_down"] = request.bytes_down
+    print(f"\nВременные файлы: {workdir}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота с фиктивным Bot API")
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--students", type=int, default=30, help="учеников в классе")
+    parser.add_argument("--screenshots", type=int, default=5, help="скриншотов у ученика")
+    parser.add_argument("--file-kb", type=int, default=16, help="размер файла скриншота, КБ")
+    parser.add_argument("--new-users", type=int, default=200, help="регистраций в сценарии registration")
+    parser.add_argument("--uploads", type=int, default=200, help="загрузок в сценарии uploads")
+    parser.add_argument("--sessions", type=int, default=100, help="сессий администратора в browsing")
+    parser.add_argument("--archives", type=int, default=5, help="классов для выгрузки в archives")
+    parser.add_argument("--scenarios", nargs="+", default=["registration", "uploads", "browsing", "archives"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--api-latency", type=float, default=5, help="задержка ответа Bot API, мс")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
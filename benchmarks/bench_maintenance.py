@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+import maintenance  # noqa: E402
+from bench_handlers import percentile  # noqa: E402
+from bench_storage import LoopLag  # noqa: E402
+
+# Обслуживание базы под нагрузкой: пул соединений бота непрерывно сохраняет скриншоты
+# и читает списки классов, пока в потоке идёт maintenance.run (checkpoint, статистика,
+# incremental vacuum, резервная копия по шагам). Для сравнения — та же нагрузка без
+# обслуживания и во время полного VACUUM, который держит блокировку записи до конца.
+
+
+def populate(conn, students: int, screenshots: int):
+    conn.executemany("INSERT INTO students (user_id, first_name, last_name, class, username) VALUES (?, ?, ?, ?, ?)",
+                     [(i, f"Имя{i}", f"Фамилия{i}", f"{i % 11 + 1}{'АБВГД'[i % 5]}", f"user{i}")
+                      for i in range(1, students + 1)])
+    base = db.to_epoch("2026-09-01 08:00")
+    for user_id in range(1, students + 1):
+        for _ in range(screenshots):
+            created = base + random.randrange(60 * 86400)
+            db.insert_screenshot(conn, user_id, f"photos/x/{user_id}_{created}.jpg", "2026-09-01 08:00",
+                                 file_id=f"file{user_id}{created}", created_at=created)
+    # Удалённые загрузки оставляют свободные страницы для incremental vacuum
+    conn.execute("DELETE FROM screenshots WHERE user_id <= ?", (students // 4,))
+
+
+async def load(pool, students: int, latencies, stop: asyncio.Event):
+    while not stop.is_set():
+        user_id = random.randint(1, students)
+        started = time.perf_counter()
+        if random.random() < 0.5:
+            await pool.transaction(db.insert_screenshot, user_id, "photos/x/new.jpg", "2026-10-18 10:00")
+        else:
+            await pool.fetchall("SELECT first_name, last_name FROM students WHERE class = ? ORDER BY last_name",
+                                (f"{user_id % 11 + 1}А",))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def measure(name: str, pool, students: int, work, workers: int):
+    latencies = []
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(load(pool, students, latencies, stop)) for _ in range(workers)]
+    with LoopLag() as lag:
+        started = time.perf_counter()
+        result = await work()
+        elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*tasks)
+    print(f"{name:<22} {elapsed:6.2f} с, запросов {len(latencies):6} ({len(latencies) / elapsed:5.0f}/с), "
+          f"p50 {percentile(latencies, 0.5):6.1f} мс, p99 {percentile(latencies, 0.99):7.1f} мс, "
+          f"макс {max(latencies, default=0):7.1f} мс, задержка цикла до {lag.worst:5.1f} мс")
+    return result
+
+
+def vacuum(path: str):
+    conn = db.connect(path)
+    conn.execute("VACUUM")
+    conn.close()
+
+
+async def main_async(args):
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "maintenance.db")
+        db.init_db(path)
+        conn = db.connect(path)
+        db._transaction(conn, populate, args.students, args.screenshots)
+        conn.close()
+        size, wal = maintenance.sizes(path)
+        print(f"{args.students} учеников × {args.screenshots} скриншотов, база {size / 1024 / 1024:.1f} МБ, "
+              f"WAL {wal / 1024 / 1024:.1f} МБ; нагрузка: {args.workers} корутин")
+
+        pool = db.Database(path, db.POOL_SIZE)
+        service = maintenance.Maintenance(path, os.path.join(workdir, "backups"))
+        await measure("без обслуживания", pool, args.students, lambda: asyncio.sleep(args.idle), args.workers)
+        report = await measure("maintenance.run", pool, args.students, service.run, args.workers)
+        await measure("полный VACUUM", pool, args.students, lambda: asyncio.to_thread(vacuum, path), args.workers)
+        pool.close()
+        print()
+        print(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обслуживания базы под нагрузкой")
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--screenshots", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--idle", type=float, default=2.0, help="длительность замера без обслуживания, секунды")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_telegram import FakeTelegram  # noqa: E402
+from outbound import OutboundScheduler, BULK  # noqa: E402
+
+# Исходящий трафик под flood control: несколько администраторов одновременно
+# выгружают скриншоты (массовая отправка фото), а в это время другие пользователи
+# нажимают кнопки и ждут ответа. Без планировщика Telegram отвечает 429 и отправка
+# обрывается; с планировщиком запросы укладываются в лимиты, а ответы идут вне очереди.
+
+TOKEN = "123456:TEST"
+
+
+async def bulk(bot, chat_id: int, photos: int, kwargs, errors):
+    for i in range(photos):
+        try:
+            await bot.send_photo(chat_id, photo=f"photo-{i}", **kwargs)
+        except RetryAfter:
+            errors.append(chat_id)
+
+
+async def interactive(bot, chat_ids, count: int, interval: float, latencies, errors):
+    for _ in range(count):
+        started = time.perf_counter()
+        try:
+            await bot.send_message(random.choice(chat_ids), "🎓 Выберите действие:")
+            latencies.append(time.perf_counter() - started)
+        except RetryAfter:
+            errors.append(None)
+        await asyncio.sleep(interval)
+
+
+async def run(name: str, base_url: str, fake: FakeTelegram, scheduler, args):
+    fake.reset()
+    bot = ExtBot(TOKEN, base_url=base_url, rate_limiter=scheduler)
+    kwargs = {"rate_limit_args": BULK} if scheduler else {}
+    latencies, bulk_errors, interactive_errors = [], [], []
+    async with bot:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(bulk(bot, 1000 + i, args.photos, kwargs, bulk_errors) for i in range(args.admins)),
+            interactive(bot, list(range(2000, 2000 + args.users)), args.replies, args.interval,
+                        latencies, interactive_errors))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+    print(f"{name}: {elapsed:.1f} с, фото не доставлено: {len(bulk_errors)}/{args.admins * args.photos}, "
+          f"ответов не доставлено: {len(interactive_errors)}/{args.replies}, 429 от API: {fake.flood_errors}")
+    if latencies:
+        print(f"    задержка ответа: p50 {statistics.median(latencies) * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс")
+    if scheduler:
+        print("    " + scheduler.report().replace("\n", "\n    "))
+
+
+async def main_async(args):
+    fake = FakeTelegram(args.api_latency / 1000, flood_control=True)
+    base_url = fake.start(args.api_port)
+    try:
+        await run("без планировщика", base_url, fake, None, args)
+        await asyncio.sleep(2)
+        await run("OutboundScheduler", base_url, fake, OutboundScheduler(), args)
+    finally:
+        await fake.stop()
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(description="Бенчмарк планировщика исходящих сообщений")
+    parser.add_argument("--admins", type=int, default=4, help="чатов с массовой отправкой фото")
+    parser.add_argument("--photos", type=int, default=15)
+    parser.add_argument("--users", type=int, default=50, help="чатов, получающих ответы")
+    parser.add_argument("--replies", type=int, default=60)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--api-latency", type=float, default=20, help="задержка ответа Bot API, мс")
+    parser.add_argument("--api-port", type=int, default=8082)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+import report  # noqa: E402
+
+# Отчёт по всей школе: время и пик памяти Python при построчной записи CSV/XLSX
+# из курсора против чтения всего результата через fetchall
+
+
+def populate(conn, students: int, screenshots: int):
+    conn.executemany("INSERT INTO students (user_id, first_name, last_name, class, username) VALUES (?, ?, ?, ?, ?)",
+                     [(i, f"Имя{i}", f"Фамилия{i}", f"{i % 11 + 1}{'АБВГД'[i % 5]}", f"user{i}" if i % 2 else None)
+                      for i in range(1, students + 1)])
+    base = db.to_epoch("2026-09-01 08:00")
+    conn.executemany("INSERT INTO screenshots (user_id, file_path, timestamp, created_at) VALUES (?, ?, ?, ?)",
+                     ((random.randint(1, students), "x", "", base + random.randrange(60 * 86400))
+                      for _ in range(students * screenshots)))
+
+
+# Время — отдельным прогоном: tracemalloc замедляет выделения в разы
+def measure(func):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк выгрузки отчёта")
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--screenshots", type=int, default=5, help="в среднем на ученика")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "report.db")
+        conn = db.connect(path)
+        conn.execute("CREATE TABLE students (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, "
+                     "first_name TEXT, last_name TEXT, class TEXT, username TEXT)")
+        conn.execute("CREATE TABLE screenshots (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                     "file_path TEXT, timestamp TEXT, created_at INTEGER)")
+        conn.execute("CREATE INDEX idx_screenshots_user_created ON screenshots(user_id, created_at)")
+        with conn:
+            populate(conn, args.students, args.screenshots)
+        since = db.to_epoch("2026-10-15 00:00")
+
+        print(f"{args.students} учеников, ~{args.students * args.screenshots} скриншотов")
+        rows, elapsed, peak = measure(lambda: list(report.rows(conn, None, since)))
+        print(f"fetchall всех строк:  {elapsed:6.2f} с, пик памяти {peak:7.1f} МБ ({len(rows)} строк)")
+        del rows
+        for xlsx in (False, True) if report.XLSX else (False,):
+            out = os.path.join(workdir, "report.xlsx" if xlsx else "report.csv")
+            count, elapsed, peak = measure(lambda: report.write(conn, out, xlsx, None, since))
+            size = os.path.getsize(out) / 1024 / 1024
+            print(f"{'XLSX' if xlsx else 'CSV '} построчно:      {elapsed:6.2f} с, пик памяти {peak:7.1f} МБ "
+                  f"({count} строк, файл {size:.1f} МБ)")
+        if not report.XLSX:
+            print("XLSX пропущен: openpyxl не установлен")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
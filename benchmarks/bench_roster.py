@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+
+# Список учеников класса: коррелированные подзапросы без индексов против
+# индексов и таблицы student_stats, плюс время однократного заполнения счётчиков.
+
+OLD_ROSTER_SQL = """
+    SELECT s.id, s.first_name, s.last_name,
+           (SELECT MAX(timestamp) FROM screenshots WHERE user_id = s.user_id) as last_upload,
+           (SELECT COUNT(*) FROM screenshots WHERE user_id = s.user_id) as screenshot_count
+    FROM students s
+    WHERE s.class = ?
+"""
+
+NEW_ROSTER_SQL = """
+    SELECT s.id, s.first_name, s.last_name, st.last_upload, COALESCE(st.upload_count, 0)
+    FROM students s
+    LEFT JOIN student_stats st ON st.user_id = s.user_id
+    WHERE s.class = ?
+    ORDER BY s.id
+"""
+
+# Схема в том виде, в каком она была до индексов и student_stats
+LEGACY_SCHEMA = """
+    CREATE TABLE students (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE,
+                           first_name TEXT, last_name TEXT, class TEXT, username TEXT);
+    CREATE TABLE classes (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE);
+    CREATE TABLE screenshots (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+                              file_path TEXT, timestamp TEXT);
+"""
+
+
+def build_legacy(path: str, classes: int, students: int, screenshots: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany("INSERT INTO classes (name) VALUES (?)", [(f"{i}А",) for i in range(classes)])
+    conn.executemany("INSERT INTO students (user_id, first_name, last_name, class) VALUES (?, ?, ?, ?)",
+                     [(uid, f"Имя{uid}", f"Фамилия{uid}", f"{uid % classes}А") for uid in range(students)])
+    conn.executemany("INSERT INTO screenshots (user_id, file_path, timestamp) VALUES (?, ?, ?)",
+                     [(random.randrange(students), f"photos/x/{i}.jpg",
+                       f"2024-{random.randint(1, 12):02}-{random.randint(1, 28):02} 10:00")
+                      for i in range(screenshots)])
+    conn.commit()
+    conn.close()
+
+
+def time_query(conn, sql: str, classes: int, repeat: int) -> float:
+    started = time.perf_counter()
+    for i in range(repeat):
+        conn.execute(sql, (f"{i % classes}А",)).fetchall()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк списка учеников класса")
+    parser.add_argument("--classes", type=int, default=40)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--screenshots", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        build_legacy(path, args.classes, args.students, args.screenshots)
+        conn = sqlite3.connect(path)
+        old_ms = time_query(conn, OLD_ROSTER_SQL, args.classes, args.repeat)
+        conn.close()
+
+        started = time.perf_counter()
+        db.init_db(path)
+        migrate_ms = (time.perf_counter() - started) * 1000
+
+        conn = db.connect(path)
+        new_ms = time_query(conn, NEW_ROSTER_SQL, args.classes, args.repeat * 20)
+        old_indexed_ms = time_query(conn, OLD_ROSTER_SQL, args.classes, args.repeat * 20)
+        check_old = sorted(conn.execute(OLD_ROSTER_SQL, ("0А",)).fetchall())
+        check_new = sorted(conn.execute(NEW_ROSTER_SQL, ("0А",)).fetchall())
+        assert [row[:3] + (row[4],) for row in check_old] == [row[:3] + (row[4],) for row in check_new]
+
+        started = time.perf_counter()
+        inserts = 1000
+        for i in range(inserts):
+            db._transaction(conn, db.insert_screenshot, i % args.students, f"photos/x/new_{i}.jpg",
+                            "2024-12-31 10:00")
+        insert_ms = (time.perf_counter() - started) / inserts * 1000
+        conn.close()
+
+    print(f"{args.screenshots} скриншотов, {args.students} учеников, {args.classes} классов")
+    print(f"roster, без индексов (до):            {old_ms:9.2f} ms")
+    print(f"roster, подзапросы с индексом:        {old_indexed_ms:9.2f} ms")
+    print(f"roster, индекс + student_stats:       {new_ms:9.2f} ms")
+    print(f"init_db: индексы + заполнение stats:  {migrate_ms:9.2f} ms (однократно)")
+    print(f"insert_screenshot со счётчиками:      {insert_ms:9.2f} ms на скриншот")
+
+
+if __name__ == '__main__':
+    main()
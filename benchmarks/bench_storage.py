@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import zipfile
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_s3 import FakeS3  # noqa: E402
+import storage  # noqa: E402
+import archive  # noqa: E402
+
+# Хранилище скриншотов: запись и чтение объектов параллельно и выгрузка архива класса
+# через ArchiveCache для локального диска и S3 (FakeS3 в том же процессе, с задержкой сети).
+# Во время каждого прогона отдельная задача меряет задержку цикла событий: хранилище
+# не должно останавливать обработку апдейтов.
+
+
+# Максимальное опоздание тика цикла событий, мс
+class LoopLag:
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.worst = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.worst = max(self.worst, (loop.time() - started - self.interval) * 1000)
+
+    def __enter__(self):
+        self.worst = 0.0
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+async def measure(name: str, func, volume: int):
+    with LoopLag() as lag:
+        started = time.perf_counter()
+        await func()
+        elapsed = time.perf_counter() - started
+    print(f"  {name:<22} {elapsed:6.2f} с, {volume / 1024 / 1024 / elapsed:7.1f} МБ/с, "
+          f"задержка цикла до {lag.worst:5.1f} мс")
+
+
+async def run_backend(backend: storage.Storage, blobs, workdir: str, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    volume = sum(len(data) for _, data in blobs)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    async def put_all():
+        await asyncio.gather(*(limited(backend.put(key, data)) for key, data in blobs))
+
+    async def get_all():
+        results = await asyncio.gather(*(limited(backend.get(key)) for key, _ in blobs))
+        assert all(result == data for result, (_, data) in zip(results, blobs))
+
+    manifest = [(i, key, f"Ученик_{i % 30}/{os.path.basename(key)}") for i, (key, _) in enumerate(blobs, start=1)]
+    cache = archive.ArchiveCache(os.path.join(workdir, f"cache_{backend.name}"), storage=backend)
+
+    async def export():
+        files = 0
+        async for part in cache.parts("class", manifest):
+            with zipfile.ZipFile(part.path) as zf:
+                files += len(zf.namelist())
+        assert files == len(blobs), files
+
+    print(f"{backend.name}:")
+    await measure("запись", put_all, volume)
+    await measure("чтение", get_all, volume)
+    await measure("архив класса", export, volume)
+
+
+async def main_async(args):
+    random.seed(args.seed)
+    blobs = [(f"photos/blobs/{i:02x}/{i:064x}.jpg", random.randbytes(args.size * 1024)) for i in range(args.files)]
+    print(f"{args.files} файлов по {args.size} КБ, параллельно {args.concurrency}, "
+          f"задержка S3 {args.latency * 1000:.0f} мс")
+    fake = FakeS3(latency=args.latency)
+    fake.start(args.port)
+    with tempfile.TemporaryDirectory() as workdir:
+        local = storage.LocalStorage(os.path.join(workdir, "local"))
+        s3 = fake.storage()
+        try:
+            await run_backend(local, blobs, workdir, args.concurrency)
+            await run_backend(s3, blobs, workdir, args.concurrency)
+        finally:
+            await s3.close()
+            await fake.stop()
+    print(f"Запросов к S3: {dict(fake.requests)}, отклонено по подписи: {fake.rejected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилища скриншотов")
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--size", type=int, default=200, help="размер файла, КБ")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.005, help="задержка ответа S3, секунды")
+    parser.add_argument("--port", type=int, default=8933)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_telegram import FakeTelegram  # noqa: E402
+
+# Нагрузочный тест режима webhook без сети: бот работает через свой webhook-сервер,
+# Bot API заменён локальным FakeTelegram с задержкой ответа. Каждый пользователь
+# проходит регистрацию (/start → имя → фамилия) — если апдейты одного пользователя
+# обгонят друг друга, ConversationHandler не ответит, и это будет видно в проверке.
+
+TOKEN = "123456:TEST"
+SECRET = "bench-secret"
+EXPECTED = ["👋 Введите ваше имя:", "✍️ Введите вашу фамилию:", "🏫 Выберите ваш класс:"]
+
+
+def message_update(update_id: int, user_id: int, text: str):
+    message = {"message_id": update_id, "date": int(time.time()), "text": text,
+               "chat": {"id": user_id, "type": "private"},
+               "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+async def post_updates(client, url: str, user_id: int, first_update_id: int):
+    for i, text in enumerate(["/start", f"Имя{user_id}", f"Фамилия{user_id}"]):
+        response = await client.post(url, json=message_update(first_update_id + i, user_id, text),
+                                     headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+        response.raise_for_status()
+
+
+async def run(bot, fake: FakeTelegram, base_url: str, concurrency: int, users: int, first_user: int, args):
+    application = bot.build_application(TOKEN, base_url, concurrency)
+    fake.reset()
+    user_ids = range(first_user, first_user + users)
+    async with application:
+        await application.updater.start_webhook(listen="127.0.0.1", port=args.webhook_port, url_path="telegram",
+                                                webhook_url=f"http://127.0.0.1:{args.webhook_port}/telegram",
+                                                secret_token=SECRET)
+        await application.start()
+        url = f"http://127.0.0.1:{args.webhook_port}/telegram"
+        limits = httpx.Limits(max_connections=args.connections)
+        started = time.perf_counter()
+        async with httpx.AsyncClient(limits=limits) as client:
+            await asyncio.gather(*(post_updates(client, url, uid, uid * 10) for uid in user_ids))
+        received = time.perf_counter() - started
+        done = lambda: all(len(fake.messages[uid]) >= len(EXPECTED) for uid in user_ids)  # noqa: E731
+        try:
+            await fake.wait_for(done, timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        await application.updater.stop()
+        await application.stop()
+    in_order = sum(fake.messages[uid][:len(EXPECTED)] == EXPECTED for uid in user_ids)
+    updates = users * len(EXPECTED)
+    print(f"concurrency={concurrency:>3}: {updates} апдейтов за {elapsed:.2f} с "
+          f"({updates / elapsed:.0f} апд/с; приём webhook {received:.2f} с), "
+          f"регистраций по порядку: {in_order}/{users}, вызовов API: {sum(fake.calls.values())}")
+
+
+async def main_async(args):
+    workdir = tempfile.mkdtemp(prefix="bench_webhook_")
+    os.chdir(workdir)
+    os.environ["SCHOOL_BOT_DB"] = os.path.join(workdir, "bench.db")
+    import bot
+    import db
+    logging.getLogger().setLevel(logging.WARNING)
+    await db.execute("INSERT INTO classes (name) VALUES ('7А')")
+    fake = FakeTelegram(args.api_latency / 1000)
+    base_url = fake.start(args.api_port)
+    try:
+        for i, concurrency in enumerate(args.concurrency):
+            await run(bot, fake, base_url, concurrency, args.users, (i + 1) * 1_000_000, args)
+    finally:
+        await fake.stop()
+        db.close()
+    print(f"Временные файлы: {workdir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест webhook-режима с локальным Bot API")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--api-latency", type=float, default=20, help="задержка ответа Bot API, мс")
+    parser.add_argument("--connections", type=int, default=40, help="как max_connections у Telegram")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    parser.add_argument("--timeout", type=float, default=300)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
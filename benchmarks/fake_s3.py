@@ -0,0 +1,122 @@
+import os
+import sys
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+import tornado.web
+import tornado.httpserver
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage  # noqa: E402
+
+# Локальная имитация S3-совместимого хранилища для офлайн-тестов storage.S3Storage:
+# PUT/GET/HEAD/DELETE объектов с адресацией path-style (/<bucket>/<ключ>), объекты — в памяти.
+# Каждый запрос проверяется по подписи SigV4 (неверная — 403, как у настоящего S3),
+# задержка сети задаётся latency. Считает запросы и переданные байты.
+
+ACCESS_KEY = "bench"
+SECRET_KEY = "bench-secret"
+REGION = "us-east-1"
+
+
+class FakeS3:
+    def __init__(self, latency: float = 0.0, access_key: str = ACCESS_KEY, secret_key: str = SECRET_KEY,
+                 region: str = REGION):
+        self.latency = latency
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.objects = {}
+        self.requests = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rejected = 0
+        self._server = None
+        self.endpoint = None
+
+    # Подпись запроса пересчитывается тем же алгоритмом по подписанным заголовкам
+    def verify(self, request) -> bool:
+        authorization = request.headers.get("Authorization", "")
+        try:
+            fields = dict(part.strip().split("=", 1) for part in authorization.split(" ", 1)[1].split(","))
+            now = datetime.strptime(request.headers["X-Amz-Date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        except (IndexError, KeyError, ValueError):
+            return False
+        payload_hash = request.headers.get("X-Amz-Content-Sha256", "")
+        if payload_hash != hashlib.sha256(request.body or b"").hexdigest():
+            return False
+        if fields.get("Credential", "").split("/", 1)[0] != self.access_key:
+            return False
+        skip = {"host", "x-amz-date", "x-amz-content-sha256"}
+        headers = {name: request.headers[name] for name in fields.get("SignedHeaders", "").split(";")
+                   if name not in skip and name in request.headers}
+        expected = storage.sign(request.method, request.host, request.path, headers, payload_hash,
+                                self.access_key, self.secret_key, self.region, now)
+        return expected["authorization"] == authorization
+
+    def start(self, port: int, address: str = "127.0.0.1") -> str:
+        app = tornado.web.Application([(r"/([^/]+)/(.+)", _ObjectHandler, {"fake": self})])
+        self._server = tornado.httpserver.HTTPServer(app)
+        self._server.listen(port, address)
+        self.endpoint = f"http://{address}:{port}"
+        return self.endpoint
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+    # Клиент S3Storage, настроенный на этот сервер
+    def storage(self, bucket: str = "bench", **kwargs) -> storage.S3Storage:
+        return storage.S3Storage(self.endpoint, bucket, self.access_key, self.secret_key, self.region, **kwargs)
+
+
+class _ObjectHandler(tornado.web.RequestHandler):
+    def initialize(self, fake: FakeS3):
+        self.fake = fake
+
+    async def prepare(self):
+        fake = self.fake
+        fake.requests[self.request.method] = fake.requests.get(self.request.method, 0) + 1
+        if fake.latency:
+            await asyncio.sleep(fake.latency)
+        if not fake.verify(self.request):
+            fake.rejected += 1
+            self.set_status(403)
+            self.finish(b"<Error><Code>SignatureDoesNotMatch</Code></Error>")
+
+    def _object(self, bucket: str, key: str):
+        item = self.fake.objects.get((bucket, key))
+        if item is None:
+            self.set_status(404)
+            self.finish(b"<Error><Code>NoSuchKey</Code></Error>")
+        return item
+
+    def put(self, bucket: str, key: str):
+        self.fake.objects[(bucket, key)] = (self.request.body, formatdate(usegmt=True))
+        self.fake.bytes_in += len(self.request.body)
+        self.set_header("ETag", f'"{hashlib.md5(self.request.body).hexdigest()}"')
+
+    def _describe(self, item):
+        self.set_header("Content-Type", "image/jpeg")
+        self.set_header("Last-Modified", item[1])
+
+    def get(self, bucket: str, key: str):
+        item = self._object(bucket, key)
+        if item is not None:
+            self._describe(item)
+            self.fake.bytes_out += len(item[0])
+            self.write(item[0])
+
+    def head(self, bucket: str, key: str):
+        item = self._object(bucket, key)
+        if item is not None:
+            self._describe(item)
+            self.set_header("Content-Length", len(item[0]))
+
+    def delete(self, bucket: str, key: str):
+        self.fake.objects.pop((bucket, key), None)
+        self.set_status(204)
@@ -0,0 +1,177 @@
+import json
+import time
+import random
+import asyncio
+from collections import defaultdict, deque
+
+import tornado.web
+import tornado.httpserver
+from telegram.request import BaseRequest
+
+# Локальная имитация Telegram Bot API для офлайн-тестов: отвечает на вызовы
+# /bot<token>/<method> правдоподобными объектами, добавляет задержку сети
+# и запоминает все вызовы (по чатам — в порядке поступления).
+# Доступна по HTTP (start) или без сети — как запрос Bot (FakeRequest).
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "School Bot", "username": "school_bot"}
+
+# Приблизительная модель flood control: не больше CHAT_LIMIT сообщений в чат
+# и GLOBAL_LIMIT сообщений от бота за любую секунду, иначе 429 с retry_after
+CHAT_LIMIT = 5
+GLOBAL_LIMIT = 35
+RETRY_AFTER = 3
+FILE_SIZE = 64 * 1024
+SENDING_METHODS = ("sendMessage", "sendPhoto", "sendDocument", "sendMediaGroup", "editMessageText")
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, flood_control: bool = False):
+        self.latency = latency
+        self.flood_control = flood_control
+        self.flood_errors = 0
+        self._sent = deque()
+        self._chat_sent = defaultdict(deque)
+        self.calls = defaultdict(int)
+        self.messages = defaultdict(list)
+        self._message_id = 0
+        self._server = None
+        self._waiters = []
+
+    def _message(self, chat_id, text=None):
+        self._message_id += 1
+        message = {"message_id": self._message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+        if text is not None:
+            message["text"] = text
+        return message
+
+    def _result(self, method: str, params: dict):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            self.messages[chat_id].append(params.get("text"))
+            return self._message(chat_id, params.get("text"))
+        if method in ("sendPhoto", "sendDocument"):
+            return self._message(chat_id)
+        if method == "sendMediaGroup":
+            return [self._message(chat_id) for _ in json.loads(params.get("media", "[]"))]
+        if method == "getFile":
+            file_id = params.get("file_id")
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": FILE_SIZE,
+                    "file_path": f"photos/{file_id}.jpg"}
+        return True
+
+    # Учёт отправок за последнюю секунду; True, если лимит превышен
+    def _flooded(self, method: str, params: dict) -> bool:
+        now = time.monotonic()
+        chat_sent = self._chat_sent[params.get("chat_id")]
+        for sent in (self._sent, chat_sent):
+            while sent and now - sent[0] > 1:
+                sent.popleft()
+        count = len(json.loads(params["media"])) if method == "sendMediaGroup" else 1
+        if len(chat_sent) + count > CHAT_LIMIT or len(self._sent) + count > GLOBAL_LIMIT:
+            return True
+        chat_sent.extend([now] * count)
+        self._sent.extend([now] * count)
+        return False
+
+    async def handle(self, method: str, params: dict):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_control and method in SENDING_METHODS and self._flooded(method, params):
+            self.flood_errors += 1
+            return {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {RETRY_AFTER}",
+                    "parameters": {"retry_after": RETRY_AFTER}}
+        result = self._result(method, params)
+        for waiter in list(self._waiters):
+            waiter()
+        return {"ok": True, "result": result}
+
+    # Ждать, пока predicate() не станет истинным (проверяется после каждого вызова API)
+    async def wait_for(self, predicate, timeout: float = 60):
+        event = asyncio.Event()
+
+        def check():
+            if predicate():
+                event.set()
+
+        self._waiters.append(check)
+        try:
+            check()
+            await asyncio.wait_for(event.wait(), timeout)
+        finally:
+            self._waiters.remove(check)
+
+    def reset(self):
+        self.flood_errors = 0
+        self._sent.clear()
+        self._chat_sent.clear()
+        self.calls.clear()
+        self.messages.clear()
+
+    def start(self, port: int, address: str = "127.0.0.1"):
+        app = tornado.web.Application([(r"/bot[^/]+/(\w+)", _MethodHandler, {"fake": self})])
+        self._server = tornado.httpserver.HTTPServer(app)
+        self._server.listen(port, address)
+        return f"http://{address}:{port}/bot"
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+
+# Содержимое файла, скачиваемого по file_path: свои байты для каждого файла
+def file_content(file_path: str, size: int = FILE_SIZE) -> bytes:
+    return random.Random(file_path).randbytes(size)
+
+
+# Запрос Bot API без сети: вызовы передаются FakeTelegram напрямую
+class FakeRequest(BaseRequest):
+    def __init__(self, fake: FakeTelegram):
+        self.fake = fake
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if "/file/bot" in url:
+            file_path = url.split("/file/bot", 1)[1].split("/", 1)[1]
+            content = file_content(file_path)
+            self.bytes_down += len(content)
+            return 200, content
+        params = request_data.json_parameters if request_data else {}
+        if request_data:
+            self.bytes_up += len(request_data.json_payload)
+        response = await self.fake.handle(url.rsplit("/", 1)[1], params)
+        payload = json.dumps(response).encode()
+        self.bytes_down += len(payload)
+        return response.get("error_code", 200), payload
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, fake: FakeTelegram):
+        self.fake = fake
+
+    async def post(self, method: str):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(self.request.body or b"{}")
+        else:
+            params = {name: self.get_body_argument(name) for name in self.request.body_arguments}
+        response = await self.fake.handle(method, params)
+        self.set_status(response.get("error_code", 200))
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(response))
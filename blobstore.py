@@ -0,0 +1,195 @@
+import os
+import sys
+import shutil
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+import posixpath
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import db
+import images
+from storage import LocalStorage
+
+HASH_CHUNK = 1024 * 1024
+
+Blob = namedtuple("Blob", "sha256 path size created")
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_and_size(path: str):
+    return hash_file(path), os.path.getsize(path)
+
+
+# Хранилище файлов по содержимому: файл лежит под ключом <root>/<первые 2 символа sha256>/<sha256>.jpg,
+# одинаковые байты хранятся один раз. Байты — в storage (диск или S3), учёт ссылок — в таблице blobs.
+# Скачанный из Telegram файл до загрузки в storage лежит на локальном диске в incoming
+class BlobStore:
+    def __init__(self, root: str, storage=None, incoming: str = None):
+        self.root = root
+        self.storage = storage or LocalStorage()
+        self.incoming = incoming or os.path.join(root, "incoming")
+        os.makedirs(self.incoming, exist_ok=True)
+
+    def path_for(self, sha256: str) -> str:
+        return posixpath.join(self.root.replace(os.sep, "/"), sha256[:2], f"{sha256}.jpg")
+
+    # Временный файл для скачивания до того, как известен хэш. Имя уникально для каждого вызова:
+    # один и тот же file_unique_id могут одновременно скачивать несколько загрузок
+    # (пересланный всем скриншот, повторная отправка до сохранения первой)
+    def incoming_path(self, name: str) -> str:
+        fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=".jpg", dir=self.incoming)
+        os.close(fd)
+        return path
+
+    # Переместить скачанный файл в хранилище (хэширование — в потоке). Сжатая копия и миниатюра
+    # готовятся из локального файла и загружаются раньше оригинала: есть оригинал — есть и копии
+    async def put(self, temp_path: str) -> Blob:
+        sha256, size = await asyncio.to_thread(_hash_and_size, temp_path)
+        key = self.path_for(sha256)
+        if await self.storage.exists(key):
+            await asyncio.to_thread(os.remove, temp_path)
+            return Blob(sha256, key, size, False)
+        if await images.process(temp_path):
+            await asyncio.gather(
+                self.storage.put_file(images.compressed_path(key), images.compressed_path(temp_path), move=True),
+                self.storage.put_file(images.thumbnail_path(key), images.thumbnail_path(temp_path), move=True))
+        await self.storage.put_file(key, temp_path, move=True)
+        return Blob(sha256, key, size, True)
+
+
+# Запись о файле в таблице blobs с увеличением счётчика ссылок (вызывать внутри транзакции)
+def add_reference(conn, blob: Blob) -> int:
+    conn.execute("INSERT OR IGNORE INTO blobs (sha256, path, size, refcount) VALUES (?, ?, ?, 0)",
+                 (blob.sha256, blob.path, blob.size))
+    conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?", (blob.sha256,))
+    return conn.execute("SELECT id FROM blobs WHERE sha256 = ?", (blob.sha256,)).fetchone()[0]
+
+
+# Время, когда ученик уже загружал файл с таким содержимым, или None
+def find_duplicate(conn, user_id: int, sha256: str):
+    row = conn.execute('''
+        SELECT sc.timestamp FROM screenshots sc
+        JOIN blobs b ON b.id = sc.blob_id
+        WHERE sc.user_id = ? AND b.sha256 = ?
+    ''', (user_id, sha256)).fetchone()
+    return row[0] if row else None
+
+
+def _link_or_copy(source: str, target: str):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _assign_blobs(conn, blobs, rows):
+    for sha256, (path, size) in blobs.items():
+        conn.execute("INSERT OR IGNORE INTO blobs (sha256, path, size, refcount) VALUES (?, ?, ?, 0)",
+                     (sha256, path, size))
+    conn.executemany("UPDATE screenshots SET blob_id = (SELECT id FROM blobs WHERE sha256 = ?) WHERE id = ?",
+                     [(sha256, sc_id) for sc_id, sha256 in rows])
+    conn.execute("UPDATE blobs SET refcount = (SELECT COUNT(*) FROM screenshots WHERE blob_id = blobs.id)")
+
+
+# Сжатая копия и миниатюра оригинала source переносятся к blob target; False — их у source нет
+def _carry_variants(source: str, target: str) -> bool:
+    variants = [(images.compressed_path(source), images.compressed_path(target)),
+                (images.thumbnail_path(source), images.thumbnail_path(target))]
+    if not all(os.path.exists(old) for old, _ in variants):
+        return False
+    for old, new in variants:
+        if not os.path.exists(new):
+            _link_or_copy(old, new)
+    return True
+
+
+# Сжатые копии и миниатюры для blob, у которых их нет, — параллельно в процессах
+def _make_variants(targets, workers: int) -> int:
+    if not targets or not images.ENABLED:
+        return 0
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(images.process_image, target): target for target in targets}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Ошибка обработки изображения {futures[future]}: {e}")
+                continue
+            done += 1
+    return done
+
+
+# Перенос существующего дерева photos/ в локальное хранилище (на S3 затем — storage.py sync):
+# файлы хэшируются параллельно, одинаковые сводятся к одному blob, старые копии удаляются
+# после фиксации транзакции. Сжатые копии и миниатюры переносятся к blob, недостающие создаются
+def migrate(db_path: str, store: BlobStore, workers: int):
+    conn = db.connect(db_path)
+    rows = conn.execute("SELECT id, file_path FROM screenshots WHERE blob_id IS NULL").fetchall()
+    paths = sorted({path for _, path in rows if path and os.path.isfile(path)})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = dict(zip(paths, pool.map(hash_file, paths)))
+
+    blobs = {}
+    first_copies = set()
+    no_variants = set()
+    for path in paths:
+        sha256 = hashes[path]
+        key = store.path_for(sha256)
+        target = store.storage.path(key)
+        if sha256 not in blobs:
+            if not os.path.exists(target):
+                _link_or_copy(path, target)
+                first_copies.add(path)
+            blobs[sha256] = (key, os.path.getsize(target))
+            if not os.path.exists(images.compressed_path(target)):
+                no_variants.add(target)
+        if target in no_variants and _carry_variants(path, target):
+            no_variants.discard(target)
+    assigned = [(sc_id, hashes[path]) for sc_id, path in rows if path in hashes]
+    db._transaction(conn, _assign_blobs, blobs, assigned)
+    conn.close()
+
+    freed = 0
+    for path in paths:
+        if path not in first_copies:
+            freed += os.path.getsize(path)
+        os.remove(path)
+        for variant in (images.compressed_path(path), images.thumbnail_path(path)):
+            if os.path.exists(variant):
+                os.remove(variant)
+    return len(rows), len(assigned), len(blobs), freed, _make_variants(sorted(no_variants), workers)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Перенос скриншотов в хранилище по содержимому")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--photos", default="photos")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        sys.exit(f"База данных {args.db} не найдена")
+    db.init_db(args.db)
+    total, assigned, unique, freed, variants = migrate(args.db, BlobStore(os.path.join(args.photos, "blobs")),
+                                                       args.workers)
+    print(f"Строк без blob: {total}, перенесено: {assigned}, уникальных файлов: {unique}, "
+          f"дубликатов: {assigned - unique}, освобождено: {freed / 1048576:.1f} МБ, "
+          f"создано сжатых копий: {variants}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,26 +2,50 @@ import os
 import io
 import sqlite3
 import logging
-import shutil
-import zipfile
 import asyncio
-from datetime import datetime
+import tempfile
+from pathlib import Path
+from collections import namedtuple
+from datetime import datetime, timedelta, time as dtime
 from zoneinfo import ZoneInfo
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputFile
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, filters,
+    Application, ApplicationBuilder, CommandHandler, MessageHandler, filters,
     CallbackQueryHandler, ContextTypes, ConversationHandler
 )
 
+import db
+import archive
+import images
+from cache import ReadThroughCache
+from paginator import KeysetPaginator
+from ingest import IngestQueue, AlbumCollector
+from updates import PerUserUpdateProcessor, CONCURRENCY
+from outbound import OutboundScheduler, BULK
+from broadcast import Broadcaster, BROADCAST, REMINDER
+import roster
+import metrics
+import acl
+import search
+import storage
+import report
+import callbacks
+import maintenance
+from blobstore import BlobStore, Blob, add_reference, find_duplicate
+
 # Настройка логирования
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
 
 # Состояния для ConversationHandler
-GET_FIRST_NAME, GET_LAST_NAME, GET_CLASS, ADD_CLASS, ADD_ADMIN_ID, ADD_ADMIN_ACCESS, UPLOAD_SCREENSHOT, SET_MODO_URL = range(8)
+GET_FIRST_NAME, GET_LAST_NAME, GET_CLASS, ADD_CLASS, ADD_ADMIN_ID, ADD_ADMIN_ACCESS, UPLOAD_SCREENSHOT, SET_MODO_URL, BROADCAST_TEXT, IMPORT_ROSTER = range(10)
 
 # Множество главных администраторов (по ID)
 MAIN_ADMINS = {6897531034, 6176677671, 1552916570, 1040487188, 1380600483, 7176188474, 651856676}
+# Права остальных администраторов по классам (таблицы admins и admin_classes)
+access = acl.AccessControl(MAIN_ADMINS)
 
 # Директории для хранения данных
 PHOTOS_DIR = "photos"
@@ -29,77 +53,133 @@ os.makedirs(PHOTOS_DIR, exist_ok=True)
 TEMP_ZIP_DIR = "temp_zip"
 os.makedirs(TEMP_ZIP_DIR, exist_ok=True)
 
-# Асинхронное удаление файла после задержки
-async def delete_file_after_delay(file_path: str, delay: int):
-    await asyncio.sleep(delay)
-    try:
-        os.remove(file_path)
-        logging.info(f"Файл {file_path} удалён после задержки.")
-    except Exception as e:
-        logging.error(f"Ошибка удаления файла {file_path}: {e}")
-
-# Инициализация базы данных
-def init_db():
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            first_name TEXT,
-            last_name TEXT,
-            class TEXT,
-            username TEXT
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS classes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS admins (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            username TEXT,
-            class_access TEXT
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS screenshots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            file_path TEXT,
-            timestamp TEXT
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    ''')
-    # Инициализация настроек MODO
-    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('modo_url', 'https://class-kz.ru/ucheniku/modo-4-klass/')")
-    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('modo_active', 'true')")
-    conn.commit()
-    conn.close()
-
-init_db()
+# Байты скриншотов: локальный диск или S3 (STORAGE_BACKEND); в базе — ключи-пути вида photos/...
+photo_storage = storage.from_env()
+
+# Файлы скриншотов по содержимому (одинаковые байты хранятся один раз)
+blob_store = BlobStore(os.path.join(PHOTOS_DIR, "blobs"), photo_storage)
+
+# Постоянный кэш собранных архивов
+archive_cache = archive.ArchiveCache(os.path.join(TEMP_ZIP_DIR, "cache"), storage=photo_storage)
+
+db.init_db()
+
+# Кэш редко меняющихся данных: настройки, список классов, главное меню администратора
+cache = ReadThroughCache("bot")
+
+async def _load_settings():
+    return dict(await db.fetchall("SELECT key, value FROM settings"))
+
+async def get_setting(key: str):
+    settings = await cache.get("settings", _load_settings)
+    return settings.get(key)
+
+async def _load_classes():
+    return dict(await db.fetchall("SELECT id, name FROM classes ORDER BY id"))
+
+# Классы: id -> название (в кнопках передаётся id, название берётся отсюда)
+async def get_classes():
+    return await cache.get("classes", _load_classes)
+
+# Постраничные списки админских клавиатур: классы, ученики класса, скриншоты ученика
+class_pages = KeysetPaginator("SELECT id, name FROM classes WHERE id {op} ? ORDER BY id {order} LIMIT ?")
+# Классы администратора с доступом к отдельным классам (admin_classes)
+admin_class_pages = KeysetPaginator("""
+    SELECT c.id, c.name FROM classes c
+    JOIN admin_classes ac ON ac.user_id = ? AND ac.class = c.name
+    WHERE c.id {op} ?
+    ORDER BY c.id {order}
+    LIMIT ?
+""")
+roster_pages = KeysetPaginator("""
+    SELECT s.id, s.first_name, s.last_name, st.last_upload, COALESCE(st.upload_count, 0)
+    FROM students s
+    LEFT JOIN student_stats st ON st.user_id = s.user_id
+    WHERE s.class = ? AND s.id {op} ?
+    ORDER BY s.id {order}
+    LIMIT ?
+""")
+screenshot_pages = KeysetPaginator("""
+    SELECT id, timestamp FROM screenshots WHERE user_id = ? AND id {op} ? ORDER BY id {order} LIMIT ?
+""")
+
+# Кнопки классов по два в ряд; classes — пары (id, название)
+def _class_buttons(classes):
+    keyboard = []
+    for i in range(0, len(classes), 2):
+        keyboard.append([InlineKeyboardButton(name, callback_data=callbacks.encode(callbacks.CLASS, class_id, ""))
+                         for class_id, name in classes[i:i + 2]])
+    return keyboard
+
+def _download_buttons():
+    keyboard = [[InlineKeyboardButton("📥 Скачать все фотографии",
+                                      callback_data=callbacks.encode(callbacks.DOWNLOAD_ALL, False))]]
+    if images.ENABLED:
+        keyboard.append([InlineKeyboardButton("🗜 Скачать все фотографии (сжатые)",
+                                              callback_data=callbacks.encode(callbacks.DOWNLOAD_ALL, True))])
+    return keyboard
+
+# Кнопки отчёта по классу (class_id) или по всей школе (0): CSV и, если есть openpyxl, XLSX
+def _report_buttons(class_id: int, label: str = "📊 Отчёт"):
+    row = [InlineKeyboardButton(f"{label} (CSV)", callback_data=callbacks.encode(callbacks.REPORT, class_id, False))]
+    if report.XLSX:
+        row.append(InlineKeyboardButton(f"{label} (XLSX)", callback_data=callbacks.encode(callbacks.REPORT, class_id, True)))
+    return [row]
+
+# Меню администратора всех классов; кнопки управления ботом (классы, импорт, администраторы,
+# MODO и рассылки) — только главным администраторам (owner)
+async def _build_admin_menu(token: str, owner: bool):
+    page = await class_pages.fetch((), token)
+    keyboard = _class_buttons(page.rows)
+    keyboard.extend(class_pages.navigation(page, lambda token: callbacks.encode(callbacks.MENU, token)))
+    if owner:
+        keyboard.append([InlineKeyboardButton("➕ Добавить класс", callback_data=callbacks.encode(callbacks.ADD_CLASS))])
+        keyboard.append([InlineKeyboardButton("📋 Импорт списка учеников", callback_data=callbacks.encode(callbacks.IMPORT_ROSTER))])
+        keyboard.append([InlineKeyboardButton("👤 Управление администраторами", callback_data=callbacks.encode(callbacks.MANAGE_ADMINS))])
+    keyboard.extend(_download_buttons())
+    keyboard.append([InlineKeyboardButton("📈 Сдача по периодам", callback_data=callbacks.encode(callbacks.SUBMISSIONS))])
+    keyboard.extend(_report_buttons(0, "📊 Отчёт по школе"))
+    if owner:
+        keyboard.append([InlineKeyboardButton("⚙️ Настройки MODO", callback_data=callbacks.encode(callbacks.MODO_SETTINGS))])
+    return InlineKeyboardMarkup(keyboard)
+
+# Меню администратора с доступом к отдельным классам: только его классы, постранично,
+# и выгрузка их фотографий, без управления ботом
+async def _build_class_admin_menu(user_id: int, token: str):
+    page = await admin_class_pages.fetch((user_id,), token)
+    keyboard = _class_buttons(page.rows)
+    keyboard.extend(admin_class_pages.navigation(page, lambda token: callbacks.encode(callbacks.MENU, token)))
+    keyboard.extend(_download_buttons())
+    keyboard.append([InlineKeyboardButton("📈 Сдача по периодам", callback_data=callbacks.encode(callbacks.SUBMISSIONS))])
+    keyboard.extend(_report_buttons(0, "📊 Отчёт по моим классам"))
+    return InlineKeyboardMarkup(keyboard)
+
+async def admin_main_menu(token: str = "", user_id: int = None):
+    classes = None if user_id is None else access.classes(user_id)
+    if classes is None:
+        owner = user_id is None or access.is_owner(user_id)
+        return await cache.get(("admin_menu", token, owner), lambda: _build_admin_menu(token, owner))
+    return await cache.get(("admin_menu", "user", user_id, token), lambda: _build_class_admin_menu(user_id, token))
 
 # ## Регистрация пользователей
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM students WHERE user_id = ?", (user_id,))
-    student = cursor.fetchone()
-    conn.close()
+    student = await db.fetchone("SELECT * FROM students WHERE user_id = ?", (user_id,))
     if student:
         await update.message.reply_text("🎉 Вы уже зарегистрированы! Вот ваше меню:")
         await student_menu(update, context)
         return ConversationHandler.END
+    # Ученик из импортированного списка: аккаунт привязывается по username (индекс без учёта регистра)
+    username = update.message.from_user.username
+    imported = username and await db.fetchone('''
+        SELECT id, first_name, last_name, class FROM students
+        WHERE username = ? COLLATE NOCASE AND user_id IS NULL
+    ''', (username,))
+    if imported:
+        await db.execute("UPDATE students SET user_id = ?, username = ? WHERE id = ?", (user_id, username, imported[0]))
+        await update.message.reply_text(f"✅ Здравствуйте, {imported[1]} {imported[2]}! Вы уже есть в списке класса {imported[3]}.")
+        await student_menu(update, context)
+        return ConversationHandler.END
     else:
         await update.message.reply_text("👋 Введите ваше имя:")
         return GET_FIRST_NAME
@@ -115,82 +195,88 @@ async def get_last_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     context.user_data['last_name'] = update.message.text.strip()
     await update.message.delete()
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM classes")
-    classes = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    classes = await get_classes()
     if not classes:
         await context.bot.send_message(chat_id, "⚠️ Нет доступных классов. Обратитесь к администратору.")
         return ConversationHandler.END
-    keyboard = [[InlineKeyboardButton(cls, callback_data=cls)] for cls in classes]
+    keyboard = [[InlineKeyboardButton(name, callback_data=callbacks.encode(callbacks.PICK_CLASS, class_id))]
+                for class_id, name in classes.items()]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await context.bot.send_message(chat_id, "🏫 Выберите ваш класс:", reply_markup=reply_markup)
     return GET_CLASS
 
 async def get_class(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    class_id = callbacks.decode(query.data)[1][0]
+    class_name = (await get_classes()).get(class_id)
+    if class_name is None:
+        await query.answer("⚠️ Класс не найден. Введите /start ещё раз.", show_alert=True)
+        return ConversationHandler.END
     await query.answer()
-    class_name = query.data
     user_id = query.from_user.id
     first_name = context.user_data.get('first_name')
     last_name = context.user_data.get('last_name')
     username = query.from_user.username if query.from_user.username else ""
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR IGNORE INTO students (user_id, first_name, last_name, class, username)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, first_name, last_name, class_name, username))
-    conn.commit()
-    conn.close()
+    await db.transaction(_register_student, user_id, first_name, last_name, class_name, username)
     await query.message.delete()
     await query.message.reply_text(f"✅ Спасибо, {first_name} {last_name}! Вы зарегистрированы в классе {class_name}.")
     await student_menu(update, context)
     return ConversationHandler.END
 
+# Регистрация: если ученик уже есть в импортированном списке класса без аккаунта,
+# запись привязывается к нему, иначе создаётся новая
+def _register_student(conn, user_id, first_name, last_name, class_name, username):
+    # NOCASE в SQLite не учитывает кириллицу, поэтому имена сравниваются в Python
+    # среди учеников класса без аккаунта (выборка по индексу класса)
+    name = ((last_name or "").casefold(), (first_name or "").casefold())
+    matched = next((student_id for student_id, last, first in conn.execute(
+        "SELECT id, last_name, first_name FROM students WHERE class = ? AND user_id IS NULL", (class_name,))
+        if ((last or "").casefold(), (first or "").casefold()) == name), None)
+    if matched:
+        conn.execute("UPDATE students SET user_id = ?, username = ? WHERE id = ?", (user_id, username, matched))
+    else:
+        conn.execute('''
+            INSERT OR IGNORE INTO students (user_id, first_name, last_name, class, username)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, first_name, last_name, class_name, username))
+
 # ## Админский функционал
 async def sql_all_get(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    if user_id not in MAIN_ADMINS:
+    if not access.is_admin(user_id):
         await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
         return
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM classes")
-    classes = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    keyboard = []
-    for i in range(0, len(classes), 2):
-        row = []
-        row.append(InlineKeyboardButton(classes[i], callback_data=f"class_{classes[i]}"))
-        if i + 1 < len(classes):
-            row.append(InlineKeyboardButton(classes[i + 1], callback_data=f"class_{classes[i + 1]}"))
-        keyboard.append(row)
-    keyboard.append([InlineKeyboardButton("➕ Добавить класс", callback_data="add_class")])
-    keyboard.append([InlineKeyboardButton("👤 Управление администраторами", callback_data="manage_admins")])
-    keyboard.append([InlineKeyboardButton("📥 Скачать все фотографии", callback_data="download_all_photos")])
-    keyboard.append([InlineKeyboardButton("⚙️ Настройки MODO", callback_data="modo_settings")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = await admin_main_menu(user_id=user_id)
     await update.message.reply_text("🔧 Выберите действие:", reply_markup=reply_markup)
 
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id not in MAIN_ADMINS:
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return
+    await update.message.reply_text(f"{cache.report()}\n\n{archive_cache.report()}")
+
 async def admin_add_class(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer()
-    await update.callback_query.message.reply_text("🏫 Введите название нового класса:")
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return ConversationHandler.END
+    await query.answer()
+    await query.message.reply_text("🏫 Введите название нового класса:")
     return ADD_CLASS
 
 async def save_new_class(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not access.is_owner(update.message.from_user.id):
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return ConversationHandler.END
     chat_id = update.effective_chat.id
     new_class = update.message.text.strip()
     await update.message.delete()
     if not new_class:
         await context.bot.send_message(chat_id, "⚠️ Название класса не может быть пустым. Попробуйте ещё раз:")
         return ADD_CLASS
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO classes (name) VALUES (?)", (new_class,))
-        conn.commit()
+        await db.execute("INSERT INTO classes (name) VALUES (?)", (new_class,))
+        cache.invalidate("classes", "admin_menu")
         os.makedirs(os.path.join(PHOTOS_DIR, new_class), exist_ok=True)
         await context.bot.send_message(chat_id, f"✅ Класс '{new_class}' успешно добавлен!")
     except sqlite3.IntegrityError:
@@ -198,25 +284,75 @@ async def save_new_class(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except sqlite3.Error as e:
         logging.error(f"Ошибка при добавлении класса: {e}")
         await context.bot.send_message(chat_id, "❌ Ошибка базы данных. Попробуйте позже.")
+    return ConversationHandler.END
+
+async def import_roster_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return ConversationHandler.END
+    await query.answer()
+    await query.message.reply_text(
+        "📋 Отправьте файл CSV или XLSX со списком учеников.\n"
+        "Первая строка — заголовки: класс, фамилия, имя и (необязательно) username.")
+    return IMPORT_ROSTER
+
+# Разбор файла в потоке, запись одним executemany в одной транзакции, папки классов — пачкой
+async def import_roster_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not access.is_owner(update.message.from_user.id):
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return ConversationHandler.END
+    document = update.message.document
+    filename = document.file_name or "roster.csv"
+    if not filename.lower().endswith((".csv", ".xlsx")):
+        await update.message.reply_text("⚠️ Нужен файл .csv или .xlsx. Попробуйте ещё раз:")
+        return IMPORT_ROSTER
+    progress = await update.message.reply_text("⏳ Загружаю список...")
+    path = os.path.join(TEMP_ZIP_DIR, f"roster_{document.file_unique_id}{os.path.splitext(filename)[1].lower()}")
+    file = await context.bot.get_file(document.file_id)
+    await file.download_to_drive(path)
+    try:
+        rows, rejected = await asyncio.to_thread(roster.parse, path, filename)
+    except roster.RosterError as e:
+        await progress.edit_text(f"❌ {e}")
+        return ConversationHandler.END
     finally:
-        conn.close()
+        os.remove(path)
+    classes_created, created, updated, unchanged, classes = await db.transaction(roster.import_rows, rows)
+    await asyncio.to_thread(roster.make_class_folders, PHOTOS_DIR, classes)
+    cache.invalidate("classes", "admin_menu")
+    result = roster.ImportResult(classes_created, created, updated, unchanged, rejected)
+    logging.info(f"Импорт списка {filename}: добавлено {created}, обновлено {updated}, отклонено {len(rejected)}")
+    await progress.edit_text(roster.summary(result))
     return ConversationHandler.END
 
 async def manage_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer()
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
+    await query.answer()
     keyboard = [
-        [InlineKeyboardButton("➕ Добавить администратора", callback_data="add_admin")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+        [InlineKeyboardButton("➕ Добавить администратора", callback_data=callbacks.encode(callbacks.ADD_ADMIN))],
+        [InlineKeyboardButton("🔙 Назад", callback_data=callbacks.encode(callbacks.MENU, ""))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.callback_query.message.edit_text("👤 Управление администраторами:", reply_markup=reply_markup)
+    await query.message.edit_text(f"👤 Управление администраторами:\n{access.report()}",
+                                                  reply_markup=reply_markup)
 
 async def admin_add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer()
-    await update.callback_query.message.reply_text("🆔 Введите ID нового администратора:")
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return ConversationHandler.END
+    await query.answer()
+    await query.message.reply_text("🆔 Введите ID нового администратора:")
     return ADD_ADMIN_ID
 
 async def save_admin_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not access.is_owner(update.message.from_user.id):
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return ConversationHandler.END
     chat_id = update.effective_chat.id
     try:
         admin_id = int(update.message.text.strip())
@@ -229,277 +365,573 @@ async def save_admin_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ADD_ADMIN_ACCESS
 
 async def save_admin_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not access.is_owner(update.message.from_user.id):
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return ConversationHandler.END
     chat_id = update.effective_chat.id
     access_input = update.message.text.strip()
     await update.message.delete()
-    if access_input.lower() == 'all':
-        class_access = "all"
+    if access_input.lower() == acl.ALL:
+        classes = None
     else:
-
-        
-        classes = [cls.strip() for cls in access_input.split(',') if cls.strip()]
-        class_access = ",".join(classes)
+        requested = {cls.strip() for cls in access_input.split(',') if cls.strip()}
+        existing = set((await get_classes()).values())
+        classes = requested & existing
+        unknown = requested - existing
+        if not classes:
+            await context.bot.send_message(chat_id, "⚠️ Таких классов нет. Введите классы через запятую или 'all':")
+            return ADD_ADMIN_ACCESS
+        if unknown:
+            await context.bot.send_message(chat_id, f"⚠️ Пропущены несуществующие классы: {', '.join(sorted(unknown))}")
     admin_id = context.user_data.get('new_admin_id')
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
+    class_access = "все классы" if classes is None else ", ".join(sorted(classes))
     try:
         chat = await context.bot.get_chat(admin_id)
         username = chat.username if chat.username else "Не указан"
-        cursor.execute("INSERT OR REPLACE INTO admins (user_id, username, class_access) VALUES (?, ?, ?)",
-                       (admin_id, username, class_access))
-        conn.commit()
+        await db.transaction(acl.grant, admin_id, username, classes)
+        access.set(admin_id, classes)
+        cache.invalidate("admin_menu")
         await context.bot.send_message(chat_id, f"✅ Администратор с ID {admin_id} успешно добавлен с доступом: {class_access}")
     except Exception as e:
         logging.error(f"Ошибка при добавлении администратора: {e}")
         await context.bot.send_message(chat_id, "❌ Ошибка при добавлении администратора.")
-    finally:
-        conn.close()
-    MAIN_ADMINS.add(admin_id)
     return ConversationHandler.END
 
-async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str = ""):
     query = update.callback_query
+    if not access.is_admin(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
     await query.answer()
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM classes")
-    classes = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    keyboard = []
-    for i in range(0, len(classes), 2):
-        row = []
-        row.append(InlineKeyboardButton(classes[i], callback_data=f"class_{classes[i]}"))
-        if i + 1 < len(classes):
-            row.append(InlineKeyboardButton(classes[i + 1], callback_data=f"class_{classes[i + 1]}"))
-        keyboard.append(row)
-    keyboard.append([InlineKeyboardButton("➕ Добавить класс", callback_data="add_class")])
-    keyboard.append([InlineKeyboardButton("👤 Управление администраторами", callback_data="manage_admins")])
-    keyboard.append([InlineKeyboardButton("📥 Скачать все фотографии", callback_data="download_all_photos")])
-    keyboard.append([InlineKeyboardButton("⚙️ Настройки MODO", callback_data="modo_settings")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = await admin_main_menu(token, query.from_user.id)
     await query.message.edit_text("🔧 Выберите действие:", reply_markup=reply_markup)
 
-async def show_class_students(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_class_students(update: Update, context: ContextTypes.DEFAULT_TYPE, class_id: int, token: str):
     query = update.callback_query
-    data = query.data
-    if not data.startswith("class_"):
-        await query.answer("⚠️ Некорректные данные.", show_alert=True)
-        return
-    class_name = data[6:]
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT s.id, s.first_name, s.last_name,
-               (SELECT MAX(timestamp) FROM screenshots WHERE user_id = s.user_id) as last_upload,
-               (SELECT COUNT(*) FROM screenshots WHERE user_id = s.user_id) as screenshot_count
-        FROM students s
-        WHERE s.class = ?
-    """, (class_name,))
-    students = cursor.fetchall()
-    conn.close()
-    if not students:
+    class_name = (await get_classes()).get(class_id)
+    if class_name is None:
+        await query.answer("🏫 Класс не найден.", show_alert=True)
+        return
+    if not access.can_view(query.from_user.id, class_name):
+        await query.answer("🚫 Нет доступа к этому классу.", show_alert=True)
+        return
+    page = await roster_pages.fetch((class_name,), token)
+    if not page.rows and not token:
         await query.answer("👥 В этом классе нет учеников.", show_alert=True)
         return
     keyboard = []
-    for sid, fn, ln, last_upload, screenshot_count in students:
+    for sid, fn, ln, last_upload, screenshot_count in page.rows:
         last_upload_text = last_upload if last_upload else "Нет данных"
         button_text = f"{fn} {ln} (скриншотов: {screenshot_count}, послед.: {last_upload_text})"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"student_{sid}")])
-    keyboard.append([InlineKeyboardButton("📥 Скачать все скриншоты", callback_data=f"download_class_{class_name}")])
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")])
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=callbacks.encode(callbacks.STUDENT, sid, ""))])
+    keyboard.extend(roster_pages.navigation(page, lambda token: callbacks.encode(callbacks.CLASS, class_id, token)))
+    keyboard.append([InlineKeyboardButton("📥 Скачать все скриншоты",
+                                          callback_data=callbacks.encode(callbacks.DOWNLOAD_CLASS, class_id, False))])
+    if images.ENABLED:
+        keyboard.append([InlineKeyboardButton("🗜 Скачать сжатые",
+                                              callback_data=callbacks.encode(callbacks.DOWNLOAD_CLASS, class_id, True))])
+    keyboard.extend(_report_buttons(class_id))
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=callbacks.encode(callbacks.MENU, ""))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(f"👥 Список учеников класса {class_name}:", reply_markup=reply_markup)
 
-async def show_student_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_student_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, student_id: int, token: str):
     query = update.callback_query
-    data = query.data
-    try:
-        student_id = int(data.split("_")[1])
-    except (IndexError, ValueError):
-        await query.answer("⚠️ Некорректные данные.", show_alert=True)
-        return
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT first_name, last_name, class, username, user_id FROM students WHERE id = ?", (student_id,))
-    student = cursor.fetchone()
-    conn.close()
+    student = await db.fetchone('''
+        SELECT s.first_name, s.last_name, s.class, s.username, s.user_id, c.id FROM students s
+        LEFT JOIN classes c ON c.name = s.class
+        WHERE s.id = ?
+    ''', (student_id,))
     if not student:
         await query.answer("👤 Студент не найден.", show_alert=True)
         return
-    first_name, last_name, class_name, username, student_user_id = student
+    first_name, last_name, class_name, username, student_user_id, class_id = student
+    if not access.can_view(query.from_user.id, class_name):
+        await query.answer("🚫 Нет доступа к этому классу.", show_alert=True)
+        return
     profile_text = (f"👤 Имя: {first_name}\n👤 Фамилия: {last_name}\n🏫 Класс: {class_name}\n📱 Телеграм: @{username}"
                     if username else
                     f"👤 Имя: {first_name}\n👤 Фамилия: {last_name}\n🏫 Класс: {class_name}\n📱 Телеграм: Не указан")
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, file_path, timestamp FROM screenshots WHERE user_id = ?", (student_user_id,))
-    screenshots = cursor.fetchall()
-    conn.close()
+    page = await screenshot_pages.fetch((student_user_id,), token)
+    offset = 0
+    if page.rows and page.has_prev:
+        offset = (await db.fetchone("SELECT COUNT(*) FROM screenshots WHERE user_id = ? AND id < ?",
+                                    (student_user_id, page.rows[0][0])))[0]
     keyboard = []
-    for i, (sc_id, _, timestamp) in enumerate(screenshots, start=1):
-        keyboard.append([InlineKeyboardButton(f"📷 Скрин {i} ({timestamp})", callback_data=f"view_screenshot_{sc_id}")])
-    if screenshots:
-        keyboard.append([InlineKeyboardButton("📥 Скачать все скриншоты", callback_data=f"download_student_{student_user_id}")])
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"class_{class_name}")])
+    for i, (sc_id, timestamp) in enumerate(page.rows, start=offset + 1):
+        keyboard.append([InlineKeyboardButton(f"📷 Скрин {i} ({timestamp})",
+                                              callback_data=callbacks.encode(callbacks.SCREENSHOT, sc_id))])
+    keyboard.extend(screenshot_pages.navigation(page, lambda token: callbacks.encode(callbacks.STUDENT, student_id, token)))
+    if page.rows:
+        keyboard.append([InlineKeyboardButton("📥 Скачать все скриншоты",
+                                              callback_data=callbacks.encode(callbacks.DOWNLOAD_STUDENT, student_user_id, False))])
+        if images.ENABLED:
+            keyboard.append([InlineKeyboardButton("🗜 Скачать сжатые",
+                                                  callback_data=callbacks.encode(callbacks.DOWNLOAD_STUDENT, student_user_id, True))])
+    back = callbacks.encode(callbacks.CLASS, class_id, "") if class_id else callbacks.encode(callbacks.MENU, "")
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=back)])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(profile_text, reply_markup=reply_markup)
 
-async def view_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def view_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE, sc_id: int):
     query = update.callback_query
-    try:
-        sc_id = int(query.data.split("_")[2])
-    except (IndexError, ValueError):
-        await query.answer("⚠️ Некорректные данные.", show_alert=True)
-        return
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT file_path FROM screenshots WHERE id = ?", (sc_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = await db.fetchone("""
+        SELECT sc.id, COALESCE(b.path, sc.file_path), sc.file_id, s.class FROM screenshots sc
+        LEFT JOIN blobs b ON b.id = sc.blob_id
+        LEFT JOIN students s ON s.user_id = sc.user_id
+        WHERE sc.id = ?
+    """, (sc_id,))
     if not result:
         await query.answer("📷 Скриншот не найден.", show_alert=True)
         return
-    file_path = result[0]
+    if not access.can_view(query.from_user.id, result[3]):
+        await query.answer("🚫 Нет доступа к этому классу.", show_alert=True)
+        return
     await query.answer()
-    await context.bot.send_photo(query.message.chat_id, photo=open(file_path, 'rb'))
+    await send_screenshots(context.bot, query.message.chat_id, [result[:3]])
 
-async def download_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
+# Повторная отправка скриншотов по file_id альбомами до 10 фото; байты из хранилища
+# загружаются только если Telegram отклонил file_id (или его нет)
+MEDIA_GROUP_SIZE = 10
+
+async def _send_photo_group(bot, chat_id, rows, from_disk: bool):
+    media = []
+    for _, file_path, file_id in rows:
+        if file_id and not from_disk:
+            media.append(file_id)
+        else:
+            media.append(await photo_storage.get(file_path))
+    if len(media) == 1:
+        return [await bot.send_photo(chat_id, photo=media[0], rate_limit_args=BULK)]
+    return await bot.send_media_group(chat_id, media=[InputMediaPhoto(item) for item in media], rate_limit_args=BULK)
+
+# Ответы Telegram, после которых file_id больше не годится и фото загружается заново.
+# Остальные BadRequest (нет чата, сбой альбома и т. п.) повторная загрузка не исправит
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "invalid file_id", "wrong file_id",
+                  "file reference")
+
+def _file_id_rejected(error: BadRequest) -> bool:
+    message = error.message.lower()
+    return any(text in message for text in FILE_ID_ERRORS)
+
+async def send_screenshots(bot, chat_id, rows):
+    for i in range(0, len(rows), MEDIA_GROUP_SIZE):
+        group = rows[i:i + MEDIA_GROUP_SIZE]
+        from_disk = False
+        try:
+            try:
+                messages = await _send_photo_group(bot, chat_id, group, from_disk=False)
+            except BadRequest as e:
+                if not _file_id_rejected(e) or not any(file_id for _, _, file_id in group):
+                    raise
+                logging.warning(f"Telegram отклонил file_id, отправляю из хранилища: {e}")
+                from_disk = True
+                messages = await _send_photo_group(bot, chat_id, group, from_disk=True)
+        except storage.StorageError as e:
+            logging.error(f"Не удалось прочитать скриншоты из хранилища: {e}")
+            await bot.send_message(chat_id, "⚠️ Не удалось загрузить скриншоты из хранилища. Попробуйте позже.")
+            continue
+        # Запоминаем свежие file_id загруженных из хранилища фото, чтобы не загружать их снова
+        uploaded = [(message.photo[-1].file_id, message.photo[-1].file_unique_id, sc_id)
+                    for (sc_id, _, file_id), message in zip(group, messages)
+                    if (from_disk or not file_id) and message.photo]
+        if uploaded:
+            await db.executemany("UPDATE screenshots SET file_id = ?, file_unique_id = ? WHERE id = ?", uploaded)
+
+# Отправка частей архива по мере готовности с обновлением сообщения о ходе выгрузки
+async def send_archive(query, parts, name: str):
+    progress = await query.message.reply_text("⏳ Собираю архив...")
+    sent = 0
     try:
-        student_user_id = int(query.data.split("_")[2])
-    except (IndexError, ValueError):
-        await query.answer("⚠️ Некорректные данные.", show_alert=True)
-        return
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT file_path FROM screenshots WHERE user_id = ?", (student_user_id,))
-    files = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    if not files:
+        async for part in parts:
+            filename = f"{name}.zip" if part.number == 1 and part.is_last else f"{name}_part{part.number}.zip"
+            data = await asyncio.to_thread(Path(part.path).read_bytes)
+            await query.get_bot().send_document(query.message.chat_id, document=data, filename=filename,
+                                                rate_limit_args=BULK)
+            sent += 1
+            status = "✅ Архив отправлен" if part.is_last else "⏳ Собираю архив"
+            await progress.edit_text(f"{status}: частей {sent}, файлов {part.files}.")
+    except archive.QuotaExceeded as e:
+        logging.warning(f"Архив {name} не собран: {e}")
+        await progress.edit_text("⚠️ Недостаточно места для архива. Попробуйте позже или скачайте по классам.")
+        return
+    if not sent:
+        await progress.edit_text("📷 Нет файлов для архивации.")
+
+# Архив из кэша: оригиналы или сжатые копии
+async def send_cached_archive(query, name: str, manifest, compressed: bool):
+    if compressed:
+        name = f"{name}_compressed"
+        parts = archive_cache.parts(name, manifest, images.compressed_path)
+    else:
+        parts = archive_cache.parts(name, manifest)
+    await send_archive(query, parts, name)
+
+async def download_student(update: Update, context: ContextTypes.DEFAULT_TYPE, student_user_id: int, compressed: bool):
+    query = update.callback_query
+    rows = await db.fetchall("""
+        SELECT sc.id, COALESCE(b.path, sc.file_path), sc.file_path, s.class FROM screenshots sc
+        LEFT JOIN blobs b ON b.id = sc.blob_id
+        LEFT JOIN students s ON s.user_id = sc.user_id
+        WHERE sc.user_id = ?
+        ORDER BY sc.id
+    """, (student_user_id,))
+    if not rows:
         await query.answer("📷 Нет скриншотов для скачивания.", show_alert=True)
         return
-    zip_file = os.path.join(TEMP_ZIP_DIR, f"student_{student_user_id}_screenshots.zip")
-    with zipfile.ZipFile(zip_file, 'w') as zf:
-        for file in files:
-            zf.write(file, arcname=os.path.basename(file))
-    await query.message.reply_document(document=open(zip_file, 'rb'),
-                                       filename=f"student_{student_user_id}_screenshots.zip")
-    await query.answer("📤 Архив отправлен.")
-    asyncio.create_task(delete_file_after_delay(zip_file, 300))
+    if not access.can_view(query.from_user.id, rows[0][3]):
+        await query.answer("🚫 Нет доступа к этому классу.", show_alert=True)
+        return
+    await query.answer("📤 Готовлю архив...")
+    manifest = [(sc_id, path, os.path.basename(name)) for sc_id, path, name, _ in rows]
+    await send_cached_archive(query, f"student_{student_user_id}_screenshots", manifest, compressed)
 
-async def download_class(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def download_class(update: Update, context: ContextTypes.DEFAULT_TYPE, class_id: int, compressed: bool):
     query = update.callback_query
-    class_name = query.data.split("_", 1)[1]
-    class_folder = os.path.join(PHOTOS_DIR, class_name)
-    if not os.path.isdir(class_folder):
+    class_name = (await get_classes()).get(class_id)
+    if class_name is None:
+        await query.answer("🏫 Класс не найден.", show_alert=True)
+        return
+    if not access.can_view(query.from_user.id, class_name):
+        await query.answer("🚫 Нет доступа к этому классу.", show_alert=True)
+        return
+    rows = await db.fetchall("""
+        SELECT sc.id, COALESCE(b.path, sc.file_path), sc.file_path FROM screenshots sc
+        JOIN students s ON s.user_id = sc.user_id
+        LEFT JOIN blobs b ON b.id = sc.blob_id
+        WHERE s.class = ?
+        ORDER BY sc.id
+    """, (class_name,))
+    if not rows:
         await query.answer("📷 Нет фотографий для данного класса.", show_alert=True)
         return
-    base_name = os.path.join(TEMP_ZIP_DIR, f"{class_name}_screenshots")
-    shutil.make_archive(base_name, 'zip', class_folder)
-    zip_file = base_name + ".zip"
-    await query.message.reply_document(document=open(zip_file, 'rb'),
-                                       filename=f"{class_name}_screenshots.zip")
-    await query.answer("📤 Архив отправлен.")
-    asyncio.create_task(delete_file_after_delay(zip_file, 300))
+    await query.answer("📤 Готовлю архив...")
+    class_folder = os.path.join(PHOTOS_DIR, class_name)
+    manifest = [(sc_id, path, archive.arcname(name, class_folder)) for sc_id, path, name in rows]
+    await send_cached_archive(query, f"{class_name}_screenshots", manifest, compressed)
+
+# Администратор с доступом к отдельным классам получает архив только своих классов
+async def download_all_photos(update: Update, context: ContextTypes.DEFAULT_TYPE, compressed: bool):
+    query = update.callback_query
+    if not access.is_admin(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
+    classes = access.classes(query.from_user.id)
+    if classes is not None and not classes:
+        await query.answer("📷 Нет доступных классов.", show_alert=True)
+        return
+    await query.answer("📤 Готовлю архив...")
+    if classes is None:
+        archive_name = "all_photos"
+        rows = await db.fetchall("""
+            SELECT sc.id, COALESCE(b.path, sc.file_path), sc.file_path FROM screenshots sc
+            LEFT JOIN blobs b ON b.id = sc.blob_id
+            ORDER BY sc.id
+        """)
+    else:
+        classes = sorted(classes)
+        archive_name = "photos_" + "_".join(classes)
+        rows = await db.fetchall(f"""
+            SELECT sc.id, COALESCE(b.path, sc.file_path), sc.file_path FROM screenshots sc
+            JOIN students s ON s.user_id = sc.user_id
+            LEFT JOIN blobs b ON b.id = sc.blob_id
+            WHERE s.class IN ({", ".join("?" * len(classes))})
+            ORDER BY sc.id
+        """, classes)
+    manifest = [(sc_id, path, archive.arcname(name, PHOTOS_DIR)) for sc_id, path, name in rows]
+    await send_cached_archive(query, archive_name, manifest, compressed)
+
+# ## Отчёт об успеваемости: класс или вся школа (для администратора по классам — его классы).
+# Файл пишется построчно из одного агрегирующего запроса в потоке пула базы
+async def send_report(update: Update, context: ContextTypes.DEFAULT_TYPE, class_id: int, xlsx: bool):
+    query = update.callback_query
+    user_id = query.from_user.id
+    if not access.is_admin(user_id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
+    if class_id:
+        class_name = (await get_classes()).get(class_id)
+        if class_name is None:
+            await query.answer("🏫 Класс не найден.", show_alert=True)
+            return
+        if not access.can_view(user_id, class_name):
+            await query.answer("🚫 Нет доступа к этому классу.", show_alert=True)
+            return
+        classes, title = {class_name}, class_name
+    else:
+        classes, title = access.classes(user_id), "school"
+        if classes is not None and not classes:
+            await query.answer("🏫 Нет доступных классов.", show_alert=True)
+            return
+    if xlsx and not report.XLSX:
+        await query.answer("⚠️ XLSX недоступен (нет openpyxl), выберите CSV.", show_alert=True)
+        return
+    await query.answer("📊 Готовлю отчёт...")
+    modo_active = await get_setting('modo_active')
+    since = db.to_epoch(await get_setting('modo_activated_at')) if modo_active and modo_active.lower() == 'true' else None
+    extension = ".xlsx" if xlsx else ".csv"
+    fd, path = tempfile.mkstemp(prefix="report_", suffix=extension, dir=TEMP_ZIP_DIR)
+    os.close(fd)
+    filename = f"report_{title}_{datetime.now(db.TIMEZONE).strftime('%Y-%m-%d')}{extension}"
+    try:
+        count = await db.run(report.write, path, xlsx, classes, since)
+        # read_file_handle=False: файл читается с диска частями во время отправки, а не целиком в память
+        with open(path, "rb") as f:
+            await query.message.reply_document(document=InputFile(f, filename=filename, read_file_handle=False),
+                                               caption=f"📊 Отчёт: {'класс ' + title if class_id else 'все доступные классы'}, "
+                                                       f"учеников {count}")
+    finally:
+        os.remove(path)
+
+# ## Поиск ученика по всем классам: /find <имя, фамилия или username>
+async def find_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    if not access.is_admin(user_id):
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return
+    text = " ".join(context.args)
+    if not search.fts_query(text):
+        await update.message.reply_text("🔎 Укажите имя, фамилию или username: /find Иванов")
+        return
+    rows = await db.run(search.search, text, access.classes(user_id))
+    if not rows:
+        await update.message.reply_text(f"🔎 По запросу «{text}» никого не нашлось.")
+        return
+    keyboard = []
+    for student_id, first_name, last_name, class_name, username in rows:
+        label = f"{last_name} {first_name} ({class_name})" + (f" @{username}" if username else "")
+        keyboard.append([InlineKeyboardButton(label, callback_data=callbacks.encode(callbacks.STUDENT, student_id, ""))])
+    await update.message.reply_text(f"🔎 Найдено по запросу «{text}»:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def download_all_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# ## Сдача скриншотов по периодам
+# Сколько учеников каждого класса загрузили скриншот с начала суток, недели и после активации MODO.
+# Один проход по индексу created_at начиная с самой ранней границы и подсчёт учеников по классам
+def _submission_counts(conn, today: int, week: int, since):
+    earliest = min(week, since) if since is not None else week
+    counts = {row[0]: row[1:] for row in conn.execute('''
+        SELECT s.class,
+               COUNT(DISTINCT CASE WHEN sc.created_at >= :today THEN sc.user_id END),
+               COUNT(DISTINCT CASE WHEN sc.created_at >= :week THEN sc.user_id END),
+               COUNT(DISTINCT CASE WHEN sc.created_at >= :since THEN sc.user_id END)
+        FROM screenshots sc
+        JOIN students s ON s.user_id = sc.user_id
+        WHERE sc.created_at >= :earliest
+        GROUP BY s.class
+    ''', {"today": today, "week": week, "since": since, "earliest": earliest})}
+    sizes = dict(conn.execute("SELECT class, COUNT(*) FROM students GROUP BY class"))
+    return counts, sizes
+
+async def submissions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    base_name = os.path.join(TEMP_ZIP_DIR, "all_photos")
-    shutil.make_archive(base_name, 'zip', PHOTOS_DIR)
-    zip_file = base_name + ".zip"
-    await query.message.reply_document(document=open(zip_file, 'rb'),
-                                       filename="all_photos.zip")
-    await query.answer("📤 Архив отправлен.")
-    asyncio.create_task(delete_file_after_delay(zip_file, 300))
+    if not access.is_admin(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
+    await query.answer()
+    now = datetime.now(db.TIMEZONE)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week = today - timedelta(days=today.weekday())
+    # Граница «после активации» — только пока MODO активен, как в отчёте
+    modo_active = await get_setting('modo_active')
+    activated_at = await get_setting('modo_activated_at')
+    since = db.to_epoch(activated_at) if modo_active and modo_active.lower() == 'true' else None
+    counts, sizes = await db.run(_submission_counts, int(today.timestamp()), int(week.timestamp()), since)
+    visible = access.classes(query.from_user.id)
+    lines = ["📈 Учеников, отправивших скриншот:",
+             f"сегодня — с 00:00, за неделю — с {week.strftime('%d.%m')}"
+             + (f", после активации MODO — с {activated_at}" if since is not None else "")]
+    for class_name in (await get_classes()).values():
+        if visible is not None and class_name not in visible:
+            continue
+        day_count, week_count, since_count = counts.get(class_name, (0, 0, 0))
+        line = f"• {class_name}: сегодня {day_count}, за неделю {week_count}"
+        if since is not None:
+            line += f", после активации {since_count}"
+        lines.append(f"{line} из {sizes.get(class_name, 0)}")
+    if len(lines) == 2:
+        lines.append("• классов нет")
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=callbacks.encode(callbacks.MENU, ""))]]
+    await query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard))
 
 # ## MODO Settings
 async def modo_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
     await query.answer()
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT value FROM settings WHERE key = 'modo_url'")
-    modo_url = cursor.fetchone()
-    modo_url = modo_url[0] if modo_url else "Не установлена"
-    cursor.execute("SELECT value FROM settings WHERE key = 'modo_active'")
-    modo_active = cursor.fetchone()
-    modo_active = modo_active[0] if modo_active else "false"
-    conn.close()
+    modo_url = await get_setting('modo_url') or "Не установлена"
+    modo_active = await get_setting('modo_active') or "false"
     active_text = "✅ Да" if modo_active.lower() == 'true' else "❌ Нет"
     text = f"⚙️ Настройки MODO:\n\n🔗 Текущая ссылка: {modo_url}\n🔔 MODO активен: {active_text}"
     keyboard = [
-        [InlineKeyboardButton("✏️ Добавить ссылку на MODO", callback_data="set_modo_url")],
-        [InlineKeyboardButton("❌ Удалить ссылку на MODO", callback_data="remove_modo_url")],
-        [InlineKeyboardButton("✅ Активировать MODO", callback_data="activate_modo")],
-        [InlineKeyboardButton("🚫 Временно деактивировать MODO", callback_data="deactivate_modo")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+        [InlineKeyboardButton("✏️ Добавить ссылку на MODO", callback_data=callbacks.encode(callbacks.SET_MODO_URL))],
+        [InlineKeyboardButton("❌ Удалить ссылку на MODO", callback_data=callbacks.encode(callbacks.REMOVE_MODO_URL))],
+        [InlineKeyboardButton("✅ Активировать MODO", callback_data=callbacks.encode(callbacks.ACTIVATE_MODO))],
+        [InlineKeyboardButton("🚫 Временно деактивировать MODO", callback_data=callbacks.encode(callbacks.DEACTIVATE_MODO))],
+        [InlineKeyboardButton("📣 Рассылка ученикам", callback_data=callbacks.encode(callbacks.BROADCAST_MENU))],
+        [InlineKeyboardButton("🔔 Напомнить не отправившим скриншот", callback_data=callbacks.encode(callbacks.REMIND_NOW))],
+        [InlineKeyboardButton("🔙 Назад", callback_data=callbacks.encode(callbacks.MENU, ""))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(text, reply_markup=reply_markup)
 
 async def set_modo_url_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer()
-    await update.callback_query.message.reply_text("🔗 Введите новую ссылку на MODO:")
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return ConversationHandler.END
+    await query.answer()
+    await query.message.reply_text("🔗 Введите новую ссылку на MODO:")
     return SET_MODO_URL
 
 async def set_modo_url_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not access.is_owner(update.message.from_user.id):
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return ConversationHandler.END
     new_url = update.message.text.strip()
     if not new_url:
         await update.message.reply_text("⚠️ Ссылка не может быть пустой. Попробуйте ещё раз:")
         return SET_MODO_URL
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE settings SET value = ? WHERE key = 'modo_url'", (new_url,))
-    conn.commit()
-    conn.close()
+    await db.execute("UPDATE settings SET value = ? WHERE key = 'modo_url'", (new_url,))
+    cache.invalidate("settings")
     await update.message.reply_text(f"✅ Ссылка на MODO обновлена: {new_url}")
     return ConversationHandler.END
 
 async def remove_modo_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
     await query.answer()
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE settings SET value = NULL WHERE key = 'modo_url'")
-    conn.commit()
-    conn.close()
+    await db.execute("UPDATE settings SET value = NULL WHERE key = 'modo_url'")
+    cache.invalidate("settings")
     await query.edit_message_text("❌ Ссылка на MODO удалена.")
     await modo_settings(update, context)
 
 async def activate_modo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
     await query.answer()
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE settings SET value = 'true' WHERE key = 'modo_active'")
-    conn.commit()
-    conn.close()
-    await query.edit_message_text("✅ MODO активирован.")
+    # Момент активации — начало отсчёта для напоминаний не отправившим скриншот
+    activated_at = datetime.now(ZoneInfo("Asia/Almaty")).strftime("%Y-%m-%d %H:%M")
+    await db.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                         [("modo_active", "true"), ("modo_activated_at", activated_at)])
+    cache.invalidate("settings")
+    await query.edit_message_text("✅ MODO активирован. Напоминания получат ученики, не отправившие скриншот с этого момента.")
     await modo_settings(update, context)
 
 async def deactivate_modo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
     await query.answer()
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE settings SET value = 'false' WHERE key = 'modo_active'")
-    conn.commit()
-    conn.close()
+    await db.execute("UPDATE settings SET value = 'false' WHERE key = 'modo_active'")
+    cache.invalidate("settings")
     await query.edit_message_text("🚫 MODO временно деактивирован.")
     await modo_settings(update, context)
 
+# ## Рассылки и напоминания
+# Время ежедневного напоминания не отправившим скриншот (пусто — без напоминаний)
+REMINDER_TIME = os.environ.get("MODO_REMINDER_TIME", "16:00")
+
+broadcaster = Broadcaster()
+
+async def broadcast_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
+    await query.answer()
+    classes = list((await get_classes()).items())
+    keyboard = [[InlineKeyboardButton("🏫 Всем ученикам", callback_data=callbacks.encode(callbacks.BROADCAST_TO, 0))]]
+    for i in range(0, len(classes), 2):
+        keyboard.append([InlineKeyboardButton(f"📚 {name}", callback_data=callbacks.encode(callbacks.BROADCAST_TO, class_id))
+                         for class_id, name in classes[i:i + 2]])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=callbacks.encode(callbacks.MODO_SETTINGS))])
+    await query.edit_message_text("📣 Кому отправить сообщение?", reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return ConversationHandler.END
+    class_id = callbacks.decode(query.data)[1][0]
+    class_name = (await get_classes()).get(class_id) if class_id else None
+    if class_id and class_name is None:
+        await query.answer("🏫 Класс не найден.", show_alert=True)
+        return ConversationHandler.END
+    await query.answer()
+    context.user_data['broadcast_class'] = class_name
+    target = f"классу {class_name}" if class_name else "всем ученикам"
+    await query.message.reply_text(f"✍️ Введите текст сообщения {target}:")
+    return BROADCAST_TEXT
+
+async def broadcast_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not access.is_owner(update.message.from_user.id):
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return ConversationHandler.END
+    text = update.message.text.strip()
+    if not text:
+        await update.message.reply_text("⚠️ Сообщение не может быть пустым. Попробуйте ещё раз:")
+        return BROADCAST_TEXT
+    class_name = context.user_data.pop('broadcast_class', None)
+    admin_id = update.message.from_user.id
+    broadcast_id, recipients = await broadcaster.create(BROADCAST, f"📣 {text}", class_name, created_by=admin_id)
+    if not recipients:
+        await update.message.reply_text("👥 Нет учеников для рассылки.")
+        return ConversationHandler.END
+    broadcaster.start(context.bot, broadcast_id, f"📣 {text}", admin_id)
+    await update.message.reply_text(f"⏳ Рассылка №{broadcast_id} запущена: получателей {recipients}. "
+                                    f"Сообщу, когда она завершится.")
+    return ConversationHandler.END
+
+# Напоминание ученикам без загрузок после активации MODO; None, если MODO не активен
+async def start_reminder(bot, created_by=None):
+    modo_active = await get_setting('modo_active')
+    activated_at = await get_setting('modo_activated_at')
+    since = db.to_epoch(activated_at)
+    if not modo_active or modo_active.lower() != 'true' or since is None:
+        return None
+    text = f"⏰ Напоминание: вы ещё не отправили скриншот с результатами теста MODO (задание с {activated_at})."
+    broadcast_id, recipients = await broadcaster.create(REMINDER, text, since=since, created_by=created_by)
+    if recipients:
+        broadcaster.start(bot, broadcast_id, text, created_by)
+    return recipients
+
+async def remind_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not access.is_owner(query.from_user.id):
+        await query.answer("🚫 У вас нет доступа.", show_alert=True)
+        return
+    recipients = await start_reminder(context.bot, query.from_user.id)
+    if recipients is None:
+        await query.answer("⚠️ MODO не активирован.", show_alert=True)
+    elif not recipients:
+        await query.answer("✅ Все ученики уже отправили скриншот.", show_alert=True)
+    else:
+        await query.answer(f"🔔 Напоминание отправляется {recipients} ученикам.", show_alert=True)
+
+async def reminder_job(context: ContextTypes.DEFAULT_TYPE):
+    recipients = await start_reminder(context.bot)
+    logging.info(f"Ежедневное напоминание MODO: получателей {recipients}")
+
+async def broadcast_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id not in MAIN_ADMINS:
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return
+    await update.message.reply_text(broadcaster.report())
+
 # ## Меню ученика
 async def student_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT value FROM settings WHERE key = 'modo_active'")
-    modo_active = cursor.fetchone()
-    modo_active = modo_active[0].lower() == 'true' if modo_active else False
-    conn.close()
+    modo_active = await get_setting('modo_active')
+    modo_active = modo_active.lower() == 'true' if modo_active else False
     keyboard = []
     if modo_active:
-        keyboard.append([InlineKeyboardButton("📚 Задания MODO", callback_data="modo_tasks")])
-    keyboard.append([InlineKeyboardButton("📂 Мои скриншоты", callback_data="my_screenshots")])
+        keyboard.append([InlineKeyboardButton("📚 Задания MODO", callback_data=callbacks.encode(callbacks.MODO_TASKS))])
+    keyboard.append([InlineKeyboardButton("📂 Мои скриншоты", callback_data=callbacks.encode(callbacks.MY_SCREENSHOTS))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     chat_id = update.effective_chat.id
     await context.bot.send_message(chat_id, "🎓 Выберите действие:", reply_markup=reply_markup)
@@ -508,17 +940,12 @@ async def modo_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     await query.message.delete()
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT value FROM settings WHERE key = 'modo_url'")
-    modo_url = cursor.fetchone()
-    modo_url = modo_url[0] if modo_url else None
-    conn.close()
+    modo_url = await get_setting('modo_url')
     keyboard = []
     if modo_url:
         keyboard.append([InlineKeyboardButton("🔗 Перейти к заданиям", url=modo_url)])
-    keyboard.append([InlineKeyboardButton("✅ Я прошел тест", callback_data="upload_screenshot")])
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")])
+    keyboard.append([InlineKeyboardButton("✅ Я прошел тест", callback_data=callbacks.encode(callbacks.UPLOAD_SCREENSHOT))])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=callbacks.encode(callbacks.BACK_TO_MENU))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await context.bot.send_message(query.message.chat_id, "📚 Выберите действие:", reply_markup=reply_markup)
 
@@ -529,48 +956,135 @@ async def upload_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(query.message.chat_id, "📷 Пришлите скриншот с результатами теста.")
     return UPLOAD_SCREENSHOT
 
+# Загрузка скриншотов в фоне: ученик сразу получает ответ, а скачивание файлов
+# и запись в базу выполняет пул воркеров очереди загрузок.
+# photos — кортеж пар (file_id, file_unique_id): одно фото или весь альбом
+UploadJob = namedtuple("UploadJob", "bot chat_id user_id photos timestamp created_at")
+
+# Запись скриншотов со ссылками на blob одной транзакцией. Файлы, которые ученик уже
+# присылал, не записываются: возвращается (время прошлых загрузок, сохранённые blob)
+def _store_screenshots(conn, job: UploadJob, files):
+    duplicates, stored = [], []
+    for (file_id, file_unique_id), file_path, blob in files:
+        duplicate = find_duplicate(conn, job.user_id, blob.sha256)
+        if duplicate:
+            duplicates.append(duplicate)
+            continue
+        blob_id = add_reference(conn, blob)
+        db.insert_screenshot(conn, job.user_id, file_path, job.timestamp, file_id, file_unique_id, blob_id,
+                             job.created_at)
+        stored.append(blob)
+    return duplicates, stored
+
+# Удаление временных файлов, которых может уже не быть
+def _discard(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+async def _download_photo(bot, file_id: str, file_unique_id: str) -> Blob:
+    temp_path = blob_store.incoming_path(file_unique_id)
+    try:
+        file = await bot.get_file(file_id)
+        await file.download_to_drive(temp_path)
+        return await blob_store.put(temp_path)
+    finally:
+        # Файл создан incoming_path: после put он уже перенесён в хранилище, после ошибки
+        # скачивания или put (вместе с готовыми копиями) больше не нужен
+        await asyncio.to_thread(_discard, temp_path, images.compressed_path(temp_path), images.thumbnail_path(temp_path))
+
+async def process_upload(job: UploadJob):
+    # Тот же file_unique_id у этого ученика — повтор, файл даже не скачиваем. Строка с тем же
+    # временем загрузки записана прошлой попыткой этого же задания (ошибка сети после фиксации
+    # транзакции): такое фото уже сохранено и повтором не считается
+    photos = list(dict(job.photos).items())
+    unique_ids = [file_unique_id for _, file_unique_id in photos]
+    known = {file_unique_id: (timestamp, created_at) for file_unique_id, timestamp, created_at in await db.fetchall(f"""
+        SELECT file_unique_id, timestamp, created_at FROM screenshots
+        WHERE user_id = ? AND file_unique_id IN ({", ".join("?" * len(unique_ids))})
+    """, (job.user_id, *unique_ids))}
+    duplicates = [known[file_unique_id][0] for _, file_unique_id in photos
+                  if file_unique_id in known and known[file_unique_id][1] != job.created_at]
+    photos = [photo for photo in photos if photo[1] not in known]
+    if photos:
+        result = await db.fetchone("SELECT class FROM students WHERE user_id = ?", (job.user_id,))
+        class_name = result[0] if result else "unknown"
+        # Файлы альбома скачиваются параллельно
+        blobs = await asyncio.gather(*(_download_photo(job.bot, *photo) for photo in photos))
+        # Логический путь: по нему строится структура папок в архивах, байты лежат в blob_store
+        files = [(photo, os.path.join(PHOTOS_DIR, class_name, f"screenshot_{job.user_id}_{photo[0]}.jpg"), blob)
+                 for photo, blob in zip(photos, blobs)]
+        repeated, _ = await db.transaction(_store_screenshots, job, files)
+        duplicates += repeated
+    if duplicates:
+        logging.info(f"Повторная загрузка скриншотов пользователем {job.user_id}: {len(duplicates)}")
+        if len(job.photos) == 1:
+            text = f"♻️ Этот скриншот вы уже отправляли ({duplicates[0]}), повторно он не сохранён."
+        else:
+            text = f"♻️ Скриншотов из альбома, которые вы уже отправляли: {len(duplicates)}, повторно они не сохранены."
+        await job.bot.send_message(job.chat_id, text)
+
+async def upload_failed(job: UploadJob, error: Exception):
+    logging.error(f"Не удалось сохранить скриншот пользователя {job.user_id}: {error}")
+    await job.bot.send_message(job.chat_id, "❌ Не удалось сохранить скриншот. Пожалуйста, отправьте его ещё раз.")
+
+upload_queue = IngestQueue(process_upload, upload_failed)
+
+# Альбом (несколько фото с одним media_group_id) сохраняется одним заданием с одним ответом ученику
+async def save_album(jobs):
+    first = jobs[0]
+    job = first._replace(photos=tuple(photo for item in jobs for photo in item.photos))
+    await upload_queue.submit(job)
+    await job.bot.send_message(job.chat_id, f"✅ Получено скриншотов: {len(job.photos)} (Дата и время: {job.timestamp})\n"
+                                            f"Вы можете просмотреть их в своем профиле.")
+
+albums = AlbumCollector(save_album)
+
+# Фото альбома, который уже начал собираться: первое фото заканчивает диалог загрузки,
+# остальные приходят вне его и ловятся этим фильтром
+class AlbumFilter(filters.MessageFilter):
+    def filter(self, message) -> bool:
+        return message.media_group_id is not None and message.media_group_id in albums
+
+# Все исходящие запросы к Telegram проходят через планировщик с учётом лимитов
+outbound = OutboundScheduler()
+
 async def save_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user_id = update.message.from_user.id
     photo = update.message.photo[-1]
-    file_id = photo.file_id
-    file = await context.bot.get_file(file_id)
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT class FROM students WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    class_name = result[0] if result else "unknown"
-    class_folder = os.path.join(PHOTOS_DIR, class_name)
-    os.makedirs(class_folder, exist_ok=True)
-    file_path = os.path.join(class_folder, f"screenshot_{user_id}_{file_id}.jpg")
-    upload_timestamp = datetime.now(ZoneInfo("Asia/Almaty")).strftime("%Y-%m-%d %H:%M")
-    await file.download_to_drive(file_path)
+    uploaded_at = datetime.now(db.TIMEZONE)
+    upload_timestamp = uploaded_at.strftime(db.TIMESTAMP_FORMAT)
+    job = UploadJob(context.bot, chat_id, user_id, ((photo.file_id, photo.file_unique_id),), upload_timestamp,
+                    int(uploaded_at.timestamp()))
+    if update.message.media_group_id is not None:
+        albums.add(update.message.media_group_id, job)
+        await update.message.delete()
+        return ConversationHandler.END
+    await upload_queue.submit(job)
     await update.message.delete()
-    cursor.execute("INSERT INTO screenshots (user_id, file_path, timestamp) VALUES (?, ?, ?)",
-                   (user_id, file_path, upload_timestamp))
-    conn.commit()
-    conn.close()
-    await context.bot.send_message(chat_id, f"✅ Скриншот сохранен! (Дата и время: {upload_timestamp})\nВы можете просмотреть его в своем профиле.")
+    await context.bot.send_message(chat_id, f"✅ Скриншот получен! (Дата и время: {upload_timestamp})\nВы можете просмотреть его в своем профиле.")
     return ConversationHandler.END
 
 async def my_screenshots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     chat_id = query.message.chat_id
     user_id = query.from_user.id
-    conn = sqlite3.connect('school_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT file_path FROM screenshots WHERE user_id = ?", (user_id,))
-    screenshots = cursor.fetchall()
-    conn.close()
+    screenshots = await db.fetchall("""
+        SELECT sc.id, COALESCE(b.path, sc.file_path), sc.file_id FROM screenshots sc
+        LEFT JOIN blobs b ON b.id = sc.blob_id
+        WHERE sc.user_id = ?
+        ORDER BY sc.id
+    """, (user_id,))
     await query.message.delete()
     if not screenshots:
         await context.bot.send_message(chat_id, "📷 У вас нет загруженных скриншотов.")
         return
     await context.bot.send_message(chat_id, "📂 Ваши загруженные скриншоты:")
-    for (path,) in screenshots:
-        with open(path, 'rb') as photo_file:
-            await context.bot.send_photo(chat_id, photo=photo_file)
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
+    await send_screenshots(context.bot, chat_id, screenshots)
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=callbacks.encode(callbacks.BACK_TO_MENU))]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await context.bot.send_message(chat_id, "⬅️ Вернуться в меню", reply_markup=reply_markup)
 
@@ -580,22 +1094,117 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.delete()
     await student_menu(update, context)
 
+async def upload_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id not in MAIN_ADMINS:
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return
+    await update.message.reply_text(f"{upload_queue.report()}\n• альбомов: {albums.albums}")
+
+async def outbound_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id not in MAIN_ADMINS:
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return
+    await update.message.reply_text(outbound.report())
+
+# Задержки обработчиков и запросов к базе, трафик Bot API
+stats = metrics.Metrics()
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id not in MAIN_ADMINS:
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return
+    if not metrics.ENABLED:
+        await update.message.reply_text("📊 Сбор метрик выключен (METRICS=0).")
+        return
+    await update.message.reply_text(stats.report())
+
+# Обслуживание базы (checkpoint, статистика, очистка, резервная копия) — в отдельном потоке
+db_maintenance = maintenance.Maintenance(db.DB_PATH, maintenance.BACKUP_DIR)
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    report_text = await db_maintenance.run()
+    for admin_id in MAIN_ADMINS:
+        try:
+            await context.bot.send_message(admin_id, report_text, rate_limit_args=BULK)
+        except TelegramError as e:
+            logging.warning(f"Не удалось отправить отчёт об обслуживании базы администратору {admin_id}: {e}")
+
+async def checkpoint_job(context: ContextTypes.DEFAULT_TYPE):
+    result = await db_maintenance.checkpoint()
+    if result:
+        logging.debug(f"WAL checkpoint: {result}")
+
+async def run_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.from_user.id not in MAIN_ADMINS:
+        await update.message.reply_text("🚫 У вас нет доступа к этой команде.")
+        return
+    if db_maintenance.running:
+        await update.message.reply_text("⏳ Обслуживание базы уже идёт.")
+        return
+    progress = await update.message.reply_text("⏳ Обслуживание базы данных...")
+    await progress.edit_text(await db_maintenance.run())
+
+# Запуск фоновых воркеров после инициализации бота
+async def on_startup(application: Application):
+    await db.run(access.load)
+    await archive_cache.start(TEMP_ZIP_DIR)
+    upload_queue.start()
+    await broadcaster.resume(application.bot)
+    if metrics.ENABLED and metrics.PORT:
+        await stats.start_server()
+
+# Дообработка очереди загрузок, пока бот ещё может обращаться к Telegram
+async def on_stop(application: Application):
+    await broadcaster.stop()
+    await archive_cache.stop()
+    await albums.flush()
+    await upload_queue.drain()
+
+# Закрытие пула соединений с базой при остановке бота
+async def on_shutdown(application: Application):
+    await stats.stop_server()
+    await photo_storage.close()
+    images.shutdown()
+    db.close()
+
 # ## Главная функция
-def main():
-    application = ApplicationBuilder().token("7147486797:AAGqeja-HW0NkuvjnUfS35GoUuqgiqlHoOM").build()
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "7147486797:AAGqeja-HW0NkuvjnUfS35GoUuqgiqlHoOM")
+
+# Режим webhook включается заданием публичного адреса WEBHOOK_URL; без него — long polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+
+# Сборка приложения со всеми обработчиками; base_url или request позволяют направить
+# запросы к Bot API на локальный тестовый сервер
+def build_application(token: str = BOT_TOKEN, base_url: str = None, concurrency: int = CONCURRENCY,
+                      request=None) -> Application:
+    builder = (ApplicationBuilder().token(token).concurrent_updates(PerUserUpdateProcessor(concurrency))
+               .rate_limiter(outbound)
+               .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown))
+    if base_url:
+        builder = builder.base_url(base_url)
+    if metrics.ENABLED:
+        # Счётчик трафика оборачивает транспорт (по умолчанию — тот же HTTPXRequest, что создал бы PTB)
+        request = metrics.MeteredRequest(request or HTTPXRequest(connection_pool_size=256), stats)
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
 
     registration_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             GET_FIRST_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_first_name)],
             GET_LAST_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_last_name)],
-            GET_CLASS: [CallbackQueryHandler(get_class)]
+            GET_CLASS: [CallbackQueryHandler(get_class, pattern=callbacks.matches(callbacks.PICK_CLASS))]
         },
         fallbacks=[]
     )
 
     admin_class_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(admin_add_class, pattern='^add_class$')],
+        entry_points=[CallbackQueryHandler(admin_add_class, pattern=callbacks.matches(callbacks.ADD_CLASS))],
         states={
             ADD_CLASS: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_class)]
         },
@@ -603,7 +1212,7 @@ def main():
     )
 
     admin_admin_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(admin_add_admin, pattern='^add_admin$')],
+        entry_points=[CallbackQueryHandler(admin_add_admin, pattern=callbacks.matches(callbacks.ADD_ADMIN))],
         states={
             ADD_ADMIN_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_admin_id)],
             ADD_ADMIN_ACCESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_admin_access)]
@@ -612,45 +1221,103 @@ def main():
     )
 
     screenshot_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(upload_screenshot, pattern='^upload_screenshot$')],
+        entry_points=[CallbackQueryHandler(upload_screenshot, pattern=callbacks.matches(callbacks.UPLOAD_SCREENSHOT))],
         states={
             UPLOAD_SCREENSHOT: [MessageHandler(filters.PHOTO, save_screenshot)]
         },
         fallbacks=[]
     )
 
+    roster_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(import_roster_start, pattern=callbacks.matches(callbacks.IMPORT_ROSTER))],
+        states={
+            IMPORT_ROSTER: [MessageHandler(filters.Document.ALL, import_roster_file)]
+        },
+        fallbacks=[]
+    )
+
+    broadcast_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(broadcast_start, pattern=callbacks.matches(callbacks.BROADCAST_TO))],
+        states={
+            BROADCAST_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_save)]
+        },
+        fallbacks=[]
+    )
+
     modo_url_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(set_modo_url_start, pattern='^set_modo_url$')],
+        entry_points=[CallbackQueryHandler(set_modo_url_start, pattern=callbacks.matches(callbacks.SET_MODO_URL))],
         states={
             SET_MODO_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_modo_url_save)]
         },
         fallbacks=[]
     )
 
+    # Все кнопки, кроме точек входа диалогов, — через одну таблицу по тегу callback_data
+    router = callbacks.CallbackRouter()
+    router.add(callbacks.MANAGE_ADMINS, manage_admins)
+    router.add(callbacks.MENU, back_to_main)
+    router.add(callbacks.CLASS, show_class_students)
+    router.add(callbacks.STUDENT, show_student_profile)
+    router.add(callbacks.SCREENSHOT, view_screenshot)
+    router.add(callbacks.DOWNLOAD_STUDENT, download_student)
+    router.add(callbacks.DOWNLOAD_CLASS, download_class)
+    router.add(callbacks.DOWNLOAD_ALL, download_all_photos)
+    router.add(callbacks.SUBMISSIONS, submissions)
+    router.add(callbacks.REPORT, send_report)
+    router.add(callbacks.MODO_TASKS, modo_tasks)
+    router.add(callbacks.MY_SCREENSHOTS, my_screenshots)
+    router.add(callbacks.BACK_TO_MENU, back_to_menu)
+    router.add(callbacks.MODO_SETTINGS, modo_settings)
+    router.add(callbacks.REMOVE_MODO_URL, remove_modo_url)
+    router.add(callbacks.ACTIVATE_MODO, activate_modo)
+    router.add(callbacks.DEACTIVATE_MODO, deactivate_modo)
+    router.add(callbacks.BROADCAST_MENU, broadcast_menu)
+    router.add(callbacks.REMIND_NOW, remind_now)
+
     application.add_handler(registration_handler)
     application.add_handler(CommandHandler("sqlallget", sql_all_get))
+    application.add_handler(CommandHandler("cachestats", cache_stats))
+    application.add_handler(CommandHandler("uploads", upload_stats))
+    application.add_handler(CommandHandler("outbound", outbound_stats))
+    application.add_handler(CommandHandler("stats", show_stats))
+    application.add_handler(CommandHandler("maintenance", run_maintenance))
+    application.add_handler(CommandHandler("find", find_student))
+    application.add_handler(CommandHandler("menu", student_menu))
     application.add_handler(admin_class_handler)
     application.add_handler(admin_admin_handler)
-    application.add_handler(CallbackQueryHandler(manage_admins, pattern='^manage_admins$'))
-    application.add_handler(CallbackQueryHandler(back_to_main, pattern='^back_to_main$'))
-    application.add_handler(CallbackQueryHandler(show_class_students, pattern='^class_'))
-    application.add_handler(CallbackQueryHandler(show_student_profile, pattern='^student_'))
-    application.add_handler(CallbackQueryHandler(view_screenshot, pattern='^view_screenshot_'))
-    application.add_handler(CallbackQueryHandler(download_student, pattern='^download_student_'))
-    application.add_handler(CallbackQueryHandler(download_class, pattern='^download_class_'))
-    application.add_handler(CallbackQueryHandler(download_all_photos, pattern='^download_all_photos$'))
-    application.add_handler(CommandHandler("menu", student_menu))
-    application.add_handler(CallbackQueryHandler(modo_tasks, pattern='^modo_tasks$'))
-    application.add_handler(CallbackQueryHandler(my_screenshots, pattern='^my_screenshots$'))
-    application.add_handler(CallbackQueryHandler(back_to_menu, pattern='^back_to_menu$'))
     application.add_handler(screenshot_handler)
-    application.add_handler(CallbackQueryHandler(modo_settings, pattern='^modo_settings$'))
-    application.add_handler(CallbackQueryHandler(remove_modo_url, pattern='^remove_modo_url$'))
-    application.add_handler(CallbackQueryHandler(activate_modo, pattern='^activate_modo$'))
-    application.add_handler(CallbackQueryHandler(deactivate_modo, pattern='^deactivate_modo$'))
+    application.add_handler(MessageHandler(filters.PHOTO & AlbumFilter(), save_screenshot))
     application.add_handler(modo_url_handler)
+    application.add_handler(CommandHandler("broadcasts", broadcast_stats))
+    application.add_handler(broadcast_handler)
+    application.add_handler(roster_handler)
+    application.add_handler(router)
+
+    if metrics.ENABLED:
+        stats.instrument(application)
+        db.set_observer(stats.observe_query)
 
-    application.run_polling()
+    if REMINDER_TIME:
+        hour, minute = map(int, REMINDER_TIME.split(":"))
+        application.job_queue.run_daily(reminder_job, dtime(hour, minute, tzinfo=ZoneInfo("Asia/Almaty")),
+                                        name="modo_reminder")
+    if maintenance.MAINTENANCE_TIME:
+        hour, minute = map(int, maintenance.MAINTENANCE_TIME.split(":"))
+        application.job_queue.run_daily(maintenance_job, dtime(hour, minute, tzinfo=db.TIMEZONE), name="db_maintenance")
+    if maintenance.CHECKPOINT_INTERVAL:
+        application.job_queue.run_repeating(checkpoint_job, maintenance.CHECKPOINT_INTERVAL,
+                                            first=maintenance.CHECKPOINT_INTERVAL, name="db_checkpoint")
+    return application
+
+def main():
+    application = build_application()
+    if WEBHOOK_URL:
+        logging.info(f"Запуск в режиме webhook: {WEBHOOK_URL}, порт {WEBHOOK_PORT}")
+        application.run_webhook(listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, url_path=WEBHOOK_PATH,
+                                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                                secret_token=WEBHOOK_SECRET)
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
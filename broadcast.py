@@ -0,0 +1,152 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import db
+import callbacks
+from outbound import BULK
+
+# Сколько получателей забирается из очереди доставки за один шаг
+BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "25"))
+# Сколько при остановке бота ждать отправки уже начатой партии, секунды
+STOP_TIMEOUT = 30
+TIMEZONE = ZoneInfo("Asia/Almaty")
+
+BROADCAST = "broadcast"
+REMINDER = "reminder"
+
+
+def now() -> str:
+    return datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M")
+
+
+# Получатели выбираются одним запросом по множеству учеников (класс или вся школа);
+# для напоминания — только те, у кого нет загрузок после момента активации задания
+# (since — секунды UTC, проверка по индексу screenshots (user_id, created_at))
+def _audience_sql(class_name, since) -> str:
+    conditions = ["s.user_id IS NOT NULL"]
+    if class_name is not None:
+        conditions.append("s.class = :class")
+    if since is not None:
+        conditions.append("NOT EXISTS (SELECT 1 FROM screenshots sc WHERE sc.user_id = s.user_id AND sc.created_at >= :since)")
+    return f"SELECT s.user_id FROM students s WHERE {' AND '.join(conditions)}"
+
+
+# Создание рассылки вместе со списком получателей (вызывать внутри транзакции)
+def create_broadcast(conn, kind: str, text: str, class_name=None, since=None, created_by=None):
+    broadcast_id = conn.execute('''
+        INSERT INTO broadcasts (kind, class, text, created_by, created_at) VALUES (?, ?, ?, ?, ?)
+    ''', (kind, class_name, text, created_by, now())).lastrowid
+    recipients = conn.execute(
+        f"INSERT INTO deliveries (broadcast_id, user_id) SELECT :broadcast, user_id FROM ({_audience_sql(class_name, since)})",
+        {"broadcast": broadcast_id, "class": class_name, "since": since}).rowcount
+    if not recipients:
+        conn.execute("UPDATE broadcasts SET finished_at = ? WHERE id = ?", (now(), broadcast_id))
+    return broadcast_id, recipients
+
+
+# Следующая партия получателей помечается 'sending' до отправки
+def _claim_batch(conn, broadcast_id: int, size: int):
+    user_ids = [row[0] for row in conn.execute(
+        "SELECT user_id FROM deliveries WHERE broadcast_id = ? AND status = 'pending' LIMIT ?",
+        (broadcast_id, size))]
+    conn.executemany("UPDATE deliveries SET status = 'sending' WHERE broadcast_id = ? AND user_id = ?",
+                     [(broadcast_id, user_id) for user_id in user_ids])
+    return user_ids
+
+
+# Незавершённые рассылки после перезапуска. Получатели, отправка которым прервалась
+# на середине ('sending'), помечаются 'unknown' и повторно не получают сообщение
+def _interrupted(conn):
+    conn.execute("UPDATE deliveries SET status = 'unknown' WHERE status = 'sending'")
+    return conn.execute("SELECT id, text, created_by FROM broadcasts WHERE finished_at IS NULL ORDER BY id").fetchall()
+
+
+# Доставка рассылок партиями в фоне с учётом статуса каждого получателя в базе
+class Broadcaster:
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+        self._tasks = {}
+        self._stopping = asyncio.Event()
+        self.sent = 0
+        self.failed = 0
+
+    async def create(self, kind: str, text: str, class_name=None, since=None, created_by=None):
+        return await db.transaction(create_broadcast, kind, text, class_name, since, created_by)
+
+    def start(self, bot, broadcast_id: int, text: str, created_by=None):
+        task = asyncio.create_task(self._deliver(bot, broadcast_id, text, created_by), name=f"broadcast-{broadcast_id}")
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    # Продолжить рассылки, прерванные остановкой бота
+    async def resume(self, bot):
+        for broadcast_id, text, created_by in await db.transaction(_interrupted):
+            logging.info(f"Продолжаю рассылку №{broadcast_id}")
+            self.start(bot, broadcast_id, text, created_by)
+
+    # Остановка: начатые партии досылаются, новые не берутся, остальные получатели остаются 'pending'
+    # и получат сообщение после перезапуска. Партия, не успевшая за timeout, прерывается —
+    # её получатели помечаются 'unknown', как после сбоя
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        self._stopping.set()
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send(self, bot, user_id: int, text: str, markup) -> str:
+        try:
+            await bot.send_message(user_id, text, reply_markup=markup, rate_limit_args=BULK)
+            return "sent"
+        except Forbidden:
+            return "blocked"
+        except RetryAfter:
+            return "pending"
+        except TelegramError as e:
+            logging.error(f"Не удалось отправить сообщение рассылки пользователю {user_id}: {e}")
+            return "failed"
+
+    async def _deliver(self, bot, broadcast_id: int, text: str, created_by):
+        try:
+            await self._deliver_batches(bot, broadcast_id, text, created_by)
+        except Exception:
+            logging.exception(f"Ошибка рассылки №{broadcast_id}")
+
+    async def _deliver_batches(self, bot, broadcast_id: int, text: str, created_by):
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("📚 Задания MODO", callback_data=callbacks.encode(callbacks.MODO_TASKS))]])
+        while True:
+            if self._stopping.is_set():
+                logging.info(f"Рассылка №{broadcast_id} приостановлена до перезапуска")
+                return
+            user_ids = await db.transaction(_claim_batch, broadcast_id, self.batch_size)
+            if not user_ids:
+                break
+            statuses = await asyncio.gather(*(self._send(bot, user_id, text, markup) for user_id in user_ids))
+            sent_at = now()
+            await db.executemany("UPDATE deliveries SET status = ?, sent_at = ? WHERE broadcast_id = ? AND user_id = ?",
+                                 [(status, sent_at if status == "sent" else None, broadcast_id, user_id)
+                                  for user_id, status in zip(user_ids, statuses)])
+            self.sent += statuses.count("sent")
+            self.failed += sum(status in ("blocked", "failed") for status in statuses)
+        await db.execute("UPDATE broadcasts SET finished_at = ? WHERE id = ?", (now(), broadcast_id))
+        counts = dict(await db.fetchall("SELECT status, COUNT(*) FROM deliveries WHERE broadcast_id = ? GROUP BY status",
+                                        (broadcast_id,)))
+        logging.info(f"Рассылка №{broadcast_id} завершена: {counts}")
+        if created_by:
+            await bot.send_message(created_by, f"✅ Рассылка №{broadcast_id} завершена: доставлено {counts.get('sent', 0)}, "
+                                               f"заблокировали бота {counts.get('blocked', 0)}, "
+                                               f"ошибок {counts.get('failed', 0)}, "
+                                               f"прервано при перезапуске {counts.get('unknown', 0)}.")
+
+    def report(self) -> str:
+        return (f"📣 Рассылки:\n"
+                f"• выполняется: {len(self._tasks)}\n"
+                f"• доставлено: {self.sent}, не доставлено: {self.failed}")
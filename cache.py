@@ -0,0 +1,52 @@
+import logging
+
+
+# Кэш со сквозным чтением: значение загружается при первом обращении и живёт
+# до явной инвалидации. Ключ может быть кортежем (группа, ...): invalidate(группа)
+# сбрасывает все ключи группы, счётчики попаданий/промахов ведутся по группам.
+class ReadThroughCache:
+    def __init__(self, name: str):
+        self.name = name
+        self._values = {}
+        self._generation = 0
+        self.hits = {}
+        self.misses = {}
+
+    async def get(self, key, loader):
+        group = _group(key)
+        if key in self._values:
+            self.hits[group] = self.hits.get(group, 0) + 1
+            return self._values[key]
+        self.misses[group] = self.misses.get(group, 0) + 1
+        generation = self._generation
+        value = await loader()
+        # Не сохраняем значение, если кэш инвалидировали, пока оно загружалось
+        if generation == self._generation:
+            self._values[key] = value
+        return value
+
+    def invalidate(self, *keys):
+        self._generation += 1
+        if not keys:
+            self._values.clear()
+        for key in [key for key in self._values if key in keys or _group(key) in keys]:
+            del self._values[key]
+        logging.info(f"Кэш {self.name}: сброшены ключи {', '.join(map(str, keys)) or 'все'}")
+
+    def stats(self):
+        keys = sorted(set(self.hits) | set(self.misses), key=str)
+        return [(key, self.hits.get(key, 0), self.misses.get(key, 0)) for key in keys]
+
+    def report(self) -> str:
+        lines = [f"🗄 Кэш {self.name}:"]
+        for key, hits, misses in self.stats():
+            total = hits + misses
+            ratio = hits / total * 100 if total else 0
+            lines.append(f"• {key}: попаданий {hits}, промахов {misses} ({ratio:.1f}%)")
+        if len(lines) == 1:
+            lines.append("• пока нет обращений")
+        return "\n".join(lines)
+
+
+def _group(key):
+    return key[0] if isinstance(key, tuple) else key
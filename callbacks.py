@@ -0,0 +1,203 @@
+import base64
+import binascii
+from collections import namedtuple
+
+from telegram.ext import CallbackQueryHandler
+
+# Формат callback_data: "~" + base64url без "=" от байтов
+#   [версия][тег][поля...]
+# int — zigzag-varint, bool — один байт, str — длина varint + UTF-8.
+# Классы и ученики передаются по id, поэтому длина не зависит от названий.
+# Тег кнопки не меняется никогда: по нему разбираются кнопки в уже отправленных сообщениях.
+# При несовместимом изменении формата увеличивается VERSION — старые кнопки считаются устаревшими
+VERSION = 1
+PREFIX = "~"
+# Ограничение Telegram на callback_data, байты
+MAX_LENGTH = 64
+
+Route = namedtuple("Route", "tag name fields")
+
+ROUTES = {}
+# Кнопки без полей из старых сообщений ("modo_tasks", "back_to_menu", ...) — по имени маршрута
+LEGACY = {}
+
+
+class CallbackDataError(ValueError):
+    pass
+
+
+def route(tag: int, name: str, *fields) -> Route:
+    if tag in ROUTES or not 0 < tag < 256:
+        raise ValueError(f"Тег кнопки {tag} занят или вне диапазона")
+    ROUTES[tag] = item = Route(tag, name, fields)
+    if not fields:
+        LEGACY[name] = item
+    return item
+
+
+# Меню администратора
+MENU = route(1, "back_to_main", str)                # токен страницы списка классов
+CLASS = route(2, "class", int, str)                 # id класса, токен страницы учеников
+STUDENT = route(3, "student", int, str)             # id ученика, токен страницы скриншотов
+SCREENSHOT = route(4, "view_screenshot", int)       # id скриншота
+DOWNLOAD_STUDENT = route(5, "download_student", int, bool)  # user_id ученика, сжатые
+DOWNLOAD_CLASS = route(6, "download_class", int, bool)      # id класса, сжатые
+DOWNLOAD_ALL = route(7, "download_all_photos", bool)        # сжатые
+ADD_CLASS = route(8, "add_class")
+IMPORT_ROSTER = route(9, "import_roster")
+MANAGE_ADMINS = route(10, "manage_admins")
+ADD_ADMIN = route(11, "add_admin")
+SUBMISSIONS = route(12, "submissions")
+REPORT = route(13, "report", int, bool)             # id класса (0 — вся школа), XLSX
+# Настройки MODO и рассылки
+MODO_SETTINGS = route(20, "modo_settings")
+SET_MODO_URL = route(21, "set_modo_url")
+REMOVE_MODO_URL = route(22, "remove_modo_url")
+ACTIVATE_MODO = route(23, "activate_modo")
+DEACTIVATE_MODO = route(24, "deactivate_modo")
+BROADCAST_MENU = route(25, "broadcast_menu")
+BROADCAST_TO = route(26, "broadcast_to", int)       # id класса, 0 — всем ученикам
+REMIND_NOW = route(27, "remind_now")
+# Ученик
+PICK_CLASS = route(40, "pick_class", int)           # id класса при регистрации
+MODO_TASKS = route(41, "modo_tasks")
+MY_SCREENSHOTS = route(42, "my_screenshots")
+UPLOAD_SCREENSHOT = route(43, "upload_screenshot")
+BACK_TO_MENU = route(44, "back_to_menu")
+
+
+def _varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(raw: bytes, pos: int):
+    value = shift = 0
+    while True:
+        byte = raw[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise CallbackDataError("Слишком длинное число")
+
+
+def encode(item: Route, *values) -> str:
+    if len(values) != len(item.fields):
+        raise CallbackDataError(f"{item.name}: ожидается полей {len(item.fields)}, передано {len(values)}")
+    out = bytearray((VERSION, item.tag))
+    for kind, value in zip(item.fields, values):
+        if kind is bool:
+            out.append(1 if value else 0)
+        elif kind is int:
+            _varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+        else:
+            raw = value.encode()
+            _varint(out, len(raw))
+            out += raw
+    data = PREFIX + base64.urlsafe_b64encode(out).rstrip(b"=").decode("ascii")
+    if len(data) > MAX_LENGTH:
+        raise CallbackDataError(f"{item.name}: callback_data длиннее {MAX_LENGTH} байт")
+    return data
+
+
+# (маршрут, значения полей) или None для чужих, устаревших и повреждённых данных
+def decode(data: str):
+    if not data.startswith(PREFIX):
+        legacy = LEGACY.get(data)
+        return (legacy, ()) if legacy else None
+    try:
+        raw = base64.urlsafe_b64decode(data[1:] + "=" * (-(len(data) - 1) % 4))
+        if len(raw) < 2 or raw[0] != VERSION:
+            return None
+        item = ROUTES.get(raw[1])
+        if item is None:
+            return None
+        values = []
+        pos = 2
+        for kind in item.fields:
+            if kind is bool:
+                values.append(raw[pos] != 0)
+                pos += 1
+            elif kind is int:
+                value, pos = _read_varint(raw, pos)
+                values.append(value >> 1 if not value & 1 else -((value + 1) >> 1))
+            else:
+                size, pos = _read_varint(raw, pos)
+                if pos + size > len(raw):
+                    return None
+                values.append(raw[pos:pos + size].decode())
+                pos += size
+        if pos != len(raw):
+            return None
+        return item, tuple(values)
+    except (binascii.Error, IndexError, UnicodeDecodeError, CallbackDataError):
+        return None
+
+
+# Тег без разбора полей: первые 4 символа base64 — это байты версии, тега и первого поля
+def _tag(data: str):
+    head = data[1:5]
+    try:
+        raw = base64.urlsafe_b64decode(head + "=" * (-len(head) % 4))
+    except binascii.Error:
+        return None
+    return raw[1] if len(raw) > 1 and raw[0] == VERSION else None
+
+
+# Условие для CallbackQueryHandler точки входа диалога: pattern=matches(ADD_CLASS).
+# Каждое нажатие проверяется всеми точками входа, поэтому кнопка без полей сравнивается
+# со строкой целиком, а с полями — сначала по тегу
+def matches(item: Route):
+    if not item.fields:
+        constants = frozenset((encode(item), item.name))
+        return lambda data: data in constants
+
+    def check(data) -> bool:
+        return (isinstance(data, str) and data.startswith(PREFIX) and _tag(data) == item.tag
+                and decode(data) is not None)
+    return check
+
+
+# Один обработчик для всех кнопок: callback_data разбирается один раз, обработчик
+# выбирается по тегу из словаря и получает значения полей аргументами:
+#   await callback(update, context, *values)
+# Маршруты точек входа диалогов сюда не добавляются — их ловят ConversationHandler'ы.
+# Кнопки старого формата или другой версии получают ответ вместо вечной «загрузки»
+class CallbackRouter(CallbackQueryHandler):
+    def __init__(self, block=True):
+        self.routes = {}
+        super().__init__(self._dispatch, pattern=self._match, block=block)
+
+    def add(self, item: Route, callback):
+        self.routes[item.tag] = callback
+
+    def _match(self, data):
+        if not isinstance(data, str):
+            return None
+        decoded = decode(data)
+        if decoded is None:
+            return STALE
+        if decoded[0].tag not in self.routes:
+            return None
+        return decoded
+
+    def collect_additional_context(self, context, update, application, check_result):
+        pass
+
+    async def handle_update(self, update, application, check_result, context):
+        if check_result is STALE:
+            await update.callback_query.answer("⚠️ Кнопка устарела. Откройте меню заново.", show_alert=True)
+            return None
+        item, values = check_result
+        return await self.routes[item.tag](update, context, *values)
+
+    async def _dispatch(self, update, context):
+        return await self.handle_update(update, None, self._match(update.callback_query.data), context)
+
+
+STALE = (None, ())
@@ -0,0 +1,431 @@
+import os
+import queue
+import sqlite3
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Путь к базе и размер пула соединений
+DB_PATH = os.environ.get("SCHOOL_BOT_DB", "school_bot.db")
+POOL_SIZE = int(os.environ.get("SCHOOL_BOT_DB_POOL", "4"))
+# Сколько подготовленных выражений держит каждое соединение
+STATEMENT_CACHE_SIZE = 256
+# До какого размера укорачивается файл WAL после checkpoint, байты
+WAL_SIZE_LIMIT = int(os.environ.get("SCHOOL_BOT_WAL_LIMIT_MB", "64")) * 1024 * 1024
+# Время загрузок хранится дважды: текстом в часовом поясе школы (для показа)
+# и секундами UTC в screenshots.created_at (для выборок по периодам через индекс)
+TIMEZONE = ZoneInfo("Asia/Almaty")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M"
+
+
+# Секунды UTC для времени в формате TIMESTAMP_FORMAT по часовому поясу школы; None, если не разобрать
+def to_epoch(timestamp):
+    try:
+        return int(datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(tzinfo=TIMEZONE).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+# Открытие соединения с настройками для многопоточной работы (WAL, кэш выражений).
+# auto_vacuum действует только для нового файла, поэтому задаётся до перехода в WAL
+# (для существующей базы — maintenance.py vacuum)
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                           check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+# Пул долгоживущих соединений: каждое соединение живёт в своём рабочем потоке,
+# корутины ставят задания в общую очередь и ждут результат, не блокируя цикл событий
+class Database:
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._jobs = queue.SimpleQueue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.observer = None
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.size):
+                thread = threading.Thread(target=self._worker, name=f"db-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        conn = connect(self.path)
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                func, args, future, loop = job
+                observer = self.observer
+                started = time.perf_counter()
+                try:
+                    result = func(conn, *args)
+                except BaseException as e:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    if observer is not None:
+                        observer(_describe(func, args), time.perf_counter() - started, True)
+                    loop.call_soon_threadsafe(_set_exception, future, e)
+                else:
+                    if observer is not None:
+                        observer(_describe(func, args), time.perf_counter() - started, False)
+                    loop.call_soon_threadsafe(_set_result, future, result)
+        finally:
+            # Статистика по таблицам, к которым обращалось соединение (рекомендация SQLite при закрытии)
+            conn.execute("PRAGMA optimize")
+            conn.close()
+
+    # Выполнить func(conn, *args) в одном из рабочих потоков
+    async def run(self, func, *args):
+        if not self._threads:
+            self._start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((func, args, future, loop))
+        return await future
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(_fetchone, sql, params)
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.run(_fetchall, sql, params)
+
+    # Изменяющий запрос; возвращает lastrowid
+    async def execute(self, sql: str, params=()):
+        return await self.run(_execute, sql, params)
+
+    async def executemany(self, sql: str, seq):
+        return await self.run(_executemany, sql, seq)
+
+    # Выполнить func(conn, *args) внутри одной транзакции BEGIN IMMEDIATE ... COMMIT
+    async def transaction(self, func, *args):
+        return await self.run(_transaction, func, *args)
+
+    # Функция observer(подпись, секунды, ошибка) вызывается после каждого задания в рабочем потоке
+    def set_observer(self, observer):
+        self.observer = observer
+
+    def close(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join()
+
+
+# Подпись задания для метрик: текст SQL для простых запросов, иначе имя функции
+def _describe(func, args) -> str:
+    if func in (_fetchone, _fetchall, _execute, _executemany):
+        return args[0]
+    if func is _transaction:
+        func = args[0]
+    return getattr(func, "__name__", "query")
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _execute(conn, sql, params):
+    return conn.execute(sql, params).lastrowid
+
+
+# Соединения в режиме автокоммита (isolation_level=None), и `with conn` транзакцию не открывает:
+# весь пакет выполняется в одной BEGIN IMMEDIATE ... COMMIT, иначе каждая строка — отдельный коммит
+def _executemany(conn, sql, seq):
+    return _transaction(conn, _rowcount, sql, seq)
+
+
+def _rowcount(conn, sql, seq):
+    return conn.executemany(sql, seq).rowcount
+
+
+def _transaction(conn, func, *args):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = func(conn, *args)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return result
+
+
+# Инициализация базы данных
+def init_db(path: str = DB_PATH):
+    conn = connect(path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            first_name TEXT,
+            last_name TEXT,
+            class TEXT,
+            username TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS classes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            username TEXT,
+            class_access TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS screenshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            file_path TEXT,
+            timestamp TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    # Денормализованные счётчики загрузок для списка учеников класса
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS student_stats (
+            user_id INTEGER PRIMARY KEY,
+            upload_count INTEGER NOT NULL DEFAULT 0,
+            last_upload TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_screenshots_user ON screenshots (user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_class ON students (class)")
+    # Инициализация настроек MODO
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('modo_url', 'https://class-kz.ru/ucheniku/modo-4-klass/')")
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('modo_active', 'true')")
+    migrate(conn)
+    conn.close()
+    logging.info(f"База данных {path} инициализирована.")
+
+
+# Однократное заполнение student_stats по уже существующим скриншотам
+def _backfill_student_stats(conn):
+    conn.execute('''
+        INSERT OR REPLACE INTO student_stats (user_id, upload_count, last_upload)
+        SELECT user_id, COUNT(*), MAX(timestamp) FROM screenshots GROUP BY user_id
+    ''')
+
+
+# Telegram file_id для повторной отправки без загрузки байтов. Для старых строк
+# file_id восстанавливается из имени файла screenshot_<user_id>_<file_id>.jpg
+def _add_screenshot_file_ids(conn):
+    conn.execute("ALTER TABLE screenshots ADD COLUMN file_id TEXT")
+    conn.execute("ALTER TABLE screenshots ADD COLUMN file_unique_id TEXT")
+    updates = []
+    for sc_id, user_id, file_path in conn.execute("SELECT id, user_id, file_path FROM screenshots").fetchall():
+        prefix = f"screenshot_{user_id}_"
+        name = os.path.basename(file_path or "")
+        if name.startswith(prefix) and name.endswith(".jpg"):
+            updates.append((name[len(prefix):-len(".jpg")], sc_id))
+    conn.executemany("UPDATE screenshots SET file_id = ? WHERE id = ?", updates)
+
+
+# Хранилище по содержимому: одинаковые байты хранятся один раз, screenshots.file_path
+# остаётся логическим путём photos/<класс>/<имя> (по нему строится структура архивов)
+def _add_blobs(conn):
+    conn.execute('''
+        CREATE TABLE blobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sha256 TEXT UNIQUE NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("ALTER TABLE screenshots ADD COLUMN blob_id INTEGER REFERENCES blobs (id)")
+    conn.execute("CREATE INDEX idx_screenshots_file_unique ON screenshots (user_id, file_unique_id)")
+
+
+# Рассылки и напоминания: список получателей фиксируется при создании рассылки,
+# статус доставки каждому ученику хранится, чтобы после перезапуска продолжить с места остановки
+def _add_broadcasts(conn):
+    conn.execute('''
+        CREATE TABLE broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            class TEXT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE deliveries (
+            broadcast_id INTEGER NOT NULL REFERENCES broadcasts (id),
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            sent_at TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX idx_deliveries_status ON deliveries (broadcast_id, status)")
+
+
+# Ученики из импортированного списка ещё без user_id: при /start они находятся по username
+def _add_student_username_index(conn):
+    conn.execute("CREATE INDEX idx_students_username ON students (username COLLATE NOCASE)")
+
+
+# Доступ администраторов к классам: строка через запятую в admins.class_access переносится
+# в таблицу admin_classes, в class_access остаётся только признак 'all'
+def _add_admin_classes(conn):
+    conn.execute('''
+        CREATE TABLE admin_classes (
+            user_id INTEGER NOT NULL,
+            class TEXT NOT NULL,
+            PRIMARY KEY (user_id, class)
+        ) WITHOUT ROWID
+    ''')
+    rows = []
+    for user_id, class_access in conn.execute("SELECT user_id, class_access FROM admins WHERE class_access != 'all'").fetchall():
+        rows.extend((user_id, name.strip()) for name in (class_access or "").split(",") if name.strip())
+    conn.executemany("INSERT OR IGNORE INTO admin_classes (user_id, class) VALUES (?, ?)", rows)
+    conn.execute("UPDATE admins SET class_access = NULL WHERE class_access != 'all'")
+
+
+# Числовое время загрузки с индексами для выборок «сегодня / за неделю / после активации»
+# по всей школе и по ученикам класса; старые строки заполняются разбором текстового времени
+def _add_screenshot_epochs(conn):
+    conn.execute("ALTER TABLE screenshots ADD COLUMN created_at INTEGER")
+    conn.create_function("to_epoch", 1, to_epoch, deterministic=True)
+    conn.execute("UPDATE screenshots SET created_at = to_epoch(timestamp)")
+    conn.execute("CREATE INDEX idx_screenshots_created ON screenshots (created_at)")
+    conn.execute("CREATE INDEX idx_screenshots_user_created ON screenshots (user_id, created_at)")
+
+
+# Полнотекстовый поиск учеников по имени, фамилии и username: внешний FTS5-индекс
+# над students с префиксными индексами, синхронизируется триггерами
+def _add_student_search(conn):
+    conn.execute('''
+        CREATE VIRTUAL TABLE students_fts USING fts5 (
+            first_name, last_name, username,
+            content = 'students', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER students_fts_insert AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, first_name, last_name, username)
+            VALUES (new.id, new.first_name, new.last_name, new.username);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER students_fts_delete AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, first_name, last_name, username)
+            VALUES ('delete', old.id, old.first_name, old.last_name, old.username);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER students_fts_update AFTER UPDATE OF first_name, last_name, username ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, first_name, last_name, username)
+            VALUES ('delete', old.id, old.first_name, old.last_name, old.username);
+            INSERT INTO students_fts (rowid, first_name, last_name, username)
+            VALUES (new.id, new.first_name, new.last_name, new.username);
+        END
+    ''')
+    conn.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+# Порядок строк отчёта (report.SQL): класс, фамилия, имя — без сортировки во временном дереве
+def _add_student_order_index(conn):
+    conn.execute("CREATE INDEX idx_students_class_name ON students (class, last_name, first_name)")
+
+
+# Миграции данных по порядку; номер последней применённой хранится в PRAGMA user_version
+MIGRATIONS = [
+    _backfill_student_stats,
+    _add_screenshot_file_ids,
+    _add_blobs,
+    _add_broadcasts,
+    _add_student_username_index,
+    _add_admin_classes,
+    _add_screenshot_epochs,
+    _add_student_search,
+    _add_student_order_index,
+]
+
+
+def _apply_migration(conn, migration, number: int):
+    migration(conn)
+    conn.execute(f"PRAGMA user_version = {number}")
+
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        _transaction(conn, _apply_migration, migration, number)
+        logging.info(f"Применена миграция базы данных №{number}: {migration.__name__}")
+
+
+# Сохранение скриншота вместе с обновлением счётчиков ученика (вызывать внутри транзакции)
+def insert_screenshot(conn, user_id: int, file_path: str, timestamp: str,
+                      file_id: str = None, file_unique_id: str = None, blob_id: int = None, created_at: int = None):
+    if created_at is None:
+        created_at = to_epoch(timestamp)
+    screenshot_id = conn.execute('''
+        INSERT INTO screenshots (user_id, file_path, timestamp, file_id, file_unique_id, blob_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, file_path, timestamp, file_id, file_unique_id, blob_id, created_at)).lastrowid
+    conn.execute('''
+        INSERT INTO student_stats (user_id, upload_count, last_upload) VALUES (?, 1, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            upload_count = upload_count + 1,
+            last_upload = MAX(COALESCE(last_upload, ''), excluded.last_upload)
+    ''', (user_id, timestamp))
+    return screenshot_id
+
+
+# Общий пул соединений бота
+_pool = Database()
+run = _pool.run
+fetchone = _pool.fetchone
+fetchall = _pool.fetchall
+execute = _pool.execute
+executemany = _pool.executemany
+transaction = _pool.transaction
+set_observer = _pool.set_observer
+close = _pool.close
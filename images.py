@@ -0,0 +1,132 @@
+import os
+import sys
+import shutil
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен — обработка изображений отключена
+    Image = None
+
+# Обработка после загрузки: сжатая копия без метаданных и миниатюра рядом с оригиналом
+ENABLED = Image is not None and os.environ.get("IMAGE_PIPELINE", "1") != "0"
+QUALITY = int(os.environ.get("IMAGE_QUALITY", "75"))
+MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", "1600"))
+THUMBNAIL_SIZE = int(os.environ.get("IMAGE_THUMBNAIL_SIZE", "320"))
+PROCESSES = int(os.environ.get("IMAGE_PROCESSES", str(os.cpu_count() or 1)))
+
+COMPRESSED_SUFFIX = ".compressed.jpg"
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+
+_pool = None
+
+
+def compressed_path(path: str) -> str:
+    return os.path.splitext(path)[0] + COMPRESSED_SUFFIX
+
+
+def thumbnail_path(path: str) -> str:
+    return os.path.splitext(path)[0] + THUMBNAIL_SUFFIX
+
+
+def is_variant(path: str) -> bool:
+    return path.endswith(COMPRESSED_SUFFIX) or path.endswith(THUMBNAIL_SUFFIX)
+
+
+# Обработка одного файла (выполняется в отдельном процессе).
+# Возвращает (размер оригинала, размер сжатой копии).
+def process_image(path: str, quality: int = QUALITY, max_dimension: int = MAX_DIMENSION,
+                  thumbnail_size: int = THUMBNAIL_SIZE):
+    with Image.open(path) as source:
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    image.thumbnail((max_dimension, max_dimension))
+    target = compressed_path(path)
+    # Сохранение без exif/icc: метаданные в копию не попадают
+    image.save(target + ".tmp", "JPEG", quality=quality, optimize=True, progressive=True)
+    # Если перекодирование не уменьшило файл, сжатой копией служит сам оригинал
+    if os.path.getsize(target + ".tmp") >= os.path.getsize(path):
+        shutil.copyfile(path, target + ".tmp")
+    os.replace(target + ".tmp", target)
+    image.thumbnail((thumbnail_size, thumbnail_size))
+    image.save(thumbnail_path(path), "JPEG", quality=quality, optimize=True)
+    return os.path.getsize(path), os.path.getsize(target)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PROCESSES)
+    return _pool
+
+
+# Обработка загруженного файла в пуле процессов, не блокируя цикл событий
+async def process(path: str):
+    if not ENABLED:
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), process_image, path)
+    except Exception as e:
+        logging.error(f"Ошибка обработки изображения {path}: {e}")
+        return None
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+# Оригиналы в дереве фотографий, для которых ещё нет сжатой копии (или все при force)
+def _originals(root: str, force: bool):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if is_variant(path) or not filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                continue
+            if force or not os.path.exists(compressed_path(path)):
+                yield path
+
+
+# Повторная обработка существующего дерева photos/ параллельно во всех процессах
+def backfill(root: str, processes: int = PROCESSES, force: bool = False):
+    original_total = compressed_total = done = failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(process_image, path): path for path in _originals(root, force)}
+        for future in as_completed(futures):
+            try:
+                original, compressed = future.result()
+            except Exception as e:
+                failed += 1
+                logging.error(f"Ошибка обработки изображения {futures[future]}: {e}")
+                continue
+            done += 1
+            original_total += original
+            compressed_total += compressed
+    return done, failed, original_total, compressed_total
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Сжатие и миниатюры для уже сохранённых скриншотов")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("root", nargs="?", default="photos")
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--force", action="store_true", help="обработать заново и уже сжатые файлы")
+    args = parser.parse_args()
+    if Image is None:
+        sys.exit("Для обработки изображений нужен Pillow: pip install Pillow")
+    done, failed, original, compressed = backfill(args.root, args.processes, args.force)
+    saved = original - compressed
+    ratio = saved / original * 100 if original else 0
+    print(f"Обработано файлов: {done}, ошибок: {failed}")
+    print(f"Оригиналы: {original / 1048576:.1f} МБ, сжатые: {compressed / 1048576:.1f} МБ, "
+          f"экономия: {saved / 1048576:.1f} МБ ({ratio:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
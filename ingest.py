@@ -0,0 +1,168 @@
+import os
+import time
+import asyncio
+import logging
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+# Число параллельных загрузок и максимальная длина очереди
+WORKERS = int(os.environ.get("INGEST_WORKERS", "4"))
+QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "1000"))
+# Повторы при временных ошибках Telegram
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 1.0
+# Сообщения альбома приходят отдельными апдейтами почти одновременно: альбом считается
+# собранным, если за это время (секунды) не пришло новых фото
+ALBUM_WINDOW = float(os.environ.get("INGEST_ALBUM_WINDOW", "1.0"))
+# Сколько помнить отданный альбом, чтобы опоздавшие фото собрались во вторую партию, а не потерялись
+ALBUM_MEMORY = 60
+
+
+# retry_after в разных версиях python-telegram-bot — число секунд или timedelta
+def seconds(value) -> float:
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+# Ограниченная очередь фоновой обработки с пулом асинхронных воркеров.
+# process(job) вызывается для каждого задания; временные ошибки сети повторяются
+# с экспоненциальной задержкой, RetryAfter — через указанное Telegram время.
+# on_failure(job, error) вызывается, если задание так и не удалось выполнить.
+class IngestQueue:
+    def __init__(self, process, on_failure=None, workers: int = WORKERS, maxsize: int = QUEUE_SIZE):
+        self.process = process
+        self.on_failure = on_failure
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize)
+        self._tasks = []
+        self.processed = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(), name=f"ingest-{i}") for i in range(self.workers)]
+
+    # Поставить задание в очередь; при заполненной очереди ждёт свободного места
+    async def submit(self, job):
+        await self._queue.put((time.monotonic(), job))
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    # Сколько ждёт самое старое задание в очереди
+    @property
+    def oldest_wait(self) -> float:
+        if self._queue.empty():
+            return 0.0
+        return time.monotonic() - self._queue._queue[0][0]
+
+    async def _worker(self):
+        while True:
+            enqueued, job = await self._queue.get()
+            self.last_lag = time.monotonic() - enqueued
+            self.max_lag = max(self.max_lag, self.last_lag)
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                await self.process(job)
+                self.processed += 1
+                return
+            except RetryAfter as e:
+                error, delay = e, seconds(e.retry_after)
+            except (BadRequest, Forbidden) as e:
+                # BadRequest — подкласс NetworkError, но повтор не поможет (файл слишком большой,
+                # неверный file_id, бот заблокирован)
+                error, delay = e, None
+                logging.warning(f"Задание {job} отклонено Telegram: {e}")
+            except NetworkError as e:
+                error, delay = e, RETRY_DELAY * 2 ** (attempt - 1)
+            except Exception as e:
+                error, delay = e, None
+                logging.exception(f"Ошибка обработки задания {job}")
+            if delay is None or attempt == MAX_ATTEMPTS:
+                break
+            self.retries += 1
+            logging.warning(f"Временная ошибка ({error}), повтор {attempt}/{MAX_ATTEMPTS - 1} через {delay:.1f} с")
+            await asyncio.sleep(delay)
+        self.failed += 1
+        if self.on_failure is not None:
+            try:
+                await self.on_failure(job, error)
+            except Exception as e:
+                logging.error(f"Ошибка уведомления о неудачном задании: {e}")
+
+    # Корректное завершение: дождаться обработки очереди (не дольше timeout) и остановить воркеров
+    async def drain(self, timeout: float = 60):
+        if self._tasks:
+            logging.info(f"Завершаю очередь загрузок: осталось заданий {self.depth}.")
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logging.error(f"Очередь загрузок не успела опустеть, потеряно заданий: {self.depth}.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def report(self) -> str:
+        return (f"📥 Очередь загрузок:\n"
+                f"• в очереди: {self.depth} (старейшее ждёт {self.oldest_wait:.1f} с)\n"
+                f"• задержка: последняя {self.last_lag:.2f} с, максимальная {self.max_lag:.2f} с\n"
+                f"• обработано: {self.processed}, ошибок: {self.failed}, повторов: {self.retries}")
+
+
+# Сборщик альбомов: элементы с одним media_group_id копятся, пока поступают не реже
+# чем раз в window секунд, затем вся группа одним списком передаётся в on_album(items)
+class AlbumCollector:
+    def __init__(self, on_album, window: float = ALBUM_WINDOW):
+        self.on_album = on_album
+        self.window = window
+        self._items = {}
+        self._timers = {}
+        self._recent = {}
+        self._tasks = set()
+        self.albums = 0
+
+    # Относится ли сообщение к альбому, который собирается или был недавно отдан
+    def __contains__(self, media_group_id) -> bool:
+        if media_group_id in self._items:
+            return True
+        return self._recent.get(media_group_id, 0) > time.monotonic()
+
+    def add(self, media_group_id, item):
+        self._items.setdefault(media_group_id, []).append(item)
+        timer = self._timers.get(media_group_id)
+        if timer is not None:
+            timer.cancel()
+        self._timers[media_group_id] = asyncio.get_running_loop().call_later(self.window, self._flush, media_group_id)
+
+    def _flush(self, media_group_id):
+        self._timers.pop(media_group_id).cancel()
+        items = self._items.pop(media_group_id)
+        now = time.monotonic()
+        self._recent = {key: expires for key, expires in self._recent.items() if expires > now}
+        self._recent[media_group_id] = now + ALBUM_MEMORY
+        self.albums += 1
+        task = asyncio.create_task(self._deliver(items), name=f"album-{media_group_id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, items):
+        try:
+            await self.on_album(items)
+        except Exception:
+            logging.exception(f"Ошибка обработки альбома из {len(items)} фото")
+
+    # Отдать все недособранные альбомы сразу (при остановке бота)
+    async def flush(self):
+        for media_group_id in list(self._items):
+            self._flush(media_group_id)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from collections import namedtuple
+
+import db
+
+# Ночное обслуживание базы: время запуска (часовой пояс школы), пустая строка — не запускать
+MAINTENANCE_TIME = os.environ.get("DB_MAINTENANCE_TIME", "04:00")
+# Как часто переносить WAL в основной файл базы, секунды (0 — не переносить)
+CHECKPOINT_INTERVAL = int(os.environ.get("DB_CHECKPOINT_INTERVAL", "300"))
+# Резервные копии: каталог, сколько хранить, по сколько страниц копировать за шаг
+BACKUP_DIR = os.environ.get("DB_BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.environ.get("DB_BACKUP_KEEP", "7"))
+BACKUP_PAGES = int(os.environ.get("DB_BACKUP_PAGES", "256"))
+# Сколько свободных страниц возвращать системе за один шаг incremental_vacuum
+VACUUM_PAGES = int(os.environ.get("DB_VACUUM_PAGES", "512"))
+# Пауза между шагами копирования и очистки, секунды: запросы бота успевают пройти без очереди к диску
+STEP_PAUSE = float(os.environ.get("DB_MAINTENANCE_PAUSE", "0.005"))
+# Сколько строк индекса просматривает PRAGMA optimize при пересборке статистики
+ANALYSIS_LIMIT = 400
+
+BACKUP_PREFIX = "school_bot-"
+
+Step = namedtuple("Step", "name seconds detail")
+
+
+# Размеры файла базы и WAL, байты
+def sizes(path: str = db.DB_PATH):
+    result = []
+    for name in (path, f"{path}-wal"):
+        try:
+            result.append(os.path.getsize(name))
+        except OSError:
+            result.append(0)
+    return tuple(result)
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} МБ"
+
+
+# Перенос WAL в основной файл без ожидания: страницы, которые ещё читают открытые транзакции,
+# останутся до следующего раза. Файл WAL укорачивается до journal_size_limit (db.connect)
+def checkpoint(conn) -> str:
+    busy, log, done = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    if log < 0:
+        # (1, -1, -1) — в этот момент WAL переносит другое соединение (автоматический checkpoint)
+        return "пропущен: идёт другой checkpoint" if busy else "база не в режиме WAL"
+    return f"перенесено {done} из {log} стр." + (", WAL занят читателями" if done < log else "")
+
+
+# Статистика для планировщика запросов. Первый раз — ANALYZE всех таблиц, дальше PRAGMA optimize
+# пересчитывает только изменившиеся. Оба смотрят не больше ANALYSIS_LIMIT строк каждого индекса,
+# поэтому транзакция записи остаётся короткой и на большой базе
+def optimize(conn) -> str:
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        conn.execute("ANALYZE")
+        return "ANALYZE всех таблиц"
+    conn.execute("PRAGMA optimize")
+    return "PRAGMA optimize"
+
+
+# Возврат свободных страниц системе короткими транзакциями по pages страниц.
+# Работает только с auto_vacuum=INCREMENTAL: новые базы создаются так (db.connect),
+# существующую нужно один раз перевести командой `python maintenance.py vacuum`
+def incremental_vacuum(conn, pages: int = VACUUM_PAGES, pause: float = STEP_PAUSE) -> str:
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return "недоступна (auto_vacuum не INCREMENTAL, см. maintenance.py vacuum)"
+    start = free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free:
+        # execute выполняет только первый шаг прагмы (одну страницу), executescript — всю прагму
+        conn.executescript(f"PRAGMA incremental_vacuum({pages})")
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        time.sleep(pause)
+    return f"освобождено {start} стр."
+
+
+# Онлайн-копия через backup API по pages страниц за шаг. Источник держит открытую читающую
+# транзакцию: копия получается целостным снимком, а запись в базу (WAL) при этом не блокируется
+# и не заставляет копирование начинаться заново. Копия пишется во временный файл,
+# проверяется quick_check и только потом получает своё имя
+def backup(conn, backup_dir: str = BACKUP_DIR, pages: int = BACKUP_PAGES, pause: float = STEP_PAUSE,
+           keep: int = BACKUP_KEEP) -> str:
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{BACKUP_PREFIX}{datetime.now(db.TIMEZONE).strftime('%Y%m%d-%H%M%S')}.db"
+    path = os.path.join(backup_dir, name)
+    tmp_path = f"{path}.tmp"
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        time.sleep(pause)
+
+    target = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("BEGIN")
+        try:
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            conn.backup(target, pages=pages, progress=progress)
+        finally:
+            conn.execute("COMMIT")
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        target.close()
+    if check != "ok":
+        os.remove(tmp_path)
+        raise sqlite3.DatabaseError(f"Резервная копия не прошла quick_check: {check}")
+    os.replace(tmp_path, path)
+    removed = _rotate(backup_dir, keep)
+    return f"{name}, {_megabytes(os.path.getsize(path))}, шагов {steps}" + (f", удалено старых {removed}" if removed else "")
+
+
+# Удаление старых копий сверх keep (имена сортируются по времени создания)
+def _rotate(backup_dir: str, keep: int) -> int:
+    names = sorted(name for name in os.listdir(backup_dir) if name.startswith(BACKUP_PREFIX) and name.endswith(".db"))
+    old = names[:-keep] if keep > 0 else []
+    for name in old:
+        os.remove(os.path.join(backup_dir, name))
+    return len(old)
+
+
+# Все шаги обслуживания по очереди на отдельном соединении (выполняется в потоке, не в пуле db).
+# Ошибка одного шага записывается в отчёт и не отменяет остальные
+def run(path: str = db.DB_PATH, backup_dir: str = BACKUP_DIR, with_backup: bool = True):
+    before = sizes(path)
+    steps = []
+    conn = db.connect(path)
+    try:
+        actions = [("WAL checkpoint", checkpoint), ("Статистика", optimize), ("Очистка", incremental_vacuum)]
+        if with_backup:
+            actions.append(("Резервная копия", lambda conn: backup(conn, backup_dir)))
+        actions.append(("WAL checkpoint", checkpoint))
+        for name, action in actions:
+            started = time.perf_counter()
+            try:
+                detail = action(conn)
+            except sqlite3.Error as e:
+                logging.exception(f"Обслуживание базы: шаг «{name}» завершился ошибкой")
+                detail = f"ошибка: {e}"
+            steps.append(Step(name, time.perf_counter() - started, detail))
+    finally:
+        conn.close()
+    return before, sizes(path), steps
+
+
+def format_report(before, after, steps) -> str:
+    lines = ["🛠 Обслуживание базы данных:"]
+    for name, seconds, detail in steps:
+        mark = "❌" if detail.startswith("ошибка") else "•"
+        lines.append(f"{mark} {name}: {seconds:.2f} с — {detail}")
+    lines.append(f"💾 База: {_megabytes(before[0])} → {_megabytes(after[0])}")
+    lines.append(f"📝 WAL: {_megabytes(before[1])} → {_megabytes(after[1])}")
+    return "\n".join(lines)
+
+
+# Обслуживание из бота: работа идёт в отдельном потоке, одновременно выполняется
+# только одно обслуживание или checkpoint
+class Maintenance:
+    def __init__(self, path: str = db.DB_PATH, backup_dir: str = BACKUP_DIR):
+        self.path = path
+        self.backup_dir = backup_dir
+        self._lock = asyncio.Lock()
+        self.last_report = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, with_backup: bool = True) -> str:
+        async with self._lock:
+            before, after, steps = await asyncio.to_thread(run, self.path, self.backup_dir, with_backup)
+        self.last_report = format_report(before, after, steps)
+        total = sum(step.seconds for step in steps)
+        logging.info(f"Обслуживание базы за {total:.2f} с, WAL {_megabytes(before[1])} → {_megabytes(after[1])}")
+        return self.last_report
+
+    # Периодический checkpoint; пропускается, пока идёт полное обслуживание
+    async def checkpoint(self):
+        if self.running:
+            return None
+        async with self._lock:
+            return await asyncio.to_thread(_checkpoint, self.path)
+
+
+def _checkpoint(path: str) -> str:
+    conn = db.connect(path)
+    try:
+        return checkpoint(conn)
+    finally:
+        conn.close()
+
+
+# Однократный перевод существующей базы на auto_vacuum=INCREMENTAL: полный VACUUM
+# переписывает весь файл и блокирует запись, поэтому запускается при остановленном боте
+def enable_incremental_vacuum(path: str):
+    conn = db.connect(path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    parser.add_argument("command", choices=["run", "backup", "vacuum"],
+                        help="run — все шаги, backup — только копия, vacuum — включить incremental vacuum")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--backup-dir", default=BACKUP_DIR)
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        sys.exit(f"База данных {args.db} не найдена")
+    if args.command == "run":
+        print(format_report(*run(args.db, args.backup_dir)))
+    elif args.command == "backup":
+        conn = db.connect(args.db)
+        try:
+            print(backup(conn, args.backup_dir))
+        finally:
+            conn.close()
+    elif enable_incremental_vacuum(args.db):
+        print(f"auto_vacuum=INCREMENTAL включён, размер базы {_megabytes(sizes(args.db)[0])}")
+    else:
+        print("auto_vacuum=INCREMENTAL уже включён")
+
+
+if __name__ == '__main__':
+    main()
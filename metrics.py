@@ -0,0 +1,270 @@
+import os
+import time
+import bisect
+import asyncio
+import logging
+import functools
+import threading
+
+from telegram.request import BaseRequest
+
+# Сбор метрик включён по умолчанию: на обработчик или запрос к базе уходит пара микросекунд
+ENABLED = os.environ.get("METRICS", "1") != "0"
+# Порт для Prometheus (0 — не запускать); слушается только локальный адрес
+PORT = int(os.environ.get("METRICS_PORT", "0"))
+HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Длина подписи SQL-запроса в отчёте и метках
+LABEL_LENGTH = 80
+
+
+# Гистограмма длительностей с фиксированными корзинами: память не растёт с числом замеров
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    # Оценка квантиля линейной интерполяцией внутри корзины
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+def _size(size: int) -> str:
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} КБ"
+    return f"{size / 1024 / 1024:.2f} МБ"
+
+
+def _line(name: str, h: Histogram) -> str:
+    errors = f", ошибок {h.errors}" if h.errors else ""
+    return f"• {name}: {h.count}, {_ms(h.quantile(0.5))}/{_ms(h.quantile(0.95))}/{_ms(h.max)}{errors}"
+
+
+# Метрики бота: задержки обработчиков и запросов к базе, трафик Bot API.
+# Запросы к базе замеряются в рабочих потоках пула, поэтому запись идёт под блокировкой
+class Metrics:
+    def __init__(self):
+        self.handlers = {}
+        self.queries = {}
+        self.traffic = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._labels = {}
+        self._server = None
+
+    def _observe(self, table, name: str, seconds: float, error: bool):
+        with self._lock:
+            histogram = table.get(name)
+            if histogram is None:
+                histogram = table[name] = Histogram()
+            histogram.observe(seconds, error)
+
+    def observe_handler(self, name: str, seconds: float, error: bool = False):
+        self._observe(self.handlers, name, seconds, error)
+
+    # Подпись запроса — SQL в одну строку (обрезанный) или имя функции транзакции
+    def observe_query(self, label: str, seconds: float, error: bool = False):
+        name = self._labels.get(label)
+        if name is None:
+            name = " ".join(label.split())
+            if len(name) > LABEL_LENGTH:
+                name = name[:LABEL_LENGTH - 1] + "…"
+            self._labels[label] = name
+        self._observe(self.queries, name, seconds, error)
+
+    def add_traffic(self, direction: str, kind: str, size: int):
+        key = direction, kind
+        with self._lock:
+            self.traffic[key] = self.traffic.get(key, 0) + size
+
+    def wrap(self, callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            error = True
+            try:
+                result = await callback(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                self.observe_handler(name, time.perf_counter() - started, error)
+        return timed
+
+    # Обернуть колбэки всех обработчиков приложения, включая шаги ConversationHandler
+    # и обработчики кнопок в таблице CallbackRouter
+    def instrument(self, application):
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                self._instrument(handler)
+
+    def _instrument(self, handler):
+        if hasattr(handler, "entry_points"):
+            for inner in [*handler.entry_points, *handler.fallbacks,
+                          *(h for state in handler.states.values() for h in state)]:
+                self._instrument(inner)
+        elif hasattr(handler, "routes"):
+            for tag, callback in handler.routes.items():
+                if not getattr(callback, "_metered", False):
+                    handler.routes[tag] = self.wrap(callback)
+                    handler.routes[tag]._metered = True
+        elif not getattr(handler.callback, "_metered", False):
+            handler.callback = self.wrap(handler.callback)
+            handler.callback._metered = True
+
+    def _snapshot(self, table):
+        with self._lock:
+            return sorted(((name, histogram) for name, histogram in table.items()),
+                          key=lambda item: item[1].sum, reverse=True)
+
+    def report(self, limit: int = 10) -> str:
+        lines = ["⏱ Обработчики (по суммарному времени): n, p50/p95/макс мс"]
+        for name, h in self._snapshot(self.handlers)[:limit]:
+            lines.append(_line(name, h))
+        if not self.handlers:
+            lines.append("• пока нет вызовов")
+        lines.append("")
+        lines.append("🗃 Запросы к базе (по суммарному времени): n, p50/p95/макс мс")
+        for name, h in self._snapshot(self.queries)[:limit]:
+            lines.append(_line(name, h))
+        if not self.queries:
+            lines.append("• пока нет запросов")
+        lines.append("")
+        lines.append("📶 Трафик Bot API:")
+        for (direction, kind), size in sorted(self.traffic.items()):
+            arrow = "⬆️ отправлено" if direction == "up" else "⬇️ получено"
+            what = "файлы" if kind == "file" else "запросы"
+            lines.append(f"• {arrow} ({what}): {_size(size)}")
+        if not self.traffic:
+            lines.append("• пока нет запросов")
+        uptime = int(time.time() - self.started)
+        lines.append(f"\nСбор с момента запуска: {uptime // 3600} ч {uptime % 3600 // 60} мин")
+        return "\n".join(lines)
+
+    # Текстовый формат Prometheus (version 0.0.4)
+    def prometheus(self) -> str:
+        lines = []
+        for metric, label, table in (("bot_handler_seconds", "handler", self.handlers),
+                                     ("bot_db_query_seconds", "query", self.queries)):
+            lines.append(f"# TYPE {metric} histogram")
+            errors = []
+            for name, h in self._snapshot(table):
+                labels = f'{label}="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), h.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{labels}}} {h.sum}")
+                lines.append(f"{metric}_count{{{labels}}} {h.count}")
+                errors.append(f"{metric.replace('_seconds', '_errors_total')}{{{labels}}} {h.errors}")
+            lines.append(f"# TYPE {metric.replace('_seconds', '_errors_total')} counter")
+            lines.extend(errors)
+        lines.append("# TYPE bot_api_bytes_total counter")
+        for (direction, kind), size in sorted(self.traffic.items()):
+            lines.append(f'bot_api_bytes_total{{direction="{direction}",kind="{kind}"}} {size}')
+        return "\n".join(lines) + "\n"
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            if request.split()[1:2] == [b"/metrics"]:
+                status, body = "200 OK", self.prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self, port: int = PORT, host: str = HOST):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        logging.info(f"Метрики Prometheus: http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+def _upload_size(request_data) -> int:
+    if request_data is None:
+        return 0
+    size = len(request_data.json_payload)
+    for _, content, *_ in request_data.multipart_data.values():
+        if isinstance(content, bytes):
+            size += len(content)
+        else:
+            try:
+                size += os.fstat(content.fileno()).st_size
+            except (AttributeError, OSError, ValueError):
+                pass
+    return size
+
+
+# Обёртка над транспортом Bot API, считающая байты в обе стороны;
+# скачивание файлов (/file/bot...) учитывается отдельно от вызовов методов
+class MeteredRequest(BaseRequest):
+    def __init__(self, inner: BaseRequest, metrics: Metrics):
+        self.inner = inner
+        self.metrics = metrics
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        kind = "file" if "/file/bot" in url else "api"
+        self.metrics.add_traffic("up", "file" if request_data and request_data.contains_files else kind,
+                                 _upload_size(request_data))
+        status, payload = await self.inner.do_request(url, method, request_data, read_timeout=read_timeout,
+                                                      write_timeout=write_timeout, connect_timeout=connect_timeout,
+                                                      pool_timeout=pool_timeout)
+        self.metrics.add_traffic("down", kind, len(payload))
+        return status, payload
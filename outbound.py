@@ -0,0 +1,205 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from ingest import seconds
+
+# Лимиты Telegram на исходящие сообщения: общий на бота, на личный чат и на группу
+GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.environ.get("OUTBOUND_CHAT_RATE", "1"))
+CHAT_BURST = float(os.environ.get("OUTBOUND_CHAT_BURST", "3"))
+GROUP_RATE = float(os.environ.get("OUTBOUND_GROUP_RATE", str(20 / 60)))
+MAX_RETRIES = 3
+MAX_TRACKED_CHATS = 10000
+
+# Приоритеты: ответы на действия пользователя обгоняют массовую отправку
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "ответы", BULK: "массовые"}
+
+# Методы, на которые распространяются лимиты сообщений
+LIMITED_PREFIXES = ("send", "forward", "copy", "edit")
+
+
+# Ведро токенов: rate токенов в секунду, не больше burst накопленных
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # Через сколько секунд будет доступно cost токенов (0 — уже сейчас)
+    def delay(self, cost: float = 1) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+    # Дорогой запрос (альбом) уводит ведро в минус, и следующие подождут дольше
+    def take(self, cost: float = 1):
+        self.tokens -= cost
+
+
+# Планировщик исходящих запросов к Bot API (подключается как rate_limiter приложения).
+# Каждый запрос сначала ждёт свободного места в лимите своего чата, затем — общего лимита;
+# очередь к общему лимиту упорядочена по приоритету (rate_limit_args=BULK для массовой
+# отправки), внутри приоритета — по порядку поступления. На RetryAfter чат (или весь бот,
+# если запрос без чата) приостанавливается на указанное время, и запрос повторяется.
+class OutboundScheduler(BaseRateLimiter):
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: float = CHAT_BURST, group_rate: float = GROUP_RATE, max_retries: int = MAX_RETRIES):
+        # Без накопления: общий лимит соблюдается в любом окне длиной в секунду
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats = {}
+        self._chat_locks = {}
+        self._paused_until = 0.0
+        self._chat_paused_until = {}
+        self._heap = []
+        self._pauses = 0
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self.requests = {}
+        self.wait_total = {}
+        self.wait_max = {}
+        self.throttled = 0
+        self.flood_errors = 0
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound-dispatcher")
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for _, _, future, _, _ in self._heap:
+            future.cancel()
+        self._heap.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_TRACKED_CHATS:
+                self._forget_idle_chats()
+            # Отрицательный chat_id (или @username канала) — группа или канал
+            group = not str(chat_id).lstrip("-").isdigit() or int(chat_id) < 0
+            bucket = TokenBucket(self.group_rate, 1) if group else TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    # Чаты, которые давно ничего не получали, лимит уже не сдерживает
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items()
+                        if now - bucket.updated > bucket.burst / bucket.rate
+                        and not self._chat_locks[chat_id].locked()
+                        and self._chat_paused_until.get(chat_id, 0) < now]:
+            del self._chats[chat_id]
+            del self._chat_locks[chat_id]
+            self._chat_paused_until.pop(chat_id, None)
+
+    # Ожидание места в лимите чата; запросы одного чата проходят по очереди
+    async def _acquire_chat(self, chat_id, cost: int) -> bool:
+        bucket = self._chat_bucket(chat_id)
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        throttled = False
+        async with lock:
+            while True:
+                delay = max(bucket.delay(cost), self._chat_paused_until.get(chat_id, 0) - time.monotonic())
+                if delay <= 0:
+                    break
+                throttled = True
+                await asyncio.sleep(delay)
+            bucket.take(min(cost, bucket.burst))
+        return throttled
+
+    # Ожидание места в общем лимите через очередь с приоритетом
+    async def _acquire_global(self, priority: int, cost: int) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._counter), future, cost, self._pauses))
+        self._wakeup.set()
+        return await future
+
+    async def _dispatch(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, _, future, cost, pauses = self._heap[0]
+            if future.done():
+                heapq.heappop(self._heap)
+                continue
+            delay = max(self.global_bucket.delay(cost), self._paused_until - time.monotonic())
+            if delay > 0:
+                self._pauses += 1
+                # Новый запрос с более высоким приоритетом займёт первое место в очереди
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            self.global_bucket.take(cost)
+            # Запрос придержан, если с момента постановки в очередь лимит хоть раз заставил ждать
+            future.set_result(pauses != self._pauses)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args if rate_limit_args in PRIORITY_NAMES else INTERACTIVE
+        chat_id = data.get("chat_id")
+        cost = len(data["media"]) if endpoint == "sendMediaGroup" and data.get("media") else 1
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            throttled = False
+            if chat_id is not None:
+                throttled = await self._acquire_chat(chat_id, cost)
+            throttled = await self._acquire_global(priority, cost) or throttled
+            self._record(priority, time.monotonic() - started, throttled)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.flood_errors += 1
+                if attempt == self.max_retries:
+                    raise
+                delay = seconds(e.retry_after)
+                logging.warning(f"Flood control Telegram ({endpoint}, чат {chat_id}): пауза {delay:.0f} с")
+                until = time.monotonic() + delay
+                if chat_id is None:
+                    self._paused_until = max(self._paused_until, until)
+                else:
+                    self._chat_paused_until[chat_id] = max(self._chat_paused_until.get(chat_id, 0), until)
+
+    def _record(self, priority: int, wait: float, throttled: bool):
+        self.requests[priority] = self.requests.get(priority, 0) + 1
+        self.wait_total[priority] = self.wait_total.get(priority, 0.0) + wait
+        self.wait_max[priority] = max(self.wait_max.get(priority, 0.0), wait)
+        if throttled:
+            self.throttled += 1
+
+    def report(self) -> str:
+        lines = ["📤 Исходящие сообщения:"]
+        for priority, name in PRIORITY_NAMES.items():
+            count = self.requests.get(priority, 0)
+            average = self.wait_total.get(priority, 0.0) / count if count else 0.0
+            lines.append(f"• {name}: {count}, ожидание среднее {average:.2f} с, "
+                         f"максимальное {self.wait_max.get(priority, 0.0):.2f} с")
+        lines.append(f"• в очереди: {len(self._heap)}")
+        lines.append(f"• придержано до лимита (предотвращённые 429): {self.throttled}")
+        lines.append(f"• получено 429 от Telegram: {self.flood_errors}")
+        return "\n".join(lines)
@@ -0,0 +1,46 @@
+from collections import namedtuple
+
+from telegram import InlineKeyboardButton
+
+import db
+
+# Сколько строк показывать на одной странице клавиатуры
+PAGE_SIZE = 20
+
+Page = namedtuple("Page", "rows has_prev has_next")
+
+
+# Постраничный вывод по ключу (keyset): страница выбирается условием id > ? / id < ?
+# и LIMIT, без OFFSET, поэтому стоимость не зависит от номера страницы.
+# sql должен содержать {op} и {order} и заканчиваться параметрами ключа и лимита:
+#   "SELECT id, ... FROM t WHERE x = ? AND id {op} ? ORDER BY id {order} LIMIT ?"
+# Первый столбец строки — ключ. Позиция — строка-токен, которую кнопки навигации
+# передают в callback_data: ">ключ" — страница после ключа, "<ключ" — перед ключом.
+class KeysetPaginator:
+    def __init__(self, sql: str, page_size: int = PAGE_SIZE):
+        self.sql = sql
+        self.page_size = page_size
+
+    async def fetch(self, params=(), token: str = "") -> Page:
+        if token.startswith("<"):
+            rows = await db.fetchall(self.sql.format(op="<", order="DESC"),
+                                     (*params, int(token[1:]), self.page_size + 1))
+            return Page(rows[:self.page_size][::-1], len(rows) > self.page_size, True)
+        after = int(token[1:]) if token.startswith(">") else None
+        if after is None:
+            sql = self.sql.format(op=">=", order="ASC")
+            after = -1 << 63
+        else:
+            sql = self.sql.format(op=">", order="ASC")
+        rows = await db.fetchall(sql, (*params, after, self.page_size + 1))
+        return Page(rows[:self.page_size], token.startswith(">"), len(rows) > self.page_size)
+
+    # Ряд кнопок «◀️ / ▶️» для страницы (пустой список, если листать некуда);
+    # data(token) возвращает callback_data кнопки
+    def navigation(self, page: Page, data):
+        row = []
+        if page.rows and page.has_prev:
+            row.append(InlineKeyboardButton("◀️", callback_data=data(f"<{page.rows[0][0]}")))
+        if page.rows and page.has_next:
+            row.append(InlineKeyboardButton("▶️", callback_data=data(f">{page.rows[-1][0]}")))
+        return [row] if row else []
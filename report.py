@@ -0,0 +1,84 @@
+import csv
+from datetime import datetime
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl не установлен — отчёт только в CSV
+    openpyxl = None
+
+import db
+
+# Столбцы отчёта; первые четыре совпадают с форматом импорта списка учеников (roster.py)
+HEADER = ("Класс", "Фамилия", "Имя", "Username", "Скриншотов", "Первая загрузка", "Последняя загрузка",
+          "Сдал после активации MODO")
+XLSX = openpyxl is not None
+
+# Один запрос: ученики с числом, первой и последней загрузкой (подзапросы по покрывающему
+# индексу screenshots(user_id, created_at)); {where} — фильтр по классам. Без GROUP BY порядок
+# берётся из индекса students(class, last_name, first_name): строки идут из курсора сразу,
+# без сортировки всего отчёта во временном дереве (temp_store=MEMORY держит его в памяти)
+SQL = """
+    SELECT s.class, s.last_name, s.first_name, s.username,
+           (SELECT COUNT(*) FROM screenshots sc WHERE sc.user_id = s.user_id),
+           (SELECT MIN(sc.created_at) FROM screenshots sc WHERE sc.user_id = s.user_id),
+           (SELECT MAX(sc.created_at) FROM screenshots sc WHERE sc.user_id = s.user_id)
+    FROM students s
+    {where}
+    ORDER BY s.class, s.last_name, s.first_name
+"""
+
+
+def _time(epoch):
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, db.TIMEZONE).replace(tzinfo=None)
+
+
+# Строки отчёта по одной прямо из курсора. classes=None — вся школа;
+# since — начало текущей активации MODO (секунды) или None, если MODO не активен
+def rows(conn, classes=None, since=None):
+    if classes is None:
+        cursor = conn.execute(SQL.format(where=""))
+    else:
+        classes = sorted(classes)
+        cursor = conn.execute(SQL.format(where=f"WHERE s.class IN ({', '.join('?' * len(classes))})"), classes)
+    for class_name, last_name, first_name, username, count, first, last in cursor:
+        if since is None:
+            submitted = "—"
+        else:
+            submitted = "Да" if last is not None and last >= since else "Нет"
+        yield class_name, last_name, first_name, username or "", count, _time(first), _time(last), submitted
+
+
+def _write_csv(path: str, lines) -> int:
+    count = 0
+    # utf-8-sig и ";" — чтобы Excel в русской локали открыл файл без мастера импорта
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(HEADER)
+        for line in lines:
+            writer.writerow([value.strftime(db.TIMESTAMP_FORMAT) if isinstance(value, datetime) else value
+                             for value in line])
+            count += 1
+    return count
+
+
+def _write_xlsx(path: str, lines) -> int:
+    # write_only: строки сразу уходят во временный XML, книга не держится в памяти
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Отчёт")
+    sheet.append(HEADER)
+    count = 0
+    for line in lines:
+        sheet.append(line)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+# Запись отчёта в файл (выполняется в потоке пула базы); возвращает число учеников
+def write(conn, path: str, xlsx: bool = False, classes=None, since=None) -> int:
+    if xlsx and openpyxl is None:
+        raise RuntimeError("Для отчёта XLSX нужен openpyxl: pip install openpyxl")
+    lines = rows(conn, classes, since)
+    return _write_xlsx(path, lines) if xlsx else _write_csv(path, lines)
@@ -0,0 +1,171 @@
+import os
+import re
+import csv
+import codecs
+from collections import namedtuple
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl не установлен — импорт только из CSV
+    openpyxl = None
+
+# Допустимые названия столбцов файла со списком учеников
+COLUMNS = {
+    "class": ("класс", "class"),
+    "last_name": ("фамилия", "last_name", "last name", "surname"),
+    "first_name": ("имя", "first_name", "first name", "name"),
+    "username": ("username", "telegram", "логин", "ник"),
+}
+MAX_LENGTH = 64
+# Название класса показывается на кнопках клавиатур
+MAX_CLASS_LENGTH = 20
+USERNAME_RE = re.compile(r"^[A-Za-z0-9_]{5,32}$")
+
+RosterRow = namedtuple("RosterRow", "line class_name last_name first_name username")
+ImportResult = namedtuple("ImportResult", "classes_created created updated unchanged rejected")
+
+
+class RosterError(Exception):
+    pass
+
+
+def _cell(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+# Номера столбцов по строке заголовка
+def _header(cells):
+    names = [_cell(cell).lower() for cell in cells]
+    positions = {}
+    for column, aliases in COLUMNS.items():
+        for i, name in enumerate(names):
+            if name in aliases:
+                positions[column] = i
+                break
+    missing = [COLUMNS[column][0] for column in ("class", "last_name", "first_name") if column not in positions]
+    if missing:
+        raise RosterError(f"В первой строке нет столбцов: {', '.join(missing)}")
+    return positions
+
+
+def _csv_rows(path: str):
+    with open(path, "rb") as f:
+        sample = f.read(4096)
+    encoding = "utf-8-sig"
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample)
+    except UnicodeDecodeError:
+        # Excel в русской локали сохраняет CSV в cp1251
+        encoding = "cp1251"
+    text = sample.decode(encoding, errors="ignore")
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    with open(path, newline="", encoding=encoding, errors="replace") as f:
+        yield from csv.reader(f, dialect)
+
+
+def _xlsx_rows(path: str):
+    if openpyxl is None:
+        raise RosterError("Для импорта XLSX нужен openpyxl: pip install openpyxl")
+    # read_only: строки читаются из файла по одной, книга целиком в память не загружается
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# Потоковый разбор файла: строки проверяются по мере чтения.
+# Возвращает (корректные строки, [(номер строки, причина), ...])
+def parse(path: str, filename: str):
+    rows = _xlsx_rows(path) if filename.lower().endswith(".xlsx") else _csv_rows(path)
+    positions = None
+    valid, rejected = [], []
+    seen = {}
+    for line, cells in enumerate(rows, start=1):
+        if not any(_cell(cell) for cell in cells):
+            continue
+        if positions is None:
+            positions = _header(cells)
+            continue
+        values = {column: _cell(cells[i]) if i < len(cells) else "" for column, i in positions.items()}
+        username = values.get("username", "").lstrip("@")
+        row = RosterRow(line, values["class"], values["last_name"], values["first_name"], username)
+        if not row.class_name or not row.last_name or not row.first_name:
+            rejected.append((line, "не заполнены класс, фамилия или имя"))
+        elif max(len(row.last_name), len(row.first_name)) > MAX_LENGTH or len(row.class_name) > MAX_CLASS_LENGTH:
+            rejected.append((line, "слишком длинное значение"))
+        elif any(char in row.class_name for char in "/\\") or row.class_name.startswith("."):
+            rejected.append((line, f"недопустимое название класса «{row.class_name}»"))
+        elif username and not USERNAME_RE.match(username):
+            rejected.append((line, f"некорректный username «{username}»"))
+        else:
+            key = _key(row)
+            if key in seen:
+                rejected.append((line, f"повтор строки {seen[key]}"))
+                continue
+            seen[key] = line
+            valid.append(row)
+    if positions is None:
+        raise RosterError("Файл пуст")
+    return valid, rejected
+
+
+def _key(row: RosterRow):
+    if row.username:
+        return "@" + row.username.lower()
+    return row.class_name, row.last_name.lower(), row.first_name.lower()
+
+
+# Запись в базу (вызывать внутри транзакции): ученик ищется по username, а без него —
+# по классу, фамилии и имени; новые добавляются, изменившиеся обновляются одним executemany
+def import_rows(conn, rows):
+    existing = {}
+    for student_id, class_name, last_name, first_name, username in conn.execute(
+            "SELECT id, class, last_name, first_name, username FROM students"):
+        current = RosterRow(None, class_name or "", last_name or "", first_name or "", username or "")
+        existing[_key(current)] = (student_id, current)
+        if current.username:
+            existing.setdefault(_key(current._replace(username="")), (student_id, current))
+    inserts, updates = [], []
+    unchanged = 0
+    for row in rows:
+        found = existing.get(_key(row)) or existing.get(_key(row._replace(username="")))
+        if found is None:
+            inserts.append((row.first_name, row.last_name, row.class_name, row.username))
+            continue
+        student_id, current = found
+        same_username = not row.username or row.username.lower() == current.username.lower()
+        if row[1:4] == current[1:4] and same_username:
+            unchanged += 1
+        else:
+            updates.append((row.first_name, row.last_name, row.class_name, row.username or current.username, student_id))
+    classes = sorted({row.class_name for row in rows})
+    before = conn.total_changes
+    conn.executemany("INSERT OR IGNORE INTO classes (name) VALUES (?)", [(name,) for name in classes])
+    classes_created = conn.total_changes - before
+    conn.executemany("INSERT INTO students (first_name, last_name, class, username) VALUES (?, ?, ?, ?)", inserts)
+    conn.executemany("UPDATE students SET first_name = ?, last_name = ?, class = ?, username = ? WHERE id = ?", updates)
+    return classes_created, len(inserts), len(updates), unchanged, classes
+
+
+# Папки photos/<класс> для всех классов из файла
+def make_class_folders(root: str, classes):
+    for name in classes:
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+
+
+def summary(result: ImportResult, limit: int = 10) -> str:
+    lines = ["✅ Импорт завершён.",
+             f"🏫 Новых классов: {result.classes_created}",
+             f"➕ Добавлено учеников: {result.created}",
+             f"✏️ Обновлено: {result.updated}",
+             f"➖ Без изменений: {result.unchanged}",
+             f"⚠️ Отклонено строк: {len(result.rejected)}"]
+    for line, reason in result.rejected[:limit]:
+        lines.append(f"• строка {line}: {reason}")
+    if len(result.rejected) > limit:
+        lines.append(f"• … и ещё {len(result.rejected) - limit}")
+    return "\n".join(lines)
@@ -0,0 +1,38 @@
+import re
+
+# Сколько учеников показывать в результатах поиска
+LIMIT = 20
+# Слова запроса: буквы, цифры и подчёркивание (username); остальное — разделители
+WORD_RE = re.compile(r"\w+")
+MAX_WORDS = 5
+
+
+# Запрос FTS5 из текста пользователя: каждое слово ищется как префикс, все слова обязательны.
+# Слова берутся в кавычки, поэтому операторы FTS5 в тексте не срабатывают
+def fts_query(text: str) -> str:
+    words = WORD_RE.findall(text.lower())[:MAX_WORDS]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# Ученики по убыванию релевантности (bm25): (id, имя, фамилия, класс, username).
+# classes — множество доступных классов или None для всех
+def search(conn, text: str, classes=None, limit: int = LIMIT):
+    query = fts_query(text)
+    if not query:
+        return []
+    sql = '''
+        SELECT s.id, s.first_name, s.last_name, s.class, s.username
+        FROM students_fts
+        JOIN students s ON s.id = students_fts.rowid
+        WHERE students_fts MATCH ?
+    '''
+    params = [query]
+    if classes is not None:
+        if not classes:
+            return []
+        sql += f" AND s.class IN ({', '.join('?' * len(classes))})"
+        params.extend(sorted(classes))
+    # Совпадение в фамилии весит больше, чем в имени или username
+    sql += " ORDER BY bm25(students_fts, 1.0, 2.0, 1.0) LIMIT ?"
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
@@ -0,0 +1,454 @@
+import os
+import sys
+import hmac
+import shutil
+import asyncio
+import hashlib
+import logging
+import argparse
+import posixpath
+import collections
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+
+import httpx
+
+import db
+import images
+
+# Где лежат байты скриншотов: local — на диске этого сервера, s3 — в S3-совместимом хранилище
+# (MinIO, Yandex Object Storage и т.п.), общем для нескольких экземпляров бота
+BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+LOCAL_ROOT = os.environ.get("STORAGE_LOCAL_ROOT", ".")
+S3_ENDPOINT = os.environ.get("S3_ENDPOINT", "")
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY", "")
+S3_SECRET_KEY = os.environ.get("S3_SECRET_KEY", "")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_PREFIX = os.environ.get("S3_PREFIX", "")
+S3_CONNECTIONS = int(os.environ.get("S3_CONNECTIONS", "32"))
+# Сколько ждать хранилище из потока сборки архива, секунды
+THREAD_TIMEOUT = float(os.environ.get("STORAGE_THREAD_TIMEOUT", "120"))
+
+# Сборка архива из S3 заранее скачивает до PREFETCH следующих файлов не больше PREFETCH_SIZE байт
+PREFETCH = int(os.environ.get("STORAGE_PREFETCH", "8"))
+PREFETCH_SIZE = 4 * 1024 * 1024
+
+CHUNK_SIZE = 256 * 1024
+
+
+class StorageError(Exception):
+    pass
+
+
+# Интерфейс хранилища. Ключ — относительный путь через "/" (тот же, что в blobs.path
+# и screenshots.file_path), поэтому записи в базе не зависят от выбранного бэкенда.
+# Все методы асинхронные; stat возвращает (размер, mtime) или None, если объекта нет
+class Storage(ABC):
+    name = "storage"
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes):
+        pass
+
+    # Загрузить локальный файл; move=True — исходный файл после загрузки больше не нужен
+    async def put_file(self, key: str, path: str, move: bool = False):
+        data = await asyncio.to_thread(_read, path)
+        await self.put(key, data)
+        if move:
+            await asyncio.to_thread(os.remove, path)
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        pass
+
+    # Содержимое частями, без чтения объекта целиком в память
+    async def chunks(self, key: str, size: int = CHUNK_SIZE):
+        yield await self.get(key)
+
+    @abstractmethod
+    async def stat(self, key: str):
+        pass
+
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+    # Синхронный доступ для кода, работающего в потоке (сборка архивов)
+    def reader(self, loop=None):
+        return ThreadReader(self, loop or asyncio.get_running_loop())
+
+    async def close(self):
+        pass
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _move(source: str, target: str):
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    try:
+        os.replace(source, target)
+    except OSError:
+        # Другой раздел диска: копия во временный файл и атомарная замена
+        shutil.copyfile(source, f"{target}.tmp")
+        os.replace(f"{target}.tmp", target)
+        os.remove(source)
+
+
+def _stat(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Файлы на локальном диске: ключ — путь относительно root. Вся работа с диском — в потоках
+class LocalStorage(Storage):
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_ROOT):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        if os.path.isabs(key):
+            return key
+        return os.path.join(self.root, *key.split("/"))
+
+    async def put(self, key: str, data: bytes):
+        await asyncio.to_thread(_write, self.path(key), data)
+
+    async def put_file(self, key: str, path: str, move: bool = False):
+        target = self.path(key)
+        if move:
+            await asyncio.to_thread(_move, path, target)
+        else:
+            await asyncio.to_thread(_write, target, await asyncio.to_thread(_read, path))
+
+    async def get(self, key: str) -> bytes:
+        try:
+            return await asyncio.to_thread(_read, self.path(key))
+        except FileNotFoundError:
+            raise StorageError(f"Файл {key} не найден") from None
+
+    async def chunks(self, key: str, size: int = CHUNK_SIZE):
+        try:
+            f = await asyncio.to_thread(open, self.path(key), "rb")
+        except FileNotFoundError:
+            raise StorageError(f"Файл {key} не найден") from None
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
+    async def stat(self, key: str):
+        return await asyncio.to_thread(_stat, self.path(key))
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(_remove, self.path(key))
+
+    # Из потока к диску можно обращаться напрямую, без цикла событий
+    def reader(self, loop=None):
+        return LocalReader(self)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+# Подпись запроса AWS Signature Version 4 (заголовок Authorization, без query-параметров)
+def sign(method: str, host: str, path: str, headers: dict, payload_hash: str, access_key: str, secret_key: str,
+         region: str, now: datetime = None) -> dict:
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    headers = {**headers, "host": host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash}
+    names = sorted(name.lower() for name in headers)
+    values = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+    canonical_headers = "".join(f"{name}:{values[name]}\n" for name in names)
+    signed_headers = ";".join(names)
+    canonical_request = "\n".join([method, path, "", canonical_headers, signed_headers, payload_hash])
+    scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, _sha256(canonical_request.encode("utf-8"))])
+    signing_key = _hmac(_hmac(_hmac(_hmac(f"AWS4{secret_key}".encode("utf-8"), amz_date[:8]), region), "s3"),
+                        "aws4_request")
+    signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    headers["authorization"] = (f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+                                f"SignedHeaders={signed_headers}, Signature={signature}")
+    del headers["host"]
+    return headers
+
+
+# S3-совместимое хранилище через httpx: адресация path-style (<endpoint>/<bucket>/<ключ>),
+# подпись SigV4. Одно соединение на запрос не открывается: клиент с пулом живёт до close()
+class S3Storage(Storage):
+    name = "s3"
+
+    def __init__(self, endpoint: str = S3_ENDPOINT, bucket: str = S3_BUCKET, access_key: str = S3_ACCESS_KEY,
+                 secret_key: str = S3_SECRET_KEY, region: str = S3_REGION, prefix: str = S3_PREFIX,
+                 connections: int = S3_CONNECTIONS):
+        if not endpoint or not bucket:
+            raise StorageError("Для STORAGE_BACKEND=s3 нужны S3_ENDPOINT и S3_BUCKET")
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip("/")
+        self.connections = connections
+        self._host = httpx.URL(self.endpoint).netloc.decode("ascii")
+        self._client = None
+
+    def _path(self, key: str) -> str:
+        key = f"{self.prefix}/{key}" if self.prefix else key
+        return "/" + quote(f"{self.bucket}/{key}", safe="/-_.~")
+
+    def _client_for_loop(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.connections, max_keepalive_connections=self.connections)
+            self._client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0, connect=10.0))
+        return self._client
+
+    def _request(self, method: str, key: str, content: bytes = None, headers: dict = None):
+        path = self._path(key)
+        payload_hash = _sha256(content or b"")
+        signed = sign(method, self._host, path, headers or {}, payload_hash, self.access_key, self.secret_key,
+                      self.region)
+        return self._client_for_loop().build_request(method, self.endpoint + path, content=content, headers=signed)
+
+    async def _send(self, request, stream: bool = False) -> httpx.Response:
+        try:
+            response = await self._client_for_loop().send(request, stream=stream)
+        except httpx.HTTPError as e:
+            raise StorageError(f"S3 {request.method} {request.url.path}: {e}") from e
+        if response.status_code >= 400 and response.status_code != 404:
+            body = (await response.aread())[:200]
+            await response.aclose()
+            raise StorageError(f"S3 {request.method} {request.url.path}: {response.status_code} {body!r}")
+        return response
+
+    async def put(self, key: str, data: bytes):
+        await self._send(self._request("PUT", key, data, {"content-type": "image/jpeg"}))
+
+    async def get(self, key: str) -> bytes:
+        response = await self._send(self._request("GET", key))
+        if response.status_code == 404:
+            raise StorageError(f"Объект {key} не найден")
+        return response.content
+
+    async def chunks(self, key: str, size: int = CHUNK_SIZE):
+        response = await self._send(self._request("GET", key), stream=True)
+        try:
+            if response.status_code == 404:
+                raise StorageError(f"Объект {key} не найден")
+            async for chunk in response.aiter_bytes(size):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def stat(self, key: str):
+        response = await self._send(self._request("HEAD", key))
+        if response.status_code == 404:
+            return None
+        modified = response.headers.get("last-modified")
+        mtime = parsedate_to_datetime(modified).timestamp() if modified else 0.0
+        return int(response.headers.get("content-length", 0)), mtime
+
+    async def delete(self, key: str):
+        await self._send(self._request("DELETE", key))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Доступ к локальному хранилищу из потока: обычные файловые операции
+class LocalReader:
+    def __init__(self, storage: LocalStorage):
+        self.storage = storage
+
+    def stat(self, key: str):
+        return _stat(self.storage.path(key))
+
+    def stats(self, keys):
+        return [self.stat(key) for key in keys]
+
+    def prefetch(self, items):
+        pass
+
+    def copy(self, key: str, target):
+        with open(self.storage.path(key), "rb") as f:
+            shutil.copyfileobj(f, target, CHUNK_SIZE)
+
+    def close(self):
+        pass
+
+
+async def _stats(storage: Storage, keys):
+    return await asyncio.gather(*(storage.stat(key) for key in keys))
+
+
+async def _next(chunks):
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+# Доступ к асинхронному хранилищу из потока: корутины выполняются в цикле событий бота,
+# поток ждёт результат. Содержимое копируется частями по мере получения; небольшие файлы,
+# объявленные через prefetch, скачиваются заранее (не больше PREFETCH одновременно),
+# чтобы задержки сети не складывались при последовательной записи архива
+class ThreadReader:
+    def __init__(self, storage: Storage, loop):
+        self.storage = storage
+        self.loop = loop
+        self._queue = collections.deque()
+        self._ahead = {}
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(THREAD_TIMEOUT)
+
+    def stat(self, key: str):
+        return self._call(self.storage.stat(key))
+
+    # Несколько запросов сразу: у S3 они идут параллельно, ожидание сети не складывается
+    def stats(self, keys):
+        return self._call(_stats(self.storage, keys))
+
+    # Файлы, которые будут скопированы следующими, в порядке копирования: пары (ключ, размер)
+    def prefetch(self, items):
+        self._queue.extend(key for key, size in items if size <= PREFETCH_SIZE)
+        self._fill()
+
+    def _fill(self):
+        while self._queue and len(self._ahead) < PREFETCH:
+            key = self._queue.popleft()
+            if key not in self._ahead:
+                self._ahead[key] = asyncio.run_coroutine_threadsafe(self.storage.get(key), self.loop)
+
+    def copy(self, key: str, target):
+        future = self._ahead.pop(key, None)
+        self._fill()
+        if future is not None:
+            target.write(future.result(THREAD_TIMEOUT))
+            return
+        chunks = self.storage.chunks(key)
+        try:
+            while True:
+                chunk = self._call(_next(chunks))
+                if chunk is None:
+                    break
+                target.write(chunk)
+        finally:
+            self._call(chunks.aclose())
+
+    # Отмена скачиваний, которые больше не понадобятся
+    def close(self):
+        self._queue.clear()
+        for future in self._ahead.values():
+            future.cancel()
+        self._ahead.clear()
+
+
+def from_env() -> Storage:
+    if BACKEND == "local":
+        return LocalStorage()
+    if BACKEND == "s3":
+        return S3Storage()
+    raise StorageError(f"Неизвестный STORAGE_BACKEND={BACKEND!r} (local или s3)")
+
+
+# Ключи всех файлов скриншотов, на которые ссылается база, со сжатыми копиями и миниатюрами
+def referenced_keys(conn):
+    keys = set()
+    for (path,) in conn.execute('''
+        SELECT COALESCE(b.path, sc.file_path) FROM screenshots sc LEFT JOIN blobs b ON b.id = sc.blob_id
+    '''):
+        if path:
+            path = posixpath.normpath(path.replace(os.sep, "/"))
+            keys.update((path, images.compressed_path(path), images.thumbnail_path(path)))
+    return sorted(keys)
+
+
+# Перенос файлов с локального диска в другое хранилище (например, при переезде на S3):
+# копируются отсутствующие в target объекты, параллельно не больше workers
+async def sync(keys, source: LocalStorage, target: Storage, workers: int = 16):
+    copied = skipped = missing = 0
+    semaphore = asyncio.Semaphore(workers)
+
+    async def copy(key):
+        nonlocal copied, skipped, missing
+        async with semaphore:
+            if await source.stat(key) is None:
+                missing += 1
+            elif await target.exists(key):
+                skipped += 1
+            else:
+                await target.put_file(key, source.path(key))
+                copied += 1
+
+    await asyncio.gather(*(copy(key) for key in keys))
+    return copied, skipped, missing
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Перенос скриншотов с диска в хранилище STORAGE_BACKEND")
+    parser.add_argument("command", choices=["sync"])
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--root", default=LOCAL_ROOT, help="каталог, относительно которого заданы пути в базе")
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        sys.exit(f"База данных {args.db} не найдена")
+    target = from_env()
+    if isinstance(target, LocalStorage):
+        sys.exit("Укажите STORAGE_BACKEND=s3 и параметры S3_* для переноса")
+    conn = db.connect(args.db)
+    keys = referenced_keys(conn)
+    conn.close()
+
+    async def run():
+        try:
+            return await sync(keys, LocalStorage(args.root), target, args.workers)
+        finally:
+            await target.close()
+
+    copied, skipped, missing = asyncio.run(run())
+    print(f"Ключей: {len(keys)}, скопировано: {copied}, уже были: {skipped}, нет на диске: {missing}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько апдейтов обрабатывается одновременно (1 — строго по очереди, как раньше)
+CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "16"))
+
+
+# Параллельная обработка апдейтов разных пользователей. Апдейты одного пользователя
+# (а без пользователя — одного чата) выполняются строго по порядку поступления,
+# поэтому шаги ConversationHandler не перемешиваются и не обгоняют друг друга.
+# Слот общего лимита берётся только когда апдейт начинает выполняться: апдейты,
+# ждущие своей очереди за предыдущими апдейтами того же пользователя (альбом,
+# повторные нажатия во время сборки архива), не занимают слоты других чатов.
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = CONCURRENCY):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должен быть положительным")
+        # Семафор базового класса держится и во время ожидания очереди пользователя,
+        # поэтому ограничивает только число апдейтов в работе; лимит — в self._slots.
+        # При 1 Application обрабатывает апдейты без задач, по одному, как раньше
+        super().__init__(1 if max_concurrent_updates == 1 else sys.maxsize)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = {}
+
+    @staticmethod
+    def key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return "user", update.effective_user.id
+            if update.effective_chat is not None:
+                return "chat", update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        key = self.key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    await coroutine
+        finally:
+            # Замок удаляется, когда у пользователя не осталось апдейтов в обработке
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass